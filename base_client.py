@@ -2,15 +2,21 @@
 
 from __future__ import absolute_import
 
+import contextlib
 import logging
 import uuid
+from concurrent import futures
 
 from pyVmomi import vim, vmodl
 
-from .session import VcenterSession
+from .session import VcenterSession, leased_methods, unleased
 from .tools import version_utils as v_utils
 from .tools import vm
 from .tools import constants
+from .tools import placement_utils
+from .tools import property_utils
+from .tools import task_utils
+from .tools.result_utils import DataResult
 
 
 LOG = logging.getLogger(__name__)
@@ -19,6 +25,7 @@ LOG = logging.getLogger(__name__)
 # sys.setdefaultencoding('utf-8')
 
 
+@leased_methods
 class BaseClient(VcenterSession):
     """
     VMware Base Client.
@@ -26,6 +33,17 @@ class BaseClient(VcenterSession):
 
     def __init__(self, vc_info):
         super(BaseClient, self).__init__(vc_info)
+        # How get_mor_by_moid finds a managed object:
+        # 'direct' builds the reference from the moid, 'scan' walks the
+        # whole inventory.
+        self.mor_lookup_mode = constants.MOR_LOOKUP_DIRECT
+        # Check the managed object exists when it is built from the moid.
+        self.mor_lookup_verify = True
+        # Build vm info from one PropertyCollector prefetch instead of
+        # lazy attribute reads.
+        self.vm_info_prefetch = True
+        # Objects per RetrievePropertiesEx page of get_vms.
+        self.vm_page_size = constants.VM_PAGE_SIZE
         self._check_min_version()
 
     def _check_min_version(self):
@@ -56,13 +74,39 @@ class BaseClient(VcenterSession):
         *  vim.VirtualApp
         *  vim.VirtualMachine
         """
-        container = self.si.content.viewManager.CreateContainerView(
+        container = self.content.viewManager.CreateContainerView(
             vimfolder, vimtype, True)
         mors = container.view
         container.Destroy()
         return mors
 
-    def get_mor_by_moid(self, vimtype, moid):
+    def _make_mor(self, vimtype, moid):
+        """
+        Build a managed object reference from the moid without any server
+        round trip. The moid prefix is used to pick the concrete type when
+        it is a subtype of the requested one (e.g. dvportgroup of Network).
+        """
+        mor_type = vimtype[0] if isinstance(vimtype, (list, tuple)) else vimtype
+        for prefix, prefix_type in constants.MOID_PREFIX_TYPES:
+            if moid.startswith(prefix):
+                if issubclass(prefix_type, mor_type):
+                    mor_type = prefix_type
+                break
+        return mor_type(moid, self.si._stub)
+
+    def _scan_mor_by_moid(self, vimtype, moid):
+        """
+        Find managed object reference by scanning the whole inventory.
+        """
+        mors = self.get_mors(self.content.rootFolder, vimtype)
+        mor = None
+        for o in mors:
+            if o._moId == moid:
+                mor = o
+                break
+        return mor
+
+    def get_mor_by_moid(self, vimtype, moid, verify=None):
         """
         Return managed object reference.
 
@@ -81,16 +125,92 @@ class BaseClient(VcenterSession):
         *  vim.VirtualMachine
 
         @param moid: managed object id (str)
+        @param verify: check the managed object exists, default
+                       self.mor_lookup_verify
         """
-        mors = self.get_mors(self.si.content.rootFolder, vimtype)
-        mor = None
-        if moid:
-            for o in mors:
-                if o._moId == moid:
-                    mor = o
-                    break
+        if not moid:
+            return None
+        if self.mor_lookup_mode == constants.MOR_LOOKUP_SCAN:
+            return self._scan_mor_by_moid(vimtype, moid)
+
+        mor = self._make_mor(vimtype, moid)
+        if verify is None:
+            verify = self.mor_lookup_verify
+        if verify:
+            try:
+                # one retrieval of no property instead of an inventory
+                # scan, not every type has a name (Task, Snapshot, ...)
+                if not property_utils.object_exists(
+                        self.content.propertyCollector, mor):
+                    mor = None
+            except vmodl.MethodFault as ex:
+                LOG.debug("Lookup %s by moid failed (%s), fall back to "
+                          "inventory scan.", moid, str(ex))
+                mor = self._scan_mor_by_moid(vimtype, moid)
         return mor
 
+    def iter_property_pages(self, vimtype, path_set, container=None,
+                            page_size=None):
+        """
+        Yield pages (lists) of property dicts of all objects of vimtype in
+        the container, as RetrievePropertiesEx/ContinueRetrievePropertiesEx
+        return them.
+
+        @param vimtype: [vim.VirtualMachine]
+        @param path_set: ['name', 'summary.runtime.powerState']
+        @param container: vim.Folder/vim.Datacenter/vim.ComputeResource/
+                          vim.ResourcePool/vim.HostSystem, default rootFolder
+        @param page_size: the maximum number of objects per page
+        @return: [{'mor': <mor>, 'moid': 'vm-1', 'name': 'vm01', ...}]
+        """
+        content = self.content
+        if container is None:
+            container = content.rootFolder
+        if not isinstance(vimtype, (list, tuple)):
+            vimtype = [vimtype]
+        view_mor = content.viewManager.CreateContainerView(
+            container, vimtype, True)
+        try:
+            filter_spec = property_utils.make_container_filter_spec(
+                view_mor, vimtype, path_set)
+            for objects in property_utils.iter_retrieve_pages(
+                    content.propertyCollector, filter_spec, page_size):
+                yield [property_utils.object_content_to_dict(obj_content,
+                                                             path_set)
+                       for obj_content in objects]
+        finally:
+            view_mor.Destroy()
+
+    def iter_properties(self, vimtype, path_set, container=None,
+                        page_size=None):
+        """
+        Yield property dicts of all objects of vimtype in the container.
+
+        All requested properties of all objects are fetched with paged
+        RetrievePropertiesEx calls on a ContainerView.
+        """
+        for page in self.iter_property_pages(vimtype, path_set,
+                                             container=container,
+                                             page_size=page_size):
+            for props in page:
+                yield props
+
+    def retrieve_properties(self, vimtype, path_set, container=None,
+                            page_size=None):
+        """
+        Return property dicts of all objects of vimtype in the container.
+        """
+        return list(self.iter_properties(vimtype, path_set,
+                                         container=container,
+                                         page_size=page_size))
+
+    def retrieve_mors_properties(self, mors, path_set):
+        """
+        Return {moid: property dict} of the given managed objects.
+        """
+        return property_utils.retrieve_objects_properties(
+            self.content.propertyCollector, mors, path_set)
+
     def get_mors_by_name(self, vimtype, name):
         """
         Return managed object reference.
@@ -111,12 +231,74 @@ class BaseClient(VcenterSession):
 
         @param name: managed object name (str)
         """
-        mors = self.get_mors(self.si.content.rootFolder, vimtype)
         mor_list = []
         if name:
-            mor_list = [mor for mor in mors if mor.name == name]
+            mor_list = [props['mor'] for props in
+                        self.iter_properties(vimtype, ['name'])
+                        if props['name'] == name]
         return mor_list
 
+    def _get_container_mor(self, dc_moid=None, c_moid=None, h_moid=None):
+        """
+        Get the narrowest inventory container, default rootFolder.
+        """
+        if h_moid:
+            container = self.get_host_mor(h_moid)
+        elif c_moid:
+            container = self.get_cluster_mor(c_moid)
+        elif dc_moid:
+            container = self.get_datacenter_mor(dc_moid)
+        else:
+            return self.content.rootFolder
+        if container is None:
+            raise Exception("Not found container: %s" %
+                            (h_moid or c_moid or dc_moid))
+        return container
+
+    def get_mors_datacenters(self, mors):
+        """
+        Return {moid: vim.Datacenter} of the given managed entities.
+
+        The inventory is walked up one level per call for all entities at
+        once, so the number of calls is the folder depth, not the number
+        of entities. Entities not found are left out.
+        """
+        # moid -> the next managed object up the inventory, None at the top
+        next_mors = {}
+        vm_mors = [m for m in mors if isinstance(m, vim.VirtualMachine)]
+        if vm_mors:
+            vms_props = self.retrieve_mors_properties(
+                vm_mors, ['parent', 'resourcePool'])
+            for vm_mor in vm_mors:
+                props = vms_props.get(vm_mor._moId, {})
+                # the parent of a vApp VM is unset, go by its vApp
+                next_mors[vm_mor._moId] = props.get('parent') or \
+                    props.get('resourcePool')
+
+        walks = dict((m._moId, m) for m in mors)
+        datacenters = {}
+        while walks:
+            unknown = {}
+            for moid, mor in list(walks.items()):
+                while mor is not None and \
+                        not isinstance(mor, vim.Datacenter) and \
+                        mor._moId in next_mors:
+                    mor = next_mors[mor._moId]
+                if mor is None:
+                    del walks[moid]
+                elif isinstance(mor, vim.Datacenter):
+                    datacenters[moid] = mor
+                    del walks[moid]
+                else:
+                    walks[moid] = mor
+                    unknown[mor._moId] = mor
+            if unknown:
+                objects = self.retrieve_mors_properties(
+                    list(unknown.values()), ['parent'])
+                for moid in unknown:
+                    next_mors[moid] = objects.get(moid, {}).get('parent')
+        return datacenters
+
     def get_datacenters(self):
         pass
 
@@ -142,7 +324,24 @@ class BaseClient(VcenterSession):
         return self.get_mor_by_moid([vim.ResourcePool], r_moid)
 
     def get_hosts(self, dc_moid=None, c_moid=None):
-        pass
+        """
+        Get hosts of the datacenter or cluster.
+        """
+        container = self._get_container_mor(dc_moid=dc_moid, c_moid=c_moid)
+        hosts = []
+        for props in self.iter_properties([vim.HostSystem],
+                                          constants.HOST_LIST_PROPERTIES,
+                                          container=container):
+            parent = props['parent']
+            hosts.append({
+                "name": props['name'],
+                "moid": props['moid'],
+                "parent_moid": parent._moId if parent else None,
+                "connectionState": props['runtime.connectionState'],
+                "powerState": props['runtime.powerState'],
+                "inMaintenanceMode": props['runtime.inMaintenanceMode'],
+            })
+        return hosts
 
     def get_host_info(self, h_moid):
         pass
@@ -154,7 +353,24 @@ class BaseClient(VcenterSession):
         pass
 
     def get_datastores(self, dc_moid=None):
-        pass
+        """
+        Get datastores of the datacenter.
+        """
+        container = self._get_container_mor(dc_moid=dc_moid)
+        datastores = []
+        for props in self.iter_properties(vim.Datastore,
+                                          constants.DATASTORE_LIST_PROPERTIES,
+                                          container=container):
+            datastores.append({
+                "name": props['name'],
+                "moid": props['moid'],
+                "type": props['summary.type'],
+                "url": props['summary.url'],
+                "capacity": props['summary.capacity'],
+                "freeSpace": props['summary.freeSpace'],
+                "accessible": props['summary.accessible'],
+            })
+        return datastores
 
     def get_datastore_info(self, ds_moid):
         pass
@@ -162,6 +378,52 @@ class BaseClient(VcenterSession):
     def get_datastore_mor(self, ds_moid):
         return self.get_mor_by_moid([vim.Datastore], ds_moid)
 
+    def _fetch_placement_state(self, scope):
+        """
+        Fetch the host and datastore states of a placement scope
+        (dc_moid, cluster_moid) in two PropertyCollector calls.
+        """
+        dc_moid, c_moid = scope
+        container = self._get_container_mor(dc_moid=dc_moid, c_moid=c_moid)
+        hosts = []
+        ds_mors = {}
+        for props in self.iter_properties([vim.HostSystem],
+                                          constants.PLACEMENT_HOST_PROPERTIES,
+                                          container=container):
+            parent = props['parent']
+            host_ds_mors = props['datastore'] or []
+            for ds_mor in host_ds_mors:
+                ds_mors[ds_mor._moId] = ds_mor
+            hosts.append({
+                "moid": props['moid'],
+                "name": props['name'],
+                "parent_moid": parent._moId if parent else None,
+                "cpu_capacity_mhz": (props['summary.hardware.cpuMhz'] or 0) *
+                (props['summary.hardware.numCpuCores'] or 0),
+                "cpu_usage_mhz": props['summary.quickStats.overallCpuUsage'] or 0,
+                "memory_mb": (props['summary.hardware.memorySize'] or 0) //
+                placement_utils.MB,
+                "memory_usage_mb":
+                props['summary.quickStats.overallMemoryUsage'] or 0,
+                "datastores": [ds_mor._moId for ds_mor in host_ds_mors],
+                "available": props['runtime.connectionState'] == 'connected'
+                and not props['runtime.inMaintenanceMode'],
+            })
+        datastores = []
+        if ds_mors:
+            objects = self.retrieve_mors_properties(
+                list(ds_mors.values()), constants.PLACEMENT_DATASTORE_PROPERTIES)
+            for props in objects.values():
+                datastores.append({
+                    "moid": props['moid'],
+                    "name": props['name'],
+                    "capacity": props['summary.capacity'] or 0,
+                    "freeSpace": props['summary.freeSpace'] or 0,
+                    "available": bool(props['summary.accessible']) and
+                    props['summary.maintenanceMode'] in (None, 'normal'),
+                })
+        return hosts, datastores
+
     def get_dvswitchs(self, dc_moid=None):
         pass
 
@@ -198,19 +460,86 @@ class BaseClient(VcenterSession):
     def get_vm_template_mor(self, vm_moid):
         return self.get_mor_by_moid([vim.VirtualMachine], vm_moid)
 
-    def get_vms(self, dc_moid, c_moid, h_moid):
-        pass
+    def get_vms(self, dc_moid=None, c_moid=None, h_moid=None,
+                page_size=None):
+        """
+        Yield vm_info_json records of the VMs (not templates) of the
+        datacenter, cluster or host.
+
+        The VMs are paged through RetrievePropertiesEx with page_size
+        objects per call (default self.vm_page_size) and each page is
+        yielded as it arrives, so memory use does not grow with the
+        number of VMs.
+        """
+        container = self._get_container_mor(dc_moid=dc_moid, c_moid=c_moid,
+                                            h_moid=h_moid)
+        mor_names = {}
+        for page in self.iter_property_pages(
+                [vim.VirtualMachine], vm.VM_INFO_PROPERTIES,
+                container=container,
+                page_size=page_size or self.vm_page_size):
+            # resolve the names of hosts/datastores first seen in this page
+            ref_mors = {}
+            for props in page:
+                for mor in vm.get_vm_referenced_mors(props):
+                    if mor._moId not in mor_names:
+                        ref_mors[mor._moId] = mor
+            mor_names.update(self.get_mors_names(list(ref_mors.values())))
+            for props in page:
+                summary = props['summary']
+                if summary and summary.config and summary.config.template:
+                    continue
+                vm_info = vm.vm_info_json(vm.PrefetchedVM(props, mor_names))
+                if vm_info:
+                    yield vm_info
+
+    def get_mors_names(self, mors):
+        """
+        Return {moid: name} of the given managed objects in one call.
+        """
+        if not mors:
+            return {}
+        objects = self.retrieve_mors_properties(mors, ['name'])
+        return dict((moid, props['name']) for moid, props in objects.items())
+
+    def prefetch_vms(self, vm_mors, path_set=vm.VM_INFO_PROPERTIES):
+        """
+        Return {moid: vm.PrefetchedVM} of the given VMs.
+
+        The vm properties are fetched in one PropertyCollector call and
+        the names of the referenced hosts/datastores in another one.
+        Not existing VMs are left out.
+        """
+        objects = self.retrieve_mors_properties(vm_mors, path_set)
+        ref_mors = {}
+        for props in objects.values():
+            for mor in vm.get_vm_referenced_mors(props):
+                ref_mors[mor._moId] = mor
+        mor_names = self.get_mors_names(list(ref_mors.values()))
+        return dict((moid, vm.PrefetchedVM(props, mor_names))
+                    for moid, props in objects.items())
+
+    def _get_vm_info_mor(self, vm_moid, path_set):
+        """
+        Get the vm object the info builders read from.
+        """
+        if not self.vm_info_prefetch:
+            return self.get_vm_mor(vm_moid)
+        if not vm_moid:
+            return None
+        vm_mor = self._make_mor([vim.VirtualMachine], vm_moid)
+        return self.prefetch_vms([vm_mor], path_set).get(vm_moid)
 
     def get_vm_info(self, vm_moid):
-        vm_mor = self.get_vm_mor(vm_moid)
+        vm_mor = self._get_vm_info_mor(vm_moid, vm.VM_INFO_PROPERTIES)
         return vm.vm_info_json(vm_mor)
 
     def get_vm_guest_info(self, vm_moid):
-        vm_mor = self.get_vm_mor(vm_moid)
+        vm_mor = self._get_vm_info_mor(vm_moid, vm.VM_GUEST_INFO_PROPERTIES)
         return vm.vm_guest_info_json(vm_mor)
 
     def get_vm_guest_net_info(self, vm_moid):
-        vm_mor = self.get_vm_mor(vm_moid)
+        vm_mor = self._get_vm_info_mor(vm_moid, vm.VM_GUEST_INFO_PROPERTIES)
         return vm.vm_guest_net_info_json(vm_mor)
 
     def get_vm_mor(self, vm_moid):
@@ -258,23 +587,142 @@ class BaseClient(VcenterSession):
     def get_tasks(self, managed_entity):
         pass
 
+    def _get_tasks_info(self, task_mors):
+        """
+        Return {task key: task info json} of the given tasks.
+        """
+        tasks_info = task_utils.get_tasks_info(self.content.propertyCollector,
+                                               task_mors)
+        return dict((key, task_utils.task_info_json(info))
+                    for key, info in tasks_info.items())
+
     def get_recent_tasks(self, moid=None):
-        pass
+        """
+        Get the recent tasks of the managed entity, default all recent
+        tasks of this session's task manager.
+        """
+        if moid:
+            entity_mor = self._make_mor(vim.ManagedEntity, moid)
+            props = self.retrieve_mors_properties([entity_mor],
+                                                  ['recentTask'])
+            if moid not in props:
+                raise Exception("Not found managed entity: %s" % moid)
+            task_mors = props[moid]['recentTask'] or []
+        else:
+            task_mors = self.content.taskManager.recentTask
+        if not task_mors:
+            return []
+        tasks_info = self._get_tasks_info(list(task_mors))
+        return [tasks_info[mor._moId] for mor in task_mors]
+
+    def get_tasks_info(self, task_keys):
+        """
+        Get the info json of many tasks in one call.
+        """
+        return self._get_tasks_info([self.get_task_mor(key)
+                                     for key in task_keys])
 
     def get_task_info(self, task_key, moid=None):
-        pass
+        return self._get_tasks_info([self.get_task_mor(task_key)])[task_key]
 
     def get_task_mor(self, task_key, moid=None):
-        pass
+        return self._make_mor([vim.Task], task_key)
+
+    def _get_task_property(self, task_key, path):
+        task_mor = self.get_task_mor(task_key)
+        props = self.retrieve_mors_properties([task_mor], [path])
+        if task_key not in props:
+            raise Exception("Not found task: %s" % task_key)
+        return props[task_key][path]
 
     def get_task_result_mor(self, task_key, moid=None):
-        pass
+        result = self._get_task_property(task_key, 'info.result')
+        if isinstance(result, vim.ManagedObject):
+            return result
+        return None
 
     def get_task_entity_mor(self, task_key, moid=None):
-        pass
+        return self._get_task_property(task_key, 'info.entity')
 
     def cancel_task(self, task_key, moid=None):
-        pass
+        """
+        Cancel a running task.
+        """
+        result = DataResult()
+        try:
+            task_mor = self.get_task_mor(task_key)
+            task_mor.CancelTask()
+            result.task_key = task_key
+        except Exception as ex:
+            LOG.exception(ex)
+            result.status = False
+            result.message = "Cancel task error: %s" % str(ex)
+        return result
+
+    @unleased
+    @contextlib.contextmanager
+    def get_task_tracker(self):
+        """
+        Context manager of a task_utils.TaskTracker, the connection it is
+        bound to stays leased until the tracker is closed:
+
+            with client.get_task_tracker() as tracker:
+                tracker.track(task_keys)
+        """
+        with self.lease():
+            with task_utils.TaskTracker(self.si) as tracker:
+                yield tracker
+
+    def wait_for_tasks(self, task_keys, timeout=None):
+        """
+        Yield task info json of the tasks as they finish.
+
+        All tasks are watched through one PropertyCollector filter and
+        WaitForUpdatesEx, however many there are.
+        """
+        for task_info in task_utils.wait_for_tasks(self.si, task_keys,
+                                                   timeout):
+            yield task_utils.task_info_json(task_info)
+
+    def _run_concurrently(self, func, items, concurrency=None):
+        """
+        Run func(item) for every item on up to concurrency threads, each
+        call with its own leased connection. Return the results in order.
+
+        The caller must not hold a lease itself (see session.unleased),
+        or a pool of one connection would deadlock. The connection pool
+        overflows to concurrency connections, at most vc_info.max_pool_size,
+        while the batch runs; the threads beyond wait for a connection.
+        """
+        def _run(item):
+            with self.lease():
+                return func(item)
+
+        concurrency = concurrency or constants.BATCH_CONCURRENCY
+        with self._pool.overflow(concurrency):
+            executor = futures.ThreadPoolExecutor(max_workers=concurrency)
+            try:
+                return list(executor.map(_run, items))
+            finally:
+                executor.shutdown()
+
+    def _wait_task_results(self, results, timeout=None):
+        """
+        Wait for the tasks of {moid: DataResult}, a failed task fails its
+        DataResult.
+        """
+        task_results = dict((r.task_key, r) for r in results.values()
+                            if r.status and r.task_key)
+        if not task_results:
+            return
+        with self.lease():
+            for task_info in task_utils.wait_for_tasks(
+                    self.si, list(task_results.keys()), timeout):
+                info = task_utils.task_info_json(task_info)
+                result = task_results[info['key']]
+                if info['state'] == 'error':
+                    result.status = False
+                    result.message = info['error']
 
     def get_events(self, moid=None):
         pass
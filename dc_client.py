@@ -8,6 +8,7 @@ import uuid
 from pyVmomi import vim, vmodl
 
 from .base_client import BaseClient
+from .session import leased_methods
 from .tools import constants
 from .tools.result_utils import DataResult
 
@@ -15,6 +16,7 @@ from .tools.result_utils import DataResult
 LOG = logging.getLogger(__name__)
 
 
+@leased_methods
 class DatacenterClient(BaseClient):
     """
     VMware Manager Datacenter Client.
@@ -2,18 +2,25 @@
 
 from __future__ import absolute_import
 
+import functools
 import logging
 import uuid
 
 from pyVmomi import vim, vmodl
 
 from .base_client import BaseClient
+from .session import leased_methods
 from .tools import constants
+from .tools import datastore_utils
+from .tools import scheduler_utils
+from .tools import task_utils
+from .tools.result_utils import DataResult
 
 
 LOG = logging.getLogger(__name__)
 
 
+@leased_methods
 class DatastoreClient(BaseClient):
     """
     VMware Manager Datastore Client.
@@ -28,3 +35,197 @@ class DatastoreClient(BaseClient):
     def destroy_datastore(self, ds_name):
         pass
 
+    def _search_datastores(self, ds_moids, patterns=None, folder=None,
+                           max_running=None, timeout=None):
+        """
+        Search many datastores at once, yield (ds_moid, records, error) as
+        their searches finish; records is a generator, see
+        datastore_utils.iter_search_records.
+        """
+        ds_mors = [self._make_mor([vim.Datastore], ds_moid)
+                   for ds_moid in ds_moids]
+        ds_props = self.retrieve_mors_properties(
+            ds_mors, constants.DATASTORE_SEARCH_PROPERTIES)
+        search_spec = datastore_utils.make_search_spec(patterns)
+        max_running = max_running or constants.DATASTORE_SEARCH_MAX_RUNNING
+        with self.get_task_tracker() as tracker:
+            scheduler = scheduler_utils.TaskScheduler(tracker,
+                                                      max_running=max_running)
+            for ds_moid in ds_moids:
+                props = ds_props.get(ds_moid)
+                if not props:
+                    yield ds_moid, None, "Not found datastore: %s" % ds_moid
+                    continue
+                if not props['summary.accessible'] or not props['browser']:
+                    yield ds_moid, None, \
+                        "Datastore %s is not accessible." % props['name']
+                    continue
+                scheduler.submit(
+                    ds_moid,
+                    functools.partial(
+                        props['browser'].SearchDatastoreSubFolders_Task,
+                        datastore_utils.datastore_path(props['name'], folder),
+                        search_spec))
+
+            for ds_moid, task_info, error in scheduler.run(timeout):
+                if task_info is not None:
+                    info = task_utils.task_info_json(task_info)
+                    error = info['error']
+                if error:
+                    yield ds_moid, None, error
+                    continue
+                yield ds_moid, datastore_utils.iter_search_records(
+                    ds_moid, ds_props[ds_moid]['name'],
+                    task_info.result), None
+
+    def iter_datastore_files(self, ds_moids, patterns=None, folder=None,
+                             max_running=None, timeout=None):
+        """
+        Yield the file records of many datastores, see
+        datastore_utils.iter_search_records.
+
+        The datastores are searched at once, each with one
+        SearchDatastoreSubFolders_Task, and the records of a datastore are
+        yielded as soon as its search finishes.
+        @param patterns: ['*.vmdk'], the file name patterns, None for all
+        @param folder: the folder to search on every datastore, None for
+                       the whole datastore
+        @param max_running: running searches, default
+                            constants.DATASTORE_SEARCH_MAX_RUNNING
+        @param timeout: secs to wait for all searches
+        Raises after the last record when some datastore failed.
+        """
+        errors = []
+        for ds_moid, records, error in self._search_datastores(
+                ds_moids, patterns, folder, max_running, timeout):
+            if error:
+                LOG.error("Search datastore %s error: %s", ds_moid, error)
+                errors.append("%s: %s" % (ds_moid, error))
+                continue
+            for record in records:
+                yield record
+        if errors:
+            raise Exception("Search datastore error: %s" % "; ".join(errors))
+
+    def _get_datastore_vm_files(self, ds_moids):
+        """
+        {ds_moid: (vm file paths, unverified path prefixes)} of the VMs
+        and templates with files on every datastore (its datastore.vm),
+        from their layoutEx, in two property retrievals.
+
+        A VM whose layoutEx is not known (e.g. an inaccessible VM) may own
+        the whole folder of its vmx, or any file of a datastore its vmx is
+        not on; those paths are unverified.
+        """
+        ds_props = self.retrieve_mors_properties(
+            [self._make_mor([vim.Datastore], ds_moid) for ds_moid in ds_moids],
+            ['name', 'vm'])
+        vm_mors = {}
+        for props in ds_props.values():
+            for vm_mor in props['vm'] or []:
+                vm_mors[vm_mor._moId] = vm_mor
+        vms_props = self.retrieve_mors_properties(
+            list(vm_mors.values()),
+            ['layoutEx.file', 'config.files.vmPathName'])
+        ds_files = {}
+        for ds_moid, props in ds_props.items():
+            vm_files = set()
+            prefixes = set()
+            ds_root = datastore_utils.datastore_path(props['name'])
+            for vm_mor in props['vm'] or []:
+                vm_props = vms_props.get(vm_mor._moId)
+                if vm_props and vm_props['layoutEx.file']:
+                    vm_files.update(file_info.name for file_info
+                                    in vm_props['layoutEx.file'])
+                    continue
+                home = datastore_utils.vm_home_folder(
+                    vm_props['config.files.vmPathName'] if vm_props
+                    else None)
+                if home is None or not home.startswith(ds_root):
+                    home = ds_root
+                prefixes.add(home)
+            ds_files[ds_moid] = (vm_files, prefixes)
+        return ds_files
+
+    def find_orphaned_files(self, ds_moids, patterns=('*.vmdk',),
+                            max_running=None, timeout=None):
+        """
+        Find the files of datastores which belong to no VM or template.
+
+        The files of a datastore are checked against the layoutEx file
+        lists of the VMs with files on it (datastore.vm). The files which
+        may belong to a VM whose layoutEx is not known (e.g. an
+        inaccessible VM) are never orphans, they are returned as
+        unverified: the whole folder of its vmx, or the whole datastore if
+        its vmx is on another one.
+        @param patterns: the file name patterns to check, None for all
+        @return: DataResult, data: {"orphans": [record], "size": bytes,
+                 "unverified": [record], "errors": {ds_moid: message}}
+        """
+        result = DataResult()
+        orphans = []
+        unverified = []
+        errors = {}
+        try:
+            ds_files = self._get_datastore_vm_files(ds_moids)
+            for ds_moid, records, error in self._search_datastores(
+                    ds_moids, patterns, None, max_running, timeout):
+                if error:
+                    errors[ds_moid] = error
+                    continue
+                vm_files, prefixes = ds_files.get(ds_moid, (set(), set()))
+                ds_orphans, ds_unverified = datastore_utils.classify_records(
+                    records, vm_files, prefixes)
+                orphans.extend(ds_orphans)
+                unverified.extend(ds_unverified)
+        except Exception as ex:
+            LOG.exception(ex)
+            result.status = False
+            result.message = "Find orphaned files error: %s" % str(ex)
+            return result
+        result.data = {
+            "orphans": orphans,
+            "size": sum(record['size'] or 0 for record in orphans),
+            "unverified": unverified,
+            "errors": errors,
+        }
+        if errors:
+            result.status = False
+            result.message = "Search datastore error: %s" % "; ".join(
+                "%s: %s" % item for item in errors.items())
+        return result
+
+    def get_datastore_folder_usage(self, ds_moids, max_running=None,
+                                   timeout=None):
+        """
+        Sum the size of the files directly in every folder of datastores.
+
+        @return: DataResult, data: {"usage": {ds_moid: {folder: bytes}},
+                 "errors": {ds_moid: message}},
+                 folder: "[datastore1] vm"
+        """
+        result = DataResult()
+        usage = {}
+        errors = {}
+        try:
+            for ds_moid, records, error in self._search_datastores(
+                    ds_moids, None, None, max_running, timeout):
+                if error:
+                    errors[ds_moid] = error
+                    continue
+                folders = usage[ds_moid] = {}
+                for record in records:
+                    folders[record['folder']] = folders.get(
+                        record['folder'], 0) + (record['size'] or 0)
+        except Exception as ex:
+            LOG.exception(ex)
+            result.status = False
+            result.message = "Get datastore folder usage error: %s" % str(ex)
+            return result
+        result.data = {"usage": usage, "errors": errors}
+        if errors:
+            result.status = False
+            result.message = "Search datastore error: %s" % "; ".join(
+                "%s: %s" % item for item in errors.items())
+        return result
+
@@ -2,18 +2,28 @@
 
 from __future__ import absolute_import
 
+import functools
 import logging
+import threading
 import uuid
 
 from pyVmomi import vim, vmodl
 
 from .base_client import BaseClient
+from .session import leased_methods, unleased
 from .tools import constants
+from .tools import host_utils
+from .tools import placement_utils
+from .tools import result_utils
+from .tools import scheduler_utils
+from .tools import task_utils
+from .tools.result_utils import DataResult
 
 
 LOG = logging.getLogger(__name__)
 
 
+@leased_methods
 class HostClient(BaseClient):
     """
     VMware Manager ESXi Host Client.
@@ -21,37 +31,521 @@ class HostClient(BaseClient):
 
     def __init__(self, vc_info):
         super(HostClient, self).__init__(vc_info)
+        # target hosts of the evacuated VMs
+        self.placement = placement_utils.PlacementEngine(
+            self._fetch_placement_state,
+            refresh_seconds=constants.PLACEMENT_REFRESH_SECONDS)
+
+    def _wait_task(self, task_key, timeout=None):
+        """
+        Wait for a task, raise its error.
+        """
+        for task_info in task_utils.wait_for_tasks(self.si, [task_key],
+                                                   timeout):
+            info = task_utils.task_info_json(task_info)
+            if info['state'] == 'error':
+                raise Exception(info['error'])
+            return info
+        raise Exception("Timeout waiting for the task %s." % task_key)
 
     def query_host_connection_info(self, dc_moid, auth_info):
-        pass
+        """
+        Query the info of a host to add, see host_utils.host_connect_info_json.
+
+        @param auth_info: see host_utils.make_host_connect_spec
+        @return: DataResult, a host whose certificate is not trusted yet
+                 fails with data: {"ssl_thumbprint": "AB:CD:..."}, the
+                 thumbprint to pass in auth_info once verified
+        """
+        result = DataResult()
+        try:
+            dc_mor = self.get_datacenter_mor(dc_moid)
+            if not dc_mor:
+                raise Exception("Not found datacenter: %s" % dc_moid)
+            spec = host_utils.make_host_connect_spec(auth_info)
+            connect_info = dc_mor.QueryConnectionInfo(
+                hostname=spec.hostName, port=spec.port,
+                username=spec.userName, password=spec.password,
+                sslThumbprint=spec.sslThumbprint)
+            result.data = host_utils.host_connect_info_json(connect_info)
+        except vim.fault.SSLVerifyFault as ex:
+            LOG.exception(ex)
+            result.status = False
+            result.message = "The host certificate is not trusted: %s" % \
+                ex.thumbprint
+            result.data = {"ssl_thumbprint": ex.thumbprint}
+        except Exception as ex:
+            LOG.exception(ex)
+            result.status = False
+            result.message = "Query host connection info error: %s" % str(ex)
+        return result
 
     def host_added_to_cluster(self, auth_info, c_moid, f_moid=None):
-        pass
+        """
+        Add a host to a cluster.
+
+        @param auth_info: see host_utils.make_host_connect_spec
+        @param f_moid: unused, a clustered host lives in its cluster
+        """
+        result = DataResult()
+        try:
+            cluster_mor = self.get_cluster_mor(c_moid)
+            if not cluster_mor:
+                raise Exception("Not found cluster: %s" % c_moid)
+            task_mor = cluster_mor.AddHost_Task(
+                spec=host_utils.make_host_connect_spec(auth_info),
+                asConnected=True)
+            result.task_key = task_mor._moId
+        except Exception as ex:
+            LOG.exception(ex)
+            result.status = False
+            result.message = "Add host to cluster error: %s" % str(ex)
+        return result
 
     def host_added_to_datacenter(self, auth_info, dc_moid, f_moid=None):
-        pass
+        """
+        Add a standalone host to a datacenter.
+
+        @param auth_info: see host_utils.make_host_connect_spec
+        @param f_moid: the host folder, default the datacenter hostFolder
+        """
+        result = DataResult()
+        try:
+            folder_mor = self.get_folder_mor(f_moid)
+            if not folder_mor:
+                dc_mor = self.get_datacenter_mor(dc_moid)
+                if not dc_mor:
+                    raise Exception("Not found datacenter: %s" % dc_moid)
+                folder_mor = dc_mor.hostFolder
+            task_mor = folder_mor.AddStandaloneHost_Task(
+                spec=host_utils.make_host_connect_spec(auth_info),
+                addConnected=True)
+            result.task_key = task_mor._moId
+        except Exception as ex:
+            LOG.exception(ex)
+            result.status = False
+            result.message = "Add host to datacenter error: %s" % str(ex)
+        return result
 
     def host_move_into_cluster(self, h_moid, c_moid):
-        pass
+        """
+        Move a host into a cluster, the host must be in maintenance mode.
+        """
+        result = DataResult()
+        try:
+            host_mor = self.get_host_mor(h_moid)
+            cluster_mor = self.get_cluster_mor(c_moid)
+            if not (host_mor and cluster_mor):
+                raise Exception("Not found host %s or cluster %s." %
+                                (h_moid, c_moid))
+            task_mor = cluster_mor.MoveInto_Task(host=[host_mor])
+            result.task_key = task_mor._moId
+        except Exception as ex:
+            LOG.exception(ex)
+            result.status = False
+            result.message = "Move host into cluster error: %s" % str(ex)
+        return result
 
     def host_move_into_datacenter(self, h_moid, dc_moid):
-        pass
+        """
+        Move a clustered host out into the datacenter hostFolder as a
+        standalone host, the host must be in maintenance mode.
+        """
+        result = DataResult()
+        try:
+            host_mor = self.get_host_mor(h_moid)
+            dc_mor = self.get_datacenter_mor(dc_moid)
+            if not (host_mor and dc_mor):
+                raise Exception("Not found host %s or datacenter %s." %
+                                (h_moid, dc_moid))
+            task_mor = dc_mor.hostFolder.MoveIntoFolder_Task([host_mor])
+            result.task_key = task_mor._moId
+        except Exception as ex:
+            LOG.exception(ex)
+            result.status = False
+            result.message = "Move host into datacenter error: %s" % str(ex)
+        return result
+
+    def _get_evacuate_vms(self, host_mor, include_powered_off=False):
+        """
+        The VMs to move off a host, read in one PropertyCollector call.
+        """
+        vms = []
+        for props in self.iter_properties([vim.VirtualMachine],
+                                          constants.EVACUATE_VM_PROPERTIES,
+                                          container=host_mor):
+            if props['config.template']:
+                continue
+            if props['runtime.powerState'] != 'poweredOn' and \
+                    not include_powered_off:
+                continue
+            vms.append(props)
+        return vms
+
+    def evacuate_host(self, h_moid, include_powered_off=False,
+                      source_limit=None, dest_limit=None, max_running=None,
+                      retries=None, timeout=None, priority='defaultPriority',
+                      exclude_host_moids=None):
+        """
+        vMotion the VMs of a host to the other hosts of its cluster.
+
+        The target of every VM is placed on the cluster headroom (see
+        placement_utils.PlacementEngine), on a host mounting all its
+        datastores.
+        The vMotions run under per-source and per-destination host limits;
+        a vMotion failed with a transient fault
+        (constants.MIGRATE_TRANSIENT_FAULTS) is placed and started again.
+
+        @param include_powered_off: also move the powered off VMs
+        @param source_limit: max running vMotions per source host,
+                             default constants.VMOTION_SOURCE_LIMIT
+        @param dest_limit: max running vMotions per destination host,
+                           default constants.VMOTION_DESTINATION_LIMIT
+        @param max_running: max running vMotions in total, None unlimited
+        @param retries: retries of a transient failure,
+                        default constants.MIGRATE_RETRIES
+        @param priority: highPriority lowPriority defaultPriority
+        @param exclude_host_moids: hosts not to move VMs to, read at every
+                                   placement, e.g. the set of hosts a
+                                   rolling maintenance is evacuating
+        @return: DataResult, data: {"results": {vm_moid: DataResult}},
+                 a VM DataResult data: {"host_moid": "host-2"}
+        """
+        results = {}
+        try:
+            host_mor = self.get_host_mor(h_moid)
+            if not host_mor:
+                raise Exception("Not found host: %s" % h_moid)
+            cluster_mor = host_mor.parent
+            if not isinstance(cluster_mor, vim.ClusterComputeResource):
+                raise Exception("The host %s is not in a cluster." % h_moid)
+            vms = self._get_evacuate_vms(host_mor, include_powered_off)
+            if priority not in vim.VirtualMachine.MovePriority.values:
+                raise Exception("Unknown move priority: %s" % priority)
+            priority = vim.VirtualMachine.MovePriority(priority)
+        except Exception as ex:
+            LOG.exception(ex)
+            result = DataResult()
+            result.status = False
+            result.message = "Evacuate host error: %s" % str(ex)
+            return result
+
+        scope = (None, cluster_mor._moId)
+        limits = {
+            'source': source_limit or constants.VMOTION_SOURCE_LIMIT,
+            'destination': dest_limit or constants.VMOTION_DESTINATION_LIMIT,
+        }
+        retries = constants.MIGRATE_RETRIES if retries is None else retries
+        placements = {}
+        attempts = {}
+        with self.get_task_tracker() as tracker:
+            scheduler = scheduler_utils.TaskScheduler(tracker, limits,
+                                                      max_running)
+
+            def _submit(props):
+                vm_moid = props['moid']
+                attempts[vm_moid] = attempts.get(vm_moid, 0) + 1
+                datastores = props['datastore'] or []
+                try:
+                    placement = self.placement.place(
+                        scope,
+                        memory_mb=props['summary.config.memorySizeMB'] or 0,
+                        cpu_mhz=props['summary.quickStats.overallCpuUsage'] or 0,
+                        # vMotion leaves the storage, only the host must
+                        # mount every datastore of the VM
+                        require_ds_moids=[ds._moId for ds in datastores],
+                        exclude_host_moids=set(
+                            exclude_host_moids or ()) | set([h_moid]))
+                except Exception as ex:
+                    LOG.exception(ex)
+                    results[vm_moid].status = False
+                    results[vm_moid].message = "VM vMotion error: %s" % str(ex)
+                    return
+                placements[vm_moid] = placement
+                results[vm_moid].data = {"host_moid": placement['host_moid']}
+                dest_mor = self._make_mor([vim.HostSystem],
+                                          placement['host_moid'])
+                scheduler.submit(
+                    vm_moid,
+                    functools.partial(props['mor'].Migrate, None, dest_mor,
+                                      priority),
+                    [('source', h_moid),
+                     ('destination', placement['host_moid'])])
+
+            vms_props = {}
+            for props in vms:
+                vms_props[props['moid']] = props
+                results[props['moid']] = DataResult()
+                _submit(props)
+
+            for vm_moid, task_info, error in scheduler.run(timeout):
+                # the next refreshed placement state accounts the moved VM
+                self.placement.release(placements.pop(vm_moid, None))
+                result = results[vm_moid]
+                if task_info is not None:
+                    result.task_key = task_info.key
+                    if task_info.state == 'success':
+                        continue
+                    if isinstance(task_info.error,
+                                  constants.MIGRATE_TRANSIENT_FAULTS) and \
+                            attempts[vm_moid] <= retries:
+                        LOG.info("Retry the vMotion of %s: %s", vm_moid,
+                                 task_info.error.msg)
+                        _submit(vms_props[vm_moid])
+                        continue
+                    error = task_utils.task_info_json(task_info)['error']
+                result.status = False
+                result.message = "VM vMotion error: %s" % error
+        return result_utils.aggregate_results(results)
 
-    def host_maintenance_enter(self, h_moid):
-        pass
+    def host_maintenance_enter(self, h_moid, evacuate=False,
+                               include_powered_off=False, timeout=None,
+                               exclude_host_moids=None):
+        """
+        Put a host into maintenance mode.
+
+        @param evacuate: first move its VMs to the other hosts of the
+                         cluster, see evacuate_host; the host does not
+                         enter maintenance mode if a VM could not be moved
+        @param timeout: secs to wait for the evacuation
+        @param exclude_host_moids: see evacuate_host
+        @return: DataResult, task_key: the EnterMaintenanceMode task,
+                 data: {"results": {vm_moid: DataResult}} of the evacuation
+        """
+        result = DataResult()
+        if evacuate:
+            result = self.evacuate_host(
+                h_moid, include_powered_off=include_powered_off,
+                timeout=timeout, exclude_host_moids=exclude_host_moids)
+            if not result.status:
+                return result
+        try:
+            host_mor = self.get_host_mor(h_moid)
+            if not host_mor:
+                raise Exception("Not found host: %s" % h_moid)
+            task_mor = host_mor.EnterMaintenanceMode_Task(
+                timeout=0, evacuatePoweredOffVms=include_powered_off)
+            result.task_key = task_mor._moId
+        except Exception as ex:
+            LOG.exception(ex)
+            result.status = False
+            result.message = "Enter host maintenance mode error: %s" % str(ex)
+        return result
+
+    def _host_task(self, h_moid, op_name, start):
+        """
+        Start a task of a host, start(host_mor) returns the vim.Task.
+        """
+        result = DataResult()
+        try:
+            host_mor = self.get_host_mor(h_moid)
+            if not host_mor:
+                raise Exception("Not found host: %s" % h_moid)
+            task_mor = start(host_mor)
+            result.task_key = task_mor._moId
+        except Exception as ex:
+            LOG.exception(ex)
+            result.status = False
+            result.message = "%s error: %s" % (op_name, str(ex))
+        return result
 
     def host_maintenance_exit(self, h_moid):
-        pass
+        """
+        Take a host out of maintenance mode.
+        """
+        return self._host_task(
+            h_moid, "Exit host maintenance mode",
+            lambda host_mor: host_mor.ExitMaintenanceMode_Task(timeout=0))
 
     def host_disconnect(self, h_moid):
-        pass
+        """
+        Disconnect a host from vCenter, it stays in the inventory.
+        """
+        return self._host_task(
+            h_moid, "Disconnect host",
+            lambda host_mor: host_mor.DisconnectHost_Task())
 
     def host_reconnect(self, h_moid):
-        pass
+        """
+        Reconnect a disconnected host.
+        """
+        return self._host_task(
+            h_moid, "Reconnect host",
+            lambda host_mor: host_mor.ReconnectHost_Task())
 
     def host_destroy(self, h_moid):
-        pass
+        """
+        Remove a host from the inventory, a clustered host must be in
+        maintenance mode. The compute resource of a standalone host is
+        removed with it.
+        """
+        def _destroy(host_mor):
+            parent = host_mor.parent
+            if isinstance(parent, vim.ClusterComputeResource):
+                return host_mor.Destroy_Task()
+            return parent.Destroy_Task()
+        return self._host_task(h_moid, "Destroy host", _destroy)
+
+    def _batch_host_operation(self, h_moids, operation, concurrency=None,
+                              wait=False, timeout=None):
+        """
+        Run a single host operation on many hosts, each from its own
+        leased connection, see VMClient._batch_power_vms.
+        """
+        results = {}
+        for h_moid in h_moids:
+            results.setdefault(h_moid, None)
+
+        def _submit(h_moid):
+            results[h_moid] = operation(h_moid)
+
+        self._run_concurrently(_submit, list(results.keys()), concurrency)
+        if wait:
+            self._wait_task_results(results, timeout)
+        return result_utils.aggregate_results(results)
+
+    @unleased
+    def batch_host_maintenance_exit(self, h_moids, concurrency=None,
+                                    wait=False, timeout=None):
+        """
+        Take hosts out of maintenance mode.
+
+        @param concurrency: threads submitting tasks, default
+                            constants.BATCH_CONCURRENCY
+        @param wait: wait for the tasks, a failed task fails its host result
+        @return: DataResult, data: {"results": {h_moid: DataResult}}
+        """
+        return self._batch_host_operation(h_moids, self.host_maintenance_exit,
+                                          concurrency, wait, timeout)
+
+    @unleased
+    def batch_host_disconnect(self, h_moids, concurrency=None, wait=False,
+                              timeout=None):
+        """
+        Disconnect hosts, see batch_host_maintenance_exit.
+        """
+        return self._batch_host_operation(h_moids, self.host_disconnect,
+                                          concurrency, wait, timeout)
+
+    @unleased
+    def batch_host_reconnect(self, h_moids, concurrency=None, wait=False,
+                             timeout=None):
+        """
+        Reconnect hosts, see batch_host_maintenance_exit.
+        """
+        return self._batch_host_operation(h_moids, self.host_reconnect,
+                                          concurrency, wait, timeout)
+
+    def _cycle_host(self, h_moid, action, evacuate, include_powered_off,
+                    timeout, in_maintenance):
+        """
+        Take one host through maintenance mode: evacuate and enter, run
+        the action, exit.
+        """
+        result = self.host_maintenance_enter(
+            h_moid, evacuate=evacuate, include_powered_off=include_powered_off,
+            timeout=timeout, exclude_host_moids=in_maintenance)
+        if not result.status:
+            return result
+        try:
+            self._wait_task(result.task_key, timeout)
+        except Exception as ex:
+            LOG.exception(ex)
+            result.status = False
+            result.message = "Enter host maintenance mode error: %s" % str(ex)
+            return result
+        # the host takes no VMs any more
+        self.placement.refresh()
+        if action is not None:
+            try:
+                action_result = action(h_moid)
+                if action_result is not None and not action_result.status:
+                    raise Exception(action_result.message)
+            except Exception as ex:
+                LOG.exception(ex)
+                result.status = False
+                result.message = "Host maintenance action error: %s" % str(ex)
+        exit_result = self.host_maintenance_exit(h_moid)
+        if exit_result.status:
+            result.task_key = exit_result.task_key
+            try:
+                self._wait_task(exit_result.task_key, timeout)
+            except Exception as ex:
+                exit_result.status = False
+                exit_result.message = "Exit host maintenance mode error: " \
+                    "%s" % str(ex)
+        if not exit_result.status and result.status:
+            result.status = False
+            result.message = exit_result.message
+        self.placement.refresh()
+        return result
+
+    @unleased
+    def rolling_host_maintenance(self, h_moids, action=None, window=None,
+                                 evacuate=True, include_powered_off=False,
+                                 timeout=None):
+        """
+        Take many hosts through maintenance mode with a rolling window.
 
+        Every host is evacuated and enters maintenance mode, action runs,
+        and the host exits maintenance mode. At most window hosts of a
+        cluster are in maintenance mode at a time, the clusters roll in
+        parallel on one connection per slot of every window, up to
+        vc_info.max_pool_size connections, the slots beyond wait for one;
+        the evacuations do not place VMs on the hosts of the window.
+        @param action: callable(h_moid) run while the host is in
+                       maintenance mode, e.g. patch and reboot it; a
+                       returned DataResult with status False or an
+                       exception fails the host, which still exits
+        @param window: hosts per cluster in maintenance mode at a time,
+                       default constants.HOST_ROLLING_WINDOW
+        @param timeout: secs to wait for every step of a host
+        @return: DataResult, data: {"results": {h_moid: DataResult}}
+        """
+        window = window or constants.HOST_ROLLING_WINDOW
+        results = {}
+        with self.lease():
+            hosts = self.retrieve_mors_properties(
+                [self._make_mor([vim.HostSystem], h_moid)
+                 for h_moid in h_moids], ['name', 'parent'])
+        # cluster moid: hosts waiting for the window
+        queues = {}
+        for h_moid in h_moids:
+            if h_moid in results:
+                continue
+            results[h_moid] = DataResult()
+            if h_moid not in hosts:
+                results[h_moid].status = False
+                results[h_moid].message = "Not found host: %s" % h_moid
+                continue
+            parent = hosts[h_moid]['parent']
+            queues.setdefault(parent._moId if parent else None,
+                              []).append(h_moid)
 
+        lock = threading.Lock()
+        # (queue, hosts of the cluster in maintenance mode), one per slot
+        # of the window of every cluster
+        slots = []
+        for queue in queues.values():
+            in_maintenance = set()
+            slots.extend([(queue, in_maintenance)] * min(window, len(queue)))
 
+        def _roll(slot):
+            queue, in_maintenance = slot
+            while True:
+                with lock:
+                    if not queue:
+                        return
+                    h_moid = queue.pop(0)
+                    in_maintenance.add(h_moid)
+                try:
+                    results[h_moid] = self._cycle_host(
+                        h_moid, action, evacuate, include_powered_off,
+                        timeout, in_maintenance)
+                finally:
+                    with lock:
+                        in_maintenance.discard(h_moid)
 
+        if slots:
+            self._run_concurrently(_roll, slots, len(slots))
+        return result_utils.aggregate_results(results)
@@ -8,12 +8,14 @@ import uuid
 from pyVmomi import vim, vmodl
 
 from .base_client import BaseClient
+from .session import leased_methods
 from .tools import constants
 
 
 LOG = logging.getLogger(__name__)
 
 
+@leased_methods
 class TemplateClient(BaseClient):
     """
     VMware Manager VM Template Client.
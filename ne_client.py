@@ -8,12 +8,17 @@ import uuid
 from pyVmomi import vim, vmodl
 
 from .base_client import BaseClient
+from .session import leased_methods
 from .tools import constants
+from .tools import network_utils
+from .tools import result_utils
+from .tools.result_utils import DataResult
 
 
 LOG = logging.getLogger(__name__)
 
 
+@leased_methods
 class NetworkClient(BaseClient):
     """
     VMware Manager Network Client.
@@ -21,6 +26,29 @@ class NetworkClient(BaseClient):
 
     def __init__(self, vc_info):
         super(NetworkClient, self).__init__(vc_info)
+        # names of the existing distributed portgroups per datacenter
+        self.portgroup_index = network_utils.PortgroupIndex(
+            self._fetch_portgroup_index,
+            refresh_seconds=constants.PORTGROUP_INDEX_REFRESH_SECONDS)
+
+    def _fetch_portgroup_index(self):
+        """
+        ({dvs moid: dc moid}, {dc moid: set(portgroup names)}) of all
+        switches, in paged property retrievals.
+        """
+        switch_mors = [props['mor'] for props in self.iter_properties(
+            vim.DistributedVirtualSwitch, ['name'])]
+        switches = dict((moid, dc_mor._moId) for (moid, dc_mor) in
+                        self.get_mors_datacenters(switch_mors).items())
+        names = {}
+        for props in self.iter_properties(
+                vim.dvs.DistributedVirtualPortgroup,
+                ['name', 'config.distributedVirtualSwitch']):
+            dvs_mor = props.get('config.distributedVirtualSwitch')
+            if dvs_mor and dvs_mor._moId in switches:
+                names.setdefault(switches[dvs_mor._moId], set()).add(
+                    props['name'])
+        return switches, names
 
     def create_vswtich(self, host_moid, dvpg):
         pass
@@ -31,6 +59,107 @@ class NetworkClient(BaseClient):
     def create_dvswtich(self, dvs_moid, dvpg):
         pass
 
-    def create_dvportgroup(self, dvs_moid, dvpg):
-        pass
+    def _add_dvportgroups(self, dvs_moid, dvpgs):
+        """
+        Add the portgroups not existing yet to a switch in one
+        AddDVPortgroup_Task, their names are pending in the
+        portgroup_index until the task finishes.
+        """
+        result = DataResult()
+        created = []
+        skipped = []
+        try:
+            dvs_mor = self.get_dvswitch_mor(dvs_moid)
+            if not dvs_mor:
+                raise Exception("Not found dvswitch: %s" % dvs_moid)
+            existing = self.portgroup_index.names(dvs_moid)
+            pg_specs = []
+            for dvpg in dvpgs:
+                pg_spec = network_utils.make_dvportgroup_spec(dvpg)
+                if pg_spec.name in existing:
+                    skipped.append(pg_spec.name)
+                    continue
+                existing.add(pg_spec.name)
+                created.append(pg_spec.name)
+                pg_specs.append(pg_spec)
+            if pg_specs:
+                task_mor = dvs_mor.AddDVPortgroup_Task(pg_specs)
+                result.task_key = task_mor._moId
+                self.portgroup_index.add_pending(result.task_key, dvs_moid,
+                                                 created)
+        except Exception as ex:
+            LOG.exception(ex)
+            result.status = False
+            result.message = "Create dvportgroup error: %s" % str(ex)
+            created = []
+            skipped = []
+        result.data = {"created": created, "skipped": skipped}
+        return result
+
+    def _finish_pending_dvportgroups(self):
+        """
+        Settle the pending portgroup names of the finished tasks, in one
+        property retrieval.
+        """
+        task_keys = self.portgroup_index.pending_tasks()
+        if not task_keys:
+            return
+        tasks = self.retrieve_mors_properties(
+            [self._make_mor([vim.Task], task_key) for task_key in task_keys],
+            ['info.state'])
+        for task_key in task_keys:
+            if task_key not in tasks:
+                # the task is gone, the server has the truth
+                self.portgroup_index.finish(task_key, False)
+                self.portgroup_index.refresh()
+                continue
+            state = tasks[task_key]['info.state']
+            if state in ('success', 'error'):
+                self.portgroup_index.finish(task_key, state == 'success')
+
+    def create_dvportgroup(self, dvs_moid, dvpg, wait=False, timeout=None):
+        """
+        Create a distributed portgroup, see create_dvportgroups.
+
+        @param dvpg: see network_utils.make_dvportgroup_spec
+        @return: DataResult, data: {"created": [name], "skipped": [name]}
+        """
+        result = self.create_dvportgroups([dict(dvpg, dvs_moid=dvs_moid)],
+                                          wait, timeout)
+        return result.data['results'][dvs_moid]
+
+    def create_dvportgroups(self, dvpgs, wait=False, timeout=None):
+        """
+        Create many distributed portgroups, one AddDVPortgroup_Task per
+        switch.
+
+        Portgroups whose name exists in the datacenter of their switch are
+        skipped, the names are checked against the cached portgroup_index.
+        The names being created stay pending in the index until their task
+        finishes, so a following batch does not submit them again; the
+        names of a failed task are dropped.
+        @param dvpgs: [{"dvs_moid": "dvs-21", "name": "tenant-a-100",
+                        "vlan_id": 100}], see
+                      network_utils.make_dvportgroup_spec
+        @param wait: wait for the tasks, a failed task fails its switch
+        @return: DataResult, data: {"results": {dvs_moid: DataResult}},
+                 data of a switch: {"created": [name], "skipped": [name]}
+        """
+        self._finish_pending_dvportgroups()
+        switches = {}
+        for dvpg in dvpgs:
+            switches.setdefault(dvpg.get('dvs_moid'), []).append(dvpg)
+        results = {}
+        for dvs_moid, switch_dvpgs in switches.items():
+            results[dvs_moid] = self._add_dvportgroups(dvs_moid,
+                                                       switch_dvpgs)
+        if wait:
+            self._wait_task_results(results, timeout)
+            for result in results.values():
+                if not result.status and result.task_key:
+                    # the portgroups of a failed task were not created
+                    result.data["created"] = []
+            # a task still running at the timeout stays pending
+            self._finish_pending_dvportgroups()
+        return result_utils.aggregate_results(results)
 
@@ -2,8 +2,13 @@
 
 from __future__ import absolute_import
 
+import contextlib
+import functools
+import hashlib
+import inspect
 import logging
 import ssl
+import threading
 import time
 import six
 
@@ -18,18 +23,32 @@ class VcenterInfo(object):
     The vCenter connection info object.
     """
 
-    def __init__(self, host, user, pwd, port=443, timeout=900):
+    def __init__(self, host, user, pwd, port=443, timeout=900,
+                 session_ttl=300, shared_session=True, pool_size=1,
+                 max_pool_size=16):
         self.host = host
         self.user = user
         self.pwd = pwd
         self.port = port
         # Timeout in secs for idle connections in client pool. Use -1 to disable any timeout.
         self.timeout = timeout
+        # Secs the session is trusted without a SessionIsActive check.
+        # Use 0 to check on every access, None to never check and only
+        # re-authenticate on vim.fault.NotAuthenticated.
+        self.session_ttl = session_ttl
+        # Share one login between all clients of the same host/port/user
+        # and password; their timeout and session_ttl must match.
+        self.shared_session = shared_session
+        # Authenticated connections leased to concurrent client calls.
+        self.pool_size = pool_size
+        # Max connections while batch calls run, each one is a vCenter
+        # login; the ones beyond pool_size are logged out after the batch.
+        self.max_pool_size = max_pool_size
 
 
-class VcenterSession(object):
+class VcenterConnection(object):
     """
-    Sets up a session with the VC/ESX host.
+    One authenticated connection (ServiceInstance) with the VC/ESX host.
     """
 
     def __init__(self, vc_info):
@@ -38,9 +57,23 @@ class VcenterSession(object):
         self.pwd = vc_info.pwd
         self.port = vc_info.port
         self.timeout = vc_info.timeout
+        self.session_ttl = vc_info.session_ttl
         self._sessionManager = None
         self._session_id = None
         self._si = None
+        self._content = None
+        self._version = None
+        # time of the last successful login or liveness check
+        self._session_checked_at = 0
+        # bumped on every (re)login, so concurrent NotAuthenticated
+        # failures of one session re-authenticate only once
+        self._session_generation = 0
+        self._reauth_lock = threading.RLock()
+        # per thread: the thread is logging in, its calls are not hooked
+        self._reauth_local = threading.local()
+        self.session_check_count = 0
+        self.reauth_count = 0
+        self.reauth_failed_count = 0
         self._create_session()
 
     def _create_session(self):
@@ -59,9 +92,15 @@ class VcenterSession(object):
                                                 connectionPoolTimeout=int(
                                                     self.timeout),
                                                 sslContext=context)
-                self.si = service_instance
-                self._sessionManager = service_instance.content.sessionManager
-                self._session_id = service_instance.content.sessionManager.currentSession.key
+                content = service_instance.RetrieveContent()
+                self._si = service_instance
+                self._content = content
+                self._version = content.about.version
+                self._sessionManager = content.sessionManager
+                self._session_id = content.sessionManager.currentSession.key
+                self._session_checked_at = time.time()
+                self._session_generation += 1
+                self._install_reauth_hook(service_instance._stub)
                 LOG.debug("The vCenter server (%s) has authenticated." %
                           self.host)
                 break
@@ -93,20 +132,112 @@ class VcenterSession(object):
                        'session': self._session_id})
         return is_active
 
+    def _install_reauth_hook(self, stub):
+        """
+        Re-authenticate and replay a call once when it fails with
+        vim.fault.NotAuthenticated.
+
+        Property reads go through InvokeMethod too, so every managed
+        object bound to this stub is covered. Once a new session replaced
+        this stub, its calls are sent through the stub of the new session.
+        """
+        invoke_method = stub.InvokeMethod
+
+        def _invoke_method(*args, **kwargs):
+            if getattr(self._reauth_local, 'active', False):
+                return invoke_method(*args, **kwargs)
+            current_stub = self._si._stub if self._si else stub
+            if current_stub is not stub:
+                return current_stub.InvokeMethod(*args, **kwargs)
+            generation = self._session_generation
+            try:
+                return invoke_method(*args, **kwargs)
+            except vim.fault.NotAuthenticated:
+                LOG.info("The vCenter server (%s) session is not "
+                         "authenticated, re-authenticate." % self.host)
+                self._reauthenticate(generation)
+                if self._si._stub is not stub:
+                    return self._si._stub.InvokeMethod(*args, **kwargs)
+                return invoke_method(*args, **kwargs)
+
+        stub.InvokeMethod = _invoke_method
+
+    def _reauthenticate(self, generation=None):
+        """
+        Log in again on the current stub so that the managed object
+        references already handed out stay valid; create a new session
+        if that fails.
+
+        @param generation: the session generation the failed call used,
+                           skip if another thread re-authenticated since.
+        """
+        with self._reauth_lock:
+            if generation is not None and \
+                    generation != self._session_generation:
+                return
+            self._reauth_local.active = True
+            try:
+                try:
+                    self._sessionManager.Login(self.user, self.pwd)
+                    self._session_id = self._sessionManager.currentSession.key
+                    self._session_checked_at = time.time()
+                    self._session_generation += 1
+                except vim.fault.InvalidLogin:
+                    raise
+                except Exception as ex:
+                    LOG.debug("Login on current session error: %s, create "
+                              "a new session." % str(ex))
+                    self._create_session()
+                self.reauth_count += 1
+            except Exception:
+                self.reauth_failed_count += 1
+                raise
+            finally:
+                self._reauth_local.active = False
+
+    @property
+    def session_stats(self):
+        """
+        Session liveness counters, updated under the re-auth lock.
+        """
+        with self._reauth_lock:
+            return {"session_checks": self.session_check_count,
+                    "reauth": self.reauth_count,
+                    "reauth_failed": self.reauth_failed_count}
+
     @property
     def service_instance(self):
         """
         vCenter Auth Session.
+
+        The session is trusted for session_ttl secs after the last login
+        or liveness check; calls failing with vim.fault.NotAuthenticated
+        re-authenticate lazily.
         """
-        if self.is_current_session_active:
+        if self.session_ttl is None or \
+                time.time() - self._session_checked_at < self.session_ttl:
             return self._si
+        with self._reauth_lock:
+            self.session_check_count += 1
+        if self.is_current_session_active:
+            self._session_checked_at = time.time()
         else:
-            return self._create_session()
+            self._reauthenticate()
+        return self._si
 
     @property
     def si(self):
         return self.service_instance
 
+    @property
+    def content(self):
+        """
+        The ServiceContent retrieved at login; its managed object
+        references (propertyCollector, viewManager, ...) do not change.
+        """
+        self.service_instance
+        return self._content
+
     def get_session_id(self):
         try:
             # NOTE: only a successfully authenticated session has a session key aka session id.
@@ -117,11 +248,454 @@ class VcenterSession(object):
 
     def disconnect(self):
         if self._si:
-            Disconnect(self.si)
-    
+            Disconnect(self._si)
+            self._si = None
+
+    def get_vc_version(self):
+        """
+        Return the dot-separated vCenter version string.
+        For example, "6.0.0".
+        """
+        return self._version
+
+
+class ConnectionPool(object):
+    """
+    A pool of up to size authenticated connections with the VC/ESX host,
+    up to max_size while batch calls overflow it (see overflow).
+
+    pyVmomi stubs must not be driven from several threads at once; a
+    client call leases one connection for its whole duration and other
+    threads lease other connections or wait. Connections are logged in
+    lazily, the first one (primary) at pool creation.
+
+    A leased connection is reference counted: nested leases of a thread
+    and the generators it runs share the connection, which is checked in
+    with the last reference. The connection of a call is bound to the
+    thread only while the call runs (see bind).
+    """
+
+    def __init__(self, vc_info):
+        self.key = SessionRegistry.make_key(vc_info)
+        self.vc_info = vc_info
+        self.size = max(int(vc_info.pool_size or 1), 1)
+        self.max_size = max(int(vc_info.max_pool_size or 1), self.size)
+        # connections allowed beyond size by the running batch calls
+        self._overflow = 0
+        self.primary = VcenterConnection(vc_info)
+        self._connections = [self.primary]
+        self._idle = [self.primary]
+        self._creating = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._local = threading.local()
+        # leased connection: [references, owner thread ident]
+        self._refs = {}
+        self.lease_count = 0
+        self.lease_wait_count = 0
+
+    def resize(self, size):
+        with self._cond:
+            if size > self.size:
+                self.size = size
+                self.max_size = max(self.max_size, size)
+                self._cond.notify_all()
+
+    def _limit(self):
+        return min(self.size + self._overflow, self.max_size)
+
+    def _surplus(self):
+        """
+        Take the idle connections beyond the limit out of the pool, the
+        caller holds the lock.
+        """
+        surplus = []
+        for connection in list(self._idle):
+            if len(self._connections) <= self._limit():
+                break
+            if connection is self.primary:
+                continue
+            self._idle.remove(connection)
+            self._connections.remove(connection)
+            surplus.append(connection)
+        return surplus
+
+    @contextlib.contextmanager
+    def overflow(self, size):
+        """
+        Let the pool grow to size connections, at most max_size, while the
+        block runs; the connections beyond the limit are logged out when
+        they are idle again.
+        """
+        with self._cond:
+            extra = max(min(size, self.max_size) - self.size, 0)
+            self._overflow += extra
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._overflow -= extra
+                surplus = self._surplus()
+            self._disconnect(surplus)
+
+    def _checkout(self):
+        with self._cond:
+            self.lease_count += 1
+            waited = False
+            while not self._idle and \
+                    len(self._connections) + self._creating >= self._limit():
+                if not waited:
+                    self.lease_wait_count += 1
+                    waited = True
+                self._cond.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._creating += 1
+        try:
+            connection = VcenterConnection(self.vc_info)
+        except Exception:
+            with self._cond:
+                self._creating -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._creating -= 1
+            self._connections.append(connection)
+        return connection
+
+    def _checkin(self, connection):
+        with self._cond:
+            self._idle.append(connection)
+            surplus = self._surplus()
+            self._cond.notify()
+        self._disconnect(surplus)
+
+    def held(self):
+        """
+        The connection the current thread holds a reference of: the bound
+        one, else one kept by a suspended generator of the thread.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            return connection
+        ident = threading.current_thread().ident
+        with self._cond:
+            for held, (refs, owner) in self._refs.items():
+                if owner == ident:
+                    return held
+        return None
+
+    def acquire(self, connection=None):
+        """
+        Take a reference of connection, check one out if None.
+        """
+        if connection is None:
+            connection = self._checkout()
+        with self._cond:
+            entry = self._refs.setdefault(
+                connection, [0, threading.current_thread().ident])
+            entry[0] += 1
+        return connection
+
+    def release(self, connection):
+        """
+        Drop a reference, check the connection in with the last one. Any
+        thread may drop it, e.g. the one collecting an abandoned generator.
+        """
+        with self._cond:
+            entry = self._refs[connection]
+            entry[0] -= 1
+            if entry[0] > 0:
+                return
+            del self._refs[connection]
+        self._checkin(connection)
+
+    @contextlib.contextmanager
+    def bind(self, connection):
+        """
+        Make connection the current one of the thread, the previous one is
+        restored after.
+        """
+        previous = getattr(self._local, 'connection', None)
+        self._local.connection = connection
+        try:
+            yield connection
+        finally:
+            self._local.connection = previous
+
+    @contextlib.contextmanager
+    def lease(self):
+        """
+        Lease a connection to the current thread, re-entrant.
+        """
+        connection = self.acquire(self.held())
+        try:
+            with self.bind(connection):
+                yield connection
+        finally:
+            self.release(connection)
+
+    def current(self):
+        """
+        The connection leased by the current thread, default primary.
+        """
+        return getattr(self._local, 'connection', None) or self.primary
+
+    @property
+    def stats(self):
+        stats = {"session_checks": 0, "reauth": 0, "reauth_failed": 0}
+        with self._cond:
+            connections = list(self._connections)
+            stats.update({"pool_size": self.size,
+                          "max_pool_size": self.max_size,
+                          "overflow": self._overflow,
+                          "connections": len(connections),
+                          "idle": len(self._idle),
+                          "leases": self.lease_count,
+                          "lease_waits": self.lease_wait_count})
+        for connection in connections:
+            for k, v in connection.session_stats.items():
+                stats[k] += v
+        return stats
+
+    def disconnect(self):
+        with self._cond:
+            connections = list(self._connections)
+            self._connections = []
+            self._idle = []
+        self._disconnect(connections)
+
+    @staticmethod
+    def _disconnect(connections):
+        for connection in connections:
+            try:
+                connection.disconnect()
+            except Exception as ex:
+                LOG.debug("Disconnect %s error: %s" %
+                          (connection.host, str(ex)))
+
+
+class SessionRegistry(object):
+    """
+    Process-wide registry of authenticated vCenter connection pools keyed
+    by (host, port, user, password digest), reference counted per client.
+    A VcenterInfo with a wrong password never gets the pool of a login
+    made with the right one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key: [ConnectionPool, refcount]
+        self._pools = {}
+
+    @staticmethod
+    def make_key(vc_info):
+        credential = u'%s\0%s' % (vc_info.user, vc_info.pwd)
+        digest = hashlib.sha256(credential.encode('utf-8')).hexdigest()
+        return (vc_info.host, int(vc_info.port), vc_info.user, digest)
+
+    def acquire(self, vc_info):
+        """
+        Return the shared connection pool of vc_info, log in if there is
+        none. The pool grows to the largest pool_size asked for; a
+        timeout or session_ttl other than the pool's is rejected.
+        """
+        key = self.make_key(vc_info)
+        with self._lock:
+            entry = self._pools.get(key)
+            if entry is None:
+                entry = [ConnectionPool(vc_info), 0]
+                self._pools[key] = entry
+            else:
+                shared_info = entry[0].vc_info
+                if (shared_info.timeout, shared_info.session_ttl) != \
+                        (vc_info.timeout, vc_info.session_ttl):
+                    raise Exception(
+                        "The shared session of %s@%s uses timeout %s and "
+                        "session_ttl %s, use shared_session=False for other "
+                        "values." % (vc_info.user, vc_info.host,
+                                     shared_info.timeout,
+                                     shared_info.session_ttl))
+                entry[0].resize(int(vc_info.pool_size or 1))
+            entry[1] += 1
+            return entry[0]
+
+    def release(self, pool):
+        """
+        Drop one reference, disconnect with the last one.
+        """
+        with self._lock:
+            entry = self._pools.get(pool.key)
+            if entry is not None and entry[0] is pool:
+                entry[1] -= 1
+                if entry[1] > 0:
+                    return
+                del self._pools[pool.key]
+        pool.disconnect()
+
+    def refcount(self, vc_info):
+        with self._lock:
+            entry = self._pools.get(self.make_key(vc_info))
+            return entry[1] if entry else 0
+
+    def disconnect_all(self):
+        """
+        Disconnect all shared connections, e.g. at process exit.
+        """
+        with self._lock:
+            entries = list(self._pools.values())
+            self._pools.clear()
+        for pool, _ in entries:
+            pool.disconnect()
+
+
+SESSION_REGISTRY = SessionRegistry()
+
+
+def _leased(func):
+    """
+    Run a client method with a leased connection.
+
+    A generator keeps a reference of its connection until it is exhausted,
+    closed or collected, so paged retrievals and task trackers stay on one
+    session; the connection is bound to the thread only while a step runs,
+    generators interleaved on one thread do not see each other's.
+    """
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def _gen_wrapper(self, *args, **kwargs):
+            pool = self._pool
+            connection = pool.acquire(pool.held())
+            gen = None
+            try:
+                with pool.bind(connection):
+                    gen = func(self, *args, **kwargs)
+                while True:
+                    with pool.bind(connection):
+                        try:
+                            item = next(gen)
+                        except StopIteration:
+                            return
+                    yield item
+            finally:
+                try:
+                    if gen is not None:
+                        with pool.bind(connection):
+                            gen.close()
+                finally:
+                    pool.release(connection)
+        return _gen_wrapper
+
+    @functools.wraps(func)
+    def _wrapper(self, *args, **kwargs):
+        with self.lease():
+            return func(self, *args, **kwargs)
+    return _wrapper
+
+
+def unleased(func):
+    """
+    Mark a client method which must not hold a lease for its whole
+    duration, e.g. one waiting on worker threads that lease their own
+    connections.
+    """
+    func._unleased = True
+    return func
+
+
+def leased_methods(cls):
+    """
+    Class decorator: run every public method of the client class with a
+    leased connection, so one client can be used from many threads.
+    """
+    for name, attr in list(cls.__dict__.items()):
+        if name.startswith('_') or not inspect.isfunction(attr):
+            continue
+        if getattr(attr, '_unleased', False):
+            continue
+        setattr(cls, name, _leased(attr))
+    return cls
+
+
+class VcenterSession(object):
+    """
+    Sets up a session with the VC/ESX host.
+
+    Clients built from the same host/port/user share one connection pool
+    through SESSION_REGISTRY unless vc_info.shared_session is False. The
+    public client methods lease a connection of the pool per call.
+    """
+
+    def __init__(self, vc_info):
+        self.host = vc_info.host
+        self.user = vc_info.user
+        self.pwd = vc_info.pwd
+        self.port = vc_info.port
+        self._shared = vc_info.shared_session
+        if self._shared:
+            self._pool = SESSION_REGISTRY.acquire(vc_info)
+        else:
+            self._pool = ConnectionPool(vc_info)
+
+    @property
+    def _connection(self):
+        return self._pool.current()
+
+    @property
+    def timeout(self):
+        """
+        The idle timeout of the pooled connections.
+        """
+        return self._pool.vc_info.timeout
+
+    @property
+    def session_ttl(self):
+        """
+        The secs a session is trusted without a liveness check.
+        """
+        return self._pool.vc_info.session_ttl
+
+    def lease(self):
+        """
+        Context manager leasing a connection to the current thread.
+        """
+        return self._pool.lease()
+
+    @property
+    def is_current_session_active(self):
+        return self._connection.is_current_session_active
+
+    @property
+    def session_stats(self):
+        return self._pool.stats
+
+    @property
+    def service_instance(self):
+        return self._connection.service_instance
+
+    @property
+    def si(self):
+        return self._connection.si
+
+    @property
+    def content(self):
+        return self._connection.content
+
+    def get_session_id(self):
+        return self._connection.get_session_id()
+
+    def disconnect(self):
+        pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        if self._shared:
+            SESSION_REGISTRY.release(pool)
+        else:
+            pool.disconnect()
+
     def get_vc_version(self):
         """
         Return the dot-separated vCenter version string.
         For example, "6.0.0".
         """
-        return self.si.content.about.version
\ No newline at end of file
+        return self._pool.primary.get_vc_version()
@@ -0,0 +1,8 @@
+# -*- coding:utf-8 -*-
+
+import os
+import sys
+
+# the tools package only imports its own modules, so it is importable
+# from the repository root without the client package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
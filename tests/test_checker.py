@@ -0,0 +1,69 @@
+# -*- coding:utf-8 -*-
+
+from pyVmomi import vim, vmodl
+
+from tools import checker
+
+
+class FakeTaskInfo(object):
+
+    def __init__(self, key, result=None, error=None):
+        self.key = key
+        self.state = 'error' if error else 'success'
+        self.result = result
+        self.error = error
+
+
+def make_check_result(vm_moid, host_moid=None, warning=None, error=None):
+    return vim.vm.check.Result(
+        vm=vim.VirtualMachine(vm_moid, None),
+        host=vim.HostSystem(host_moid, None) if host_moid else None,
+        warning=[vmodl.MethodFault(msg=msg) for msg in warning or []],
+        error=[vmodl.MethodFault(msg=msg) for msg in error or []])
+
+
+def wait_checks(monkeypatch, checks, task_infos):
+    monkeypatch.setattr(checker.task_utils, 'wait_for_tasks',
+                        lambda si, task_keys, timeout: iter(task_infos))
+    return checker.VmChecker(None)._wait_checks(checks, None)
+
+
+def test_wait_checks_keys_findings_by_named_host(monkeypatch):
+    results = wait_checks(
+        monkeypatch, {'task-1': (['vm-1', 'vm-2'], 'host-1')},
+        [FakeTaskInfo('task-1', [
+            make_check_result('vm-1', 'host-2', error=['no access'])])])
+    assert set(results['vm-1']) == set(['host-1', 'host-2'])
+    assert results['vm-1']['host-1'].status == 'success'
+    assert results['vm-1']['host-2'].status == 'error'
+    assert results['vm-1']['host-2'].errors == ['no access']
+    assert set(results['vm-2']) == set(['host-1'])
+    assert results['vm-2']['host-1'].status == 'success'
+
+
+def test_wait_checks_unnamed_findings_go_to_the_target(monkeypatch):
+    results = wait_checks(
+        monkeypatch, {'task-1': (['vm-1'], 'host-1')},
+        [FakeTaskInfo('task-1', [
+            make_check_result('vm-1', warning=['tools outdated'])])])
+    assert results['vm-1']['host-1'].status == 'warning'
+    assert results['vm-1']['host-1'].msg == 'tools outdated'
+
+
+def test_wait_checks_failed_and_unfinished_tasks(monkeypatch):
+    results = wait_checks(
+        monkeypatch, {'task-1': (['vm-1'], 'host-1'),
+                      'task-2': (['vm-2'], None)},
+        [FakeTaskInfo('task-1', error=vmodl.MethodFault(msg='failed'))])
+    assert results['vm-1']['host-1'].errors == ['failed']
+    assert results['vm-2'][None].status == 'error'
+
+
+def test_wait_checks_finding_only_about_the_source_host(monkeypatch):
+    results = wait_checks(
+        monkeypatch, {'task-1': (['vm-1'], 'host-2')},
+        [FakeTaskInfo('task-1', [
+            make_check_result('vm-1', 'host-1', warning=['source busy'])])])
+    assert results['vm-1']['host-2'].status == 'success'
+    assert results['vm-1']['host-1'].status == 'warning'
+    assert results['vm-1']['host-1'].warnings == ['source busy']
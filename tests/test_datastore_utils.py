@@ -0,0 +1,73 @@
+# -*- coding:utf-8 -*-
+
+from pyVmomi import vim
+
+from tools import datastore_utils
+
+
+def test_parse_datastore_path():
+    assert datastore_utils.parse_datastore_path(
+        '[datastore1] vm01/vm01.vmx') == ('datastore1', 'vm01/vm01.vmx')
+    assert datastore_utils.parse_datastore_path('[datastore1]') == \
+        ('datastore1', '')
+    assert datastore_utils.parse_datastore_path('vm01/vm01.vmx') == \
+        (None, 'vm01/vm01.vmx')
+    assert datastore_utils.parse_datastore_path(None) == (None, '')
+
+
+def test_join_datastore_path():
+    assert datastore_utils.join_datastore_path('[datastore1]', 'vm01') == \
+        '[datastore1] vm01'
+    assert datastore_utils.join_datastore_path('[datastore1] vm01/',
+                                               'vm01.vmx') == \
+        '[datastore1] vm01/vm01.vmx'
+    assert datastore_utils.datastore_path('datastore1', '/vm01/') == \
+        '[datastore1] vm01'
+
+
+def test_iter_search_records_skips_folders():
+    results = [
+        vim.host.DatastoreBrowser.SearchResults(
+            folderPath='[datastore1]', file=[
+                vim.host.DatastoreBrowser.FolderInfo(path='vm01'),
+                vim.host.DatastoreBrowser.FileInfo(path='tools.iso',
+                                                   fileSize=10)]),
+        vim.host.DatastoreBrowser.SearchResults(
+            folderPath='[datastore1] vm01', file=[
+                vim.host.DatastoreBrowser.FileInfo(path='vm01.VMDK',
+                                                   fileSize=20),
+                vim.host.DatastoreBrowser.FileInfo(path='vm01.vmx.lck')])]
+    records = list(datastore_utils.iter_search_records(
+        'datastore-1', 'datastore1', results))
+    assert [(r['path'], r['type'], r['size']) for r in records] == [
+        ('[datastore1] tools.iso', 'iso', 10),
+        ('[datastore1] vm01/vm01.VMDK', 'disk', 20),
+        ('[datastore1] vm01/vm01.vmx.lck', 'file', None)]
+    assert records[1]['folder'] == '[datastore1] vm01'
+    assert records[1]['ds_moid'] == 'datastore-1'
+    assert list(datastore_utils.iter_search_records(
+        'datastore-1', 'datastore1', None)) == []
+
+
+def test_vm_home_folder():
+    assert datastore_utils.vm_home_folder('[datastore1] vm01/vm01.vmx') == \
+        '[datastore1] vm01/'
+    assert datastore_utils.vm_home_folder('[datastore1] vm01.vmx') == \
+        '[datastore1]'
+    assert datastore_utils.vm_home_folder(None) is None
+
+
+def test_classify_records_keeps_unverified_out_of_orphans():
+    records = [{'path': '[datastore1] vm01/vm01.vmdk'},
+               {'path': '[datastore1] vm02/vm02.vmdk'},
+               {'path': '[datastore1] vm03/vm03.vmdk'},
+               {'path': '[datastore1] vm020/vm020.vmdk'}]
+    orphans, unverified = datastore_utils.classify_records(
+        records, set(['[datastore1] vm01/vm01.vmdk']),
+        set(['[datastore1] vm02/']))
+    assert [r['path'] for r in orphans] == [
+        '[datastore1] vm03/vm03.vmdk', '[datastore1] vm020/vm020.vmdk']
+    assert [r['path'] for r in unverified] == ['[datastore1] vm02/vm02.vmdk']
+    orphans, unverified = datastore_utils.classify_records(
+        records, set(), set(['[datastore1]']))
+    assert orphans == [] and len(unverified) == 4
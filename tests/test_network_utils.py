@@ -0,0 +1,68 @@
+# -*- coding:utf-8 -*-
+
+from tools import network_utils
+
+
+def make_index(**kwargs):
+    fetches = []
+
+    def _fetch():
+        fetches.append(1)
+        return ({'dvs-1': 'datacenter-1', 'dvs-2': 'datacenter-1',
+                 'dvs-3': 'datacenter-2'},
+                {'datacenter-1': set(['pg-a']), 'datacenter-2': set(['pg-b'])})
+    return network_utils.PortgroupIndex(_fetch, **kwargs), fetches
+
+
+def test_names_are_per_datacenter():
+    index, fetches = make_index()
+    assert index.names('dvs-1') == set(['pg-a'])
+    assert index.names('dvs-2') == set(['pg-a'])
+    assert index.names('dvs-3') == set(['pg-b'])
+    assert index.datacenter('dvs-2') == 'datacenter-1'
+    assert len(fetches) == 1
+
+
+def test_pending_names_survive_refresh_until_finished():
+    index, _ = make_index()
+    index.add_pending('task-1', 'dvs-1', ['pg-c'])
+    index.add_pending('task-2', 'dvs-1', ['pg-d'])
+    index.refresh()
+    assert index.names('dvs-2') == set(['pg-a', 'pg-c', 'pg-d'])
+    assert index.names('dvs-3') == set(['pg-b'])
+    assert sorted(index.pending_tasks()) == ['task-1', 'task-2']
+    index.finish('task-1', True)
+    index.finish('task-2', False)
+    assert index.pending_tasks() == []
+    assert index.names('dvs-1') == set(['pg-a', 'pg-c'])
+    # names returns a copy
+    index.names('dvs-1').add('pg-e')
+    assert 'pg-e' not in index.names('dvs-1')
+
+
+def test_unknown_switch_is_fetched_for_once():
+    index, fetches = make_index()
+    for _ in range(3):
+        try:
+            index.names('dvs-9')
+        except Exception as ex:
+            assert 'dvs-9' in str(ex)
+        else:
+            raise AssertionError('Exception expected')
+    assert len(fetches) == 1
+    index.refresh()
+    assert index.names('dvs-1') == set(['pg-a'])
+    assert len(fetches) == 2
+
+
+def test_index_expires(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(network_utils.time, 'time', lambda: now[0])
+    index, fetches = make_index(refresh_seconds=10)
+    index.names('dvs-1')
+    now[0] += 5
+    index.names('dvs-1')
+    assert len(fetches) == 1
+    now[0] += 5
+    index.names('dvs-1')
+    assert len(fetches) == 2
@@ -0,0 +1,146 @@
+# -*- coding:utf-8 -*-
+
+from tools import placement_utils
+from tools.placement_utils import GB
+
+
+def make_host(moid, memory_usage_mb=0, datastores=('datastore-1',),
+              available=True):
+    return {"moid": moid, "name": moid, "parent_moid": "domain-c1",
+            "cpu_capacity_mhz": 10000, "cpu_usage_mhz": 0,
+            "memory_mb": 4096, "memory_usage_mb": memory_usage_mb,
+            "datastores": list(datastores), "available": available}
+
+
+def make_datastore(moid, free_gb, capacity_gb=100, available=True):
+    return {"moid": moid, "name": moid, "capacity": capacity_gb * GB,
+            "freeSpace": free_gb * GB, "available": available}
+
+
+def make_engine(hosts, datastores, **kwargs):
+    fetches = []
+
+    def _fetch(scope):
+        fetches.append(scope)
+        return hosts, datastores
+    engine = placement_utils.PlacementEngine(_fetch, **kwargs)
+    return engine, fetches
+
+
+def test_spread_picks_most_headroom():
+    engine, _ = make_engine(
+        [make_host('host-1', 2048), make_host('host-2', 0)],
+        [make_datastore('datastore-1', 50)])
+    placement = engine.place('scope', memory_mb=512, disk_gb=1)
+    assert placement['host_moid'] == 'host-2'
+    assert placement['ds_name'] == 'datastore-1'
+    assert placement['parent_moid'] == 'domain-c1'
+
+
+def test_best_fit_packs():
+    engine, _ = make_engine(
+        [make_host('host-1', 2048), make_host('host-2', 0)],
+        [make_datastore('datastore-1', 50)], policy='best_fit')
+    assert engine.place('scope', memory_mb=512)['host_moid'] == 'host-1'
+
+
+def test_reservations_until_released():
+    engine, _ = make_engine([make_host('host-1')],
+                            [make_datastore('datastore-1', 10)])
+    first = engine.place('scope', disk_gb=6)
+    try:
+        engine.place('scope', disk_gb=6)
+    except Exception as ex:
+        assert 'No host/datastore' in str(ex)
+    else:
+        raise AssertionError('Exception expected')
+    engine.release(first)
+    engine.place('scope', disk_gb=6)
+
+
+def test_reservations_expire(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(placement_utils.time, 'time', lambda: now[0])
+    engine, _ = make_engine([make_host('host-1')],
+                            [make_datastore('datastore-1', 10)],
+                            reservation_seconds=10)
+    engine.place('scope', disk_gb=6)
+    now[0] += 11
+    engine.place('scope', disk_gb=6)
+
+
+def test_state_cached_until_refresh():
+    engine, fetches = make_engine([make_host('host-1')],
+                                  [make_datastore('datastore-1', 10)])
+    engine.place('scope')
+    engine.place('scope')
+    assert fetches == ['scope']
+    engine.refresh()
+    engine.place('scope')
+    assert fetches == ['scope', 'scope']
+
+
+def test_unavailable_and_excluded_hosts_skipped():
+    engine, _ = make_engine(
+        [make_host('host-1', available=False), make_host('host-2'),
+         make_host('host-3', datastores=('datastore-2',))],
+        [make_datastore('datastore-1', 10),
+         make_datastore('datastore-2', 10, available=False)])
+    placement = engine.place('scope', exclude_host_moids=('host-9',))
+    assert placement['host_moid'] == 'host-2'
+    try:
+        engine.place('scope', exclude_host_moids=('host-2',))
+    except Exception:
+        pass
+    else:
+        raise AssertionError('Exception expected')
+
+
+def test_fixed_host_and_datastore():
+    engine, _ = make_engine(
+        [make_host('host-1', datastores=('datastore-1', 'datastore-2')),
+         make_host('host-2')],
+        [make_datastore('datastore-1', 90), make_datastore('datastore-2', 10)])
+    placement = engine.place('scope', host_moid='host-1',
+                             ds_moid='datastore-2')
+    assert (placement['host_moid'], placement['ds_moid']) == \
+        ('host-1', 'datastore-2')
+
+
+def test_unknown_policy():
+    engine, _ = make_engine([make_host('host-1')],
+                            [make_datastore('datastore-1', 10)],
+                            policy='random')
+    try:
+        engine.place('scope')
+    except Exception as ex:
+        assert 'Unknown placement policy' in str(ex)
+    else:
+        raise AssertionError('Exception expected')
+
+
+def test_require_datastores_mounted():
+    engine, _ = make_engine(
+        [make_host('host-1', datastores=('datastore-1',)),
+         make_host('host-2', 2048, datastores=('datastore-1', 'datastore-2'))],
+        [make_datastore('datastore-1', 50), make_datastore('datastore-2', 50)])
+    placement = engine.place('scope', memory_mb=512, ds_moid='datastore-1',
+                             require_ds_moids=['datastore-1', 'datastore-2'])
+    assert placement['host_moid'] == 'host-2'
+    try:
+        engine.place('scope', ds_moid='datastore-1',
+                     require_ds_moids=['datastore-3'])
+    except Exception as ex:
+        assert 'No host/datastore' in str(ex)
+    else:
+        raise AssertionError('Exception expected')
+
+
+def test_require_datastores_ignores_their_state():
+    engine, _ = make_engine(
+        [make_host('host-1', datastores=('datastore-1', 'datastore-2'))],
+        [make_datastore('datastore-1', 0, available=False),
+         make_datastore('datastore-2', 50)])
+    placement = engine.place('scope', memory_mb=512,
+                             require_ds_moids=['datastore-1'])
+    assert placement['host_moid'] == 'host-1'
@@ -0,0 +1,80 @@
+# -*- coding:utf-8 -*-
+
+from pyVmomi import vim, vmodl
+
+from tools import property_utils
+
+
+class FakePropertyCollector(object):
+
+    def __init__(self, objects=None, missing=False):
+        self.objects = objects or []
+        self.missing = missing
+        self.specs = []
+
+    def RetrievePropertiesEx(self, specSet, options):
+        self.specs.extend(specSet)
+        if self.missing:
+            raise vmodl.fault.ManagedObjectNotFound(
+                obj=specSet[0].objectSet[0].obj)
+        return vmodl.query.PropertyCollector.RetrieveResult(
+            objects=self.objects)
+
+
+def test_object_exists_reads_no_property():
+    task = vim.Task('task-1', None)
+    pc = FakePropertyCollector(
+        [vmodl.query.PropertyCollector.ObjectContent(obj=task)])
+    assert property_utils.object_exists(pc, task)
+    prop_spec = pc.specs[0].propSet[0]
+    assert prop_spec.type is vim.Task
+    assert not prop_spec.all
+    assert list(prop_spec.pathSet) == []
+
+
+def test_object_exists_missing_object():
+    pc = FakePropertyCollector(missing=True)
+    assert not property_utils.object_exists(pc, vim.Task('task-1', None))
+
+
+def test_object_content_to_dict_unset_properties_are_none():
+    vm_mor = vim.VirtualMachine('vm-1', None)
+    obj_content = vmodl.query.PropertyCollector.ObjectContent(
+        obj=vm_mor,
+        propSet=[vmodl.DynamicProperty(name='name', val='vm01')],
+        missingSet=[vmodl.query.PropertyCollector.MissingProperty(
+            path='guest')])
+    props = property_utils.object_content_to_dict(
+        obj_content, ['name', 'runtime.host', 'guest'])
+    assert props == {'mor': vm_mor, 'moid': 'vm-1', 'name': 'vm01',
+                     'runtime.host': None, 'guest': None}
+
+
+def test_retrieve_objects_properties_fills_requested_paths():
+    host = vim.HostSystem('host-1', None)
+    pc = FakePropertyCollector([vmodl.query.PropertyCollector.ObjectContent(
+        obj=host, propSet=[vmodl.DynamicProperty(name='name', val='esxi')])])
+    objects = property_utils.retrieve_objects_properties(
+        pc, [host], ['name', 'summary.quickStats.overallCpuUsage'])
+    assert objects['host-1']['name'] == 'esxi'
+    assert objects['host-1']['summary.quickStats.overallCpuUsage'] is None
+
+
+def test_make_objects_filter_spec_one_prop_spec_per_type():
+    mors = [vim.VirtualMachine('vm-1', None), vim.VirtualMachine('vm-2', None),
+            vim.HostSystem('host-1', None)]
+    filter_spec = property_utils.make_objects_filter_spec(mors, ['name'])
+    assert len(filter_spec.objectSet) == 3
+    assert [p.type for p in filter_spec.propSet] == [vim.VirtualMachine,
+                                                     vim.HostSystem]
+    assert property_utils.get_path_set(filter_spec) == ['name']
+
+
+def test_make_objects_filter_spec_path_set_per_type():
+    mors = [vim.HostSystem('host-1', None), vim.Datastore('ds-1', None)]
+    filter_spec = property_utils.make_objects_filter_spec(
+        mors, {vim.HostSystem: ['parent', 'datastore'],
+               vim.Datastore: ['name']})
+    path_sets = dict((p.type, list(p.pathSet)) for p in filter_spec.propSet)
+    assert path_sets == {vim.HostSystem: ['parent', 'datastore'],
+                         vim.Datastore: ['name']}
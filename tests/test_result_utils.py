@@ -0,0 +1,39 @@
+# -*- coding:utf-8 -*-
+
+from tools import result_utils
+from tools.result_utils import DataResult
+
+
+def make_result(status, message=''):
+    result = DataResult()
+    result.status = status
+    result.message = message
+    return result
+
+
+def test_aggregate_results_all_succeeded():
+    results = {'vm-1': make_result(True), 'vm-2': make_result(True)}
+    result = result_utils.aggregate_results(results)
+    assert result.status
+    assert result.message == "2 succeeded, 0 failed."
+    assert result.data == {"results": results}
+
+
+def test_aggregate_results_some_failed():
+    results = {'vm-1': make_result(True), 'vm-2': make_result(False, 'x')}
+    result = result_utils.aggregate_results(results)
+    assert not result.status
+    assert result.message == "1 succeeded, 1 failed."
+
+
+def test_aggregate_results_empty():
+    result = result_utils.aggregate_results({})
+    assert result.status
+    assert result.message == "0 succeeded, 0 failed."
+
+
+def test_data_result_to_dict():
+    result = make_result(False, 'error')
+    result.task_key = 'task-1'
+    assert dict(result) == {'status': False, 'message': 'error',
+                            'data': None, 'task_key': 'task-1'}
@@ -0,0 +1,102 @@
+# -*- coding:utf-8 -*-
+
+from pyVmomi import vim
+
+from tools import scheduler_utils
+
+
+class FakeTracker(object):
+    """
+    Finishes the tracked tasks in the order they were started, one per
+    wait; finish=False leaves them running.
+    """
+
+    def __init__(self, finish=True):
+        self.finish = finish
+        self.running = []
+        self.waits = []
+
+    def track(self, task_keys):
+        self.running.extend(task_keys)
+
+    def wait(self, timeout=None):
+        self.waits.append(timeout)
+        if not self.finish or not self.running:
+            return []
+        key = self.running.pop(0)
+        return [vim.TaskInfo(key=key, state='success')]
+
+
+def make_start(started, name):
+    def _start():
+        started.append(name)
+        return vim.Task('task-%s' % name, None)
+    return _start
+
+
+def test_per_resource_limit():
+    tracker = FakeTracker()
+    scheduler = scheduler_utils.TaskScheduler(tracker, {'host': 1})
+    started = []
+    for name, host in [('a', 'host-1'), ('b', 'host-1'), ('c', 'host-2')]:
+        scheduler.submit(name, make_start(started, name), [('host', host)])
+    results = list(scheduler.run())
+    # c overtakes b, which waits for a to finish on host-1
+    assert started == ['a', 'c', 'b']
+    assert [key for key, info, error in results] == ['a', 'c', 'b']
+    assert all(error is None for key, info, error in results)
+    assert scheduler.running == 0 and scheduler.queued == 0
+
+
+def test_max_running():
+    tracker = FakeTracker()
+    scheduler = scheduler_utils.TaskScheduler(tracker, max_running=2)
+    started = []
+    for name in 'abc':
+        scheduler.submit(name, make_start(started, name))
+    gen = scheduler.run()
+    next(gen)
+    assert started == ['a', 'b']
+    list(gen)
+    assert started == ['a', 'b', 'c']
+
+
+def test_none_resources_are_unlimited():
+    tracker = FakeTracker()
+    scheduler = scheduler_utils.TaskScheduler(tracker, {'host': 1})
+    started = []
+    for name in 'ab':
+        scheduler.submit(name, make_start(started, name), [('host', None)])
+    gen = scheduler.run()
+    next(gen)
+    assert started == ['a', 'b']
+
+
+def test_start_error_is_yielded():
+    tracker = FakeTracker()
+    scheduler = scheduler_utils.TaskScheduler(tracker)
+
+    def _fail():
+        raise Exception('no such template')
+    scheduler.submit('a', _fail)
+    assert list(scheduler.run()) == [('a', None, 'no such template')]
+
+
+def test_timeout_yields_running_and_queued(monkeypatch):
+    tracker = FakeTracker(finish=False)
+    scheduler = scheduler_utils.TaskScheduler(tracker, {'host': 1})
+    started = []
+    scheduler.submit('a', make_start(started, 'a'), [('host', 'host-1')])
+    scheduler.submit('b', make_start(started, 'b'), [('host', 'host-1')])
+    now = [100.0]
+
+    def _wait(timeout=None):
+        now[0] += timeout
+        return []
+    tracker.wait = _wait
+    monkeypatch.setattr(scheduler_utils.time, 'time', lambda: now[0])
+    results = list(scheduler.run(timeout=5))
+    assert results == [
+        ('a', None, 'Timeout waiting for the task task-a.'),
+        ('b', None, 'Timeout before the task was started.')]
+    assert started == ['a']
@@ -0,0 +1,325 @@
+# -*- coding:utf-8 -*-
+
+import threading
+
+from pyVmomi import vim
+
+import session
+
+
+class FakeStub(object):
+
+    def __init__(self, name, fail=0):
+        self.name = name
+        self.fail = fail
+        self.calls = []
+
+    def InvokeMethod(self, *args, **kwargs):
+        self.calls.append(args)
+        if self.fail:
+            self.fail -= 1
+            raise vim.fault.NotAuthenticated()
+        return self.name
+
+
+class FakeSi(object):
+
+    def __init__(self, stub):
+        self._stub = stub
+
+
+def make_connection(stub):
+    connection = session.VcenterConnection.__new__(session.VcenterConnection)
+    connection.host = 'vc'
+    connection.user = 'user'
+    connection.pwd = 'pwd'
+    connection._si = FakeSi(stub)
+    connection._session_generation = 1
+    connection._reauth_lock = threading.RLock()
+    connection._reauth_local = threading.local()
+    connection.reauth_count = 0
+    connection.reauth_failed_count = 0
+    connection._install_reauth_hook(stub)
+    return connection
+
+
+def test_reauth_replays_on_the_same_stub_after_login():
+    stub = FakeStub('old', fail=1)
+    connection = make_connection(stub)
+
+    class SessionManager(object):
+        currentSession = vim.UserSession(key='s2')
+
+        def Login(self, user, pwd):
+            # the login goes through the hooked stub unhooked
+            assert stub.InvokeMethod('login') == 'old'
+
+    connection._sessionManager = SessionManager()
+    assert stub.InvokeMethod('call') == 'old'
+    assert connection.reauth_count == 1
+    assert connection._session_generation == 2
+
+
+def test_reauth_replays_through_the_new_session_stub():
+    old_stub = FakeStub('old', fail=10)
+    new_stub = FakeStub('new')
+    connection = make_connection(old_stub)
+
+    class SessionManager(object):
+        def Login(self, user, pwd):
+            raise Exception('login on the old stub failed')
+
+    def _create_session():
+        connection._si = FakeSi(new_stub)
+        connection._session_generation += 1
+    connection._sessionManager = SessionManager()
+    connection._create_session = _create_session
+    assert old_stub.InvokeMethod('call') == 'new'
+    # later calls of references bound to the old stub use the new one
+    assert old_stub.InvokeMethod('other') == 'new'
+    assert len(old_stub.calls) == 1
+    assert connection.reauth_count == 1
+
+
+def test_reauth_flag_is_per_thread():
+    stub = FakeStub('old')
+    connection = make_connection(stub)
+    connection._reauth_local.active = True
+    hooked = []
+
+    def _call():
+        stub.fail = 1
+        try:
+            stub.InvokeMethod('call')
+        except Exception:
+            pass
+        hooked.append(stub.fail)
+
+    connection._reauthenticate = lambda generation=None: hooked.append('reauth')
+    thread = threading.Thread(target=_call)
+    thread.start()
+    thread.join()
+    assert hooked[0] == 'reauth'
+
+
+class FakePool(object):
+
+    def __init__(self, vc_info):
+        self.key = session.SessionRegistry.make_key(vc_info)
+        self.vc_info = vc_info
+        self.sizes = []
+
+    def resize(self, size):
+        self.sizes.append(size)
+
+
+def make_registry(monkeypatch):
+    monkeypatch.setattr(session, 'ConnectionPool', FakePool)
+    return session.SessionRegistry()
+
+
+def test_registry_shares_pool_of_same_credential(monkeypatch):
+    registry = make_registry(monkeypatch)
+    pool = registry.acquire(session.VcenterInfo('vc', 'user', 'pwd'))
+    assert registry.acquire(session.VcenterInfo('vc', 'user', 'pwd',
+                                                pool_size=4)) is pool
+    assert pool.sizes == [4]
+    assert registry.refcount(session.VcenterInfo('vc', 'user', 'pwd')) == 2
+
+
+def test_registry_wrong_password_gets_own_pool(monkeypatch):
+    registry = make_registry(monkeypatch)
+    pool = registry.acquire(session.VcenterInfo('vc', 'user', 'pwd'))
+    other = registry.acquire(session.VcenterInfo('vc', 'user', 'wrong'))
+    assert other is not pool
+    assert 'pwd' not in repr(pool.key)
+
+
+def test_registry_rejects_other_session_settings(monkeypatch):
+    registry = make_registry(monkeypatch)
+    registry.acquire(session.VcenterInfo('vc', 'user', 'pwd'))
+    try:
+        registry.acquire(session.VcenterInfo('vc', 'user', 'pwd',
+                                             session_ttl=0))
+    except Exception as ex:
+        assert 'shared_session=False' in str(ex)
+    else:
+        raise AssertionError('Exception expected')
+
+
+class FakeConnection(object):
+
+    count = 0
+
+    def __init__(self, vc_info):
+        FakeConnection.count += 1
+        self.name = 'connection-%d' % FakeConnection.count
+        self.disconnected = False
+
+    def disconnect(self):
+        self.disconnected = True
+
+
+def make_pool(monkeypatch, pool_size=1, max_pool_size=16):
+    monkeypatch.setattr(session, 'VcenterConnection', FakeConnection)
+    return session.ConnectionPool(session.VcenterInfo(
+        'vc', 'user', 'pwd', pool_size=pool_size,
+        max_pool_size=max_pool_size))
+
+
+@session.leased_methods
+class FakeClient(object):
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    def lease(self):
+        return self._pool.lease()
+
+    def current(self):
+        return self._pool.current()
+
+    def iter_current(self, count):
+        for _ in range(count):
+            yield self._pool.current()
+
+
+def test_lease_is_reentrant_and_checked_in_once(monkeypatch):
+    pool = make_pool(monkeypatch)
+    with pool.lease() as outer:
+        with pool.lease() as inner:
+            assert inner is outer
+        assert pool.current() is outer
+        assert not pool._idle
+    assert pool._idle == [outer]
+    assert pool.held() is None
+
+
+def test_interleaved_generators_on_one_thread(monkeypatch):
+    pool = make_pool(monkeypatch)
+    client = FakeClient(pool)
+    first = client.iter_current(2)
+    second = client.iter_current(2)
+    seen = [next(first), next(second), next(first), next(second)]
+    # one connection, shared without a deadlock
+    assert len(set(seen)) == 1
+    assert not pool._idle
+    assert list(first) == [] and list(second) == []
+    assert pool._idle == [seen[0]]
+
+
+def test_generator_binds_connection_only_while_stepping(monkeypatch):
+    pool = make_pool(monkeypatch, pool_size=2)
+    client = FakeClient(pool)
+    gen = client.iter_current(2)
+    connection = next(gen)
+    # between steps the thread has no bound connection
+    assert getattr(pool._local, 'connection', None) is None
+    gen.close()
+    assert connection in pool._idle
+    assert not pool._refs
+
+
+def test_abandoned_generator_checks_connection_in(monkeypatch):
+    pool = make_pool(monkeypatch)
+    client = FakeClient(pool)
+    gen = client.iter_current(3)
+    connection = next(gen)
+    del gen
+    assert pool._idle == [connection]
+    assert not pool._refs
+
+
+def test_generator_outlives_the_lease_it_started_in(monkeypatch):
+    pool = make_pool(monkeypatch)
+    client = FakeClient(pool)
+    with pool.lease() as connection:
+        gen = client.iter_current(2)
+        assert next(gen) is connection
+    # the generator still references the connection
+    assert not pool._idle
+    assert list(gen) == [connection]
+    assert pool._idle == [connection]
+
+
+def test_concurrent_leases_use_own_connections(monkeypatch):
+    pool = make_pool(monkeypatch, pool_size=2)
+    barrier = threading.Barrier(2)
+    leased = []
+
+    def _lease():
+        with pool.lease() as connection:
+            barrier.wait(timeout=5)
+            leased.append(connection)
+
+    threads = [threading.Thread(target=_lease) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(leased)) == 2
+    assert len(pool._connections) == 2
+
+
+def lease_at_once(pool, count):
+    barrier = threading.Barrier(count)
+    leased = []
+
+    def _lease():
+        with pool.lease() as connection:
+            leased.append(connection)
+            barrier.wait(timeout=5)
+
+    threads = [threading.Thread(target=_lease) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return leased
+
+
+def test_overflow_connections_are_logged_out_after_the_batch(monkeypatch):
+    pool = make_pool(monkeypatch)
+    with pool.overflow(3):
+        leased = lease_at_once(pool, 3)
+        assert len(pool._connections) == 3
+    assert pool._connections == [pool.primary]
+    assert pool._idle == [pool.primary]
+    assert [c.disconnected for c in leased if c is not pool.primary] == \
+        [True, True]
+
+
+def test_overflow_is_bounded_by_max_pool_size(monkeypatch):
+    pool = make_pool(monkeypatch, max_pool_size=2)
+    with pool.overflow(64):
+        assert pool._limit() == 2
+        with pool.overflow(64):
+            assert pool._limit() == 2
+    assert pool._limit() == 1
+    assert pool._overflow == 0
+
+
+def test_session_checks_counted_from_many_threads():
+    connection = make_connection(FakeStub('stub'))
+    connection.session_ttl = 0
+    connection.session_check_count = 0
+    connection._session_id = 's1'
+    connection._session_checked_at = 0
+
+    class SessionManager(object):
+
+        def SessionIsActive(self, session_id, user):
+            return True
+
+    connection._sessionManager = SessionManager()
+
+    def _check():
+        for _ in range(200):
+            connection.service_instance
+
+    threads = [threading.Thread(target=_check) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert connection.session_stats['session_checks'] == 1600
@@ -0,0 +1,87 @@
+# -*- coding:utf-8 -*-
+
+from pyVmomi import vim, vmodl
+
+from tools import task_utils
+
+
+class FakeCollector(object):
+
+    def __init__(self):
+        self.waits = []
+        self.filters = []
+
+    def CreatePropertyCollector(self):
+        return self
+
+    def CreateFilter(self, spec, partialUpdates):
+        pf = vmodl.query.PropertyCollector.Filter(
+            'filter-%d' % len(self.filters), None)
+        self.filters.append(spec)
+        return pf
+
+    def WaitForUpdatesEx(self, version, options):
+        self.waits.append(options.maxWaitSeconds)
+        return None
+
+    def DestroyPropertyCollector(self):
+        pass
+
+
+class FakeContent(object):
+
+    def __init__(self, pc):
+        self.propertyCollector = pc
+
+
+class FakeSi(object):
+
+    def __init__(self, pc):
+        self._stub = None
+        self.content = FakeContent(pc)
+
+
+def make_tracker():
+    pc = FakeCollector()
+    tracker = task_utils.TaskTracker(FakeSi(pc))
+    tracker.track(['task-1'])
+    return tracker, pc
+
+
+def test_wait_rounds_the_last_second_up(monkeypatch):
+    tracker, pc = make_tracker()
+    now = [100.0]
+    monkeypatch.setattr(task_utils.time, 'time', lambda: now[0])
+
+    def _wait(version, options):
+        pc.waits.append(options.maxWaitSeconds)
+        now[0] += 0.6
+    pc.WaitForUpdatesEx = _wait
+    assert tracker.wait(1.5) == []
+    # 1.5 -> 2 secs, the waits below the last sec are not 0 (busy loop)
+    assert pc.waits == [2, 1, 1]
+
+
+def test_wait_keeps_at_least_one_second(monkeypatch):
+    tracker, pc = make_tracker()
+    now = [100.0]
+    monkeypatch.setattr(task_utils.time, 'time', lambda: now[0])
+
+    def _wait(version, options):
+        pc.waits.append(options.maxWaitSeconds)
+        now[0] += 0.3
+    pc.WaitForUpdatesEx = _wait
+    tracker.wait(0.2)
+    assert pc.waits == [1]
+
+
+def test_wait_without_timeout_uses_max_wait(monkeypatch):
+    tracker, pc = make_tracker()
+    calls = []
+
+    def _wait(version, options):
+        calls.append(options.maxWaitSeconds)
+        tracker._done.append(vim.TaskInfo(key='task-1', state='success'))
+    pc.WaitForUpdatesEx = _wait
+    assert [info.key for info in tracker.wait()] == ['task-1']
+    assert calls == [60]
@@ -0,0 +1,55 @@
+# -*- coding:utf-8 -*-
+
+from pyVmomi import vim
+
+from tools import vm
+
+
+def test_make_property_tree_nests_paths():
+    devices = [vim.vm.device.VirtualDisk(key=2000)]
+    tree = vm._make_property_tree({'name': 'vm01',
+                                   'config.hardware.device': devices,
+                                   'config.changeVersion': '1'})
+    assert tree['name'] == 'vm01'
+    assert tree['config'].hardware.device is devices
+    assert tree['config'].changeVersion == '1'
+
+
+def test_make_property_tree_unset_node_is_none():
+    tree = vm._make_property_tree({'config.hardware.device': None,
+                                   'config.changeVersion': None})
+    assert tree['config'] is None
+
+
+def test_prefetched_vm_reads_prefetched_properties():
+    vm_mor = vim.VirtualMachine('vm-1', None)
+    prefetched = vm.PrefetchedVM({'mor': vm_mor, 'moid': 'vm-1',
+                                  'name': 'vm01', 'guest': None,
+                                  'config.hardware.device': []})
+    assert prefetched._moId == 'vm-1'
+    assert prefetched.name == 'vm01'
+    assert prefetched.guest is None
+    assert prefetched.config.hardware.device == []
+
+
+def test_property_node_missing_attribute():
+    tree = vm._make_property_tree({'config.hardware.device': []})
+    try:
+        tree['config'].files
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError('AttributeError expected')
+
+
+def test_get_vm_referenced_mors():
+    ds_mor = vim.Datastore('datastore-1', None)
+    host_mor = vim.HostSystem('host-1', None)
+    disk = vim.vm.device.VirtualDisk(
+        key=2000,
+        backing=vim.vm.device.VirtualDisk.FlatVer2BackingInfo(
+            fileName='[ds1] vm01/vm01.vmdk', datastore=ds_mor))
+    summary = vim.vm.Summary(runtime=vim.vm.RuntimeInfo(host=host_mor))
+    mors = vm.get_vm_referenced_mors({'summary': summary,
+                                      'config.hardware.device': [disk, disk]})
+    assert sorted(m._moId for m in mors) == ['datastore-1', 'host-1']
@@ -0,0 +1,302 @@
+# -*- coding:utf-8 -*-
+
+from pyVmomi import vim
+
+from tools import vm
+from tools import vm_utils
+
+
+def make_disk(key, controller_key, unit_number):
+    return vim.vm.device.VirtualDisk(key=key, controllerKey=controller_key,
+                                     unitNumber=unit_number)
+
+
+def test_scsi_slot_allocator_lowest_free_skips_controller_unit():
+    allocator = vm_utils.ScsiSlotAllocator()
+    slots = [allocator.allocate() for _ in range(8)]
+    assert slots == ['0:0', '0:1', '0:2', '0:3', '0:4', '0:5', '0:6', '0:8']
+    assert allocator.allocate(bus_number=2) == '2:0'
+
+
+def test_scsi_slot_allocator_reserve_and_free():
+    allocator = vm_utils.ScsiSlotAllocator()
+    allocator.reserve('0:0')
+    assert not allocator.is_free('0:0')
+    try:
+        allocator.reserve('0:0')
+    except Exception as ex:
+        assert 'in use' in str(ex)
+    else:
+        raise AssertionError('Exception expected')
+    assert allocator.allocate() == '0:1'
+    allocator.free('0:0')
+    assert allocator.allocate() == '0:0'
+
+
+def test_scsi_slot_allocator_rejects_bad_vdev_nodes():
+    allocator = vm_utils.ScsiSlotAllocator()
+    for vdev_node in ('0:7', '4:0', '0:16', 'x', None):
+        try:
+            allocator.reserve(vdev_node)
+        except Exception as ex:
+            assert 'vdev node error' in str(ex)
+        else:
+            raise AssertionError('Exception expected: %s' % vdev_node)
+
+
+def test_scsi_slot_allocator_full():
+    allocator = vm_utils.ScsiSlotAllocator()
+    for _ in range(4 * 15):
+        allocator.allocate()
+    try:
+        allocator.allocate()
+    except Exception as ex:
+        assert 'No SCSI controllers' in str(ex)
+    else:
+        raise AssertionError('Exception expected')
+
+
+def test_scsi_slot_allocator_copy_is_independent():
+    allocator = vm_utils.ScsiSlotAllocator()
+    allocator.allocate()
+    copied = allocator.copy()
+    assert copied.allocate() == '0:1'
+    assert allocator.allocate() == '0:1'
+
+
+def test_make_scsi_slot_allocator_from_devices():
+    devices = [vim.vm.device.VirtualLsiLogicController(key=1000, busNumber=0),
+               vim.vm.device.ParaVirtualSCSIController(key=1001, busNumber=1),
+               vim.vm.device.VirtualIDEController(key=200, busNumber=0),
+               make_disk(2000, 1000, 0), make_disk(2016, 1001, 0),
+               make_disk(3000, 200, 1)]
+    allocator = vm_utils.make_scsi_slot_allocator(devices)
+    assert not allocator.is_free('0:0')
+    assert not allocator.is_free('1:0')
+    assert allocator.is_free('0:1')
+
+
+def test_assign_vdev_nodes_reserves_given_first():
+    disks = [{'disk_size': 1}, {'disk_size': 1, 'vdev_node': '0:0'}]
+    vm_utils.assign_vdev_nodes(vm_utils.ScsiSlotAllocator(), disks)
+    assert [disk['vdev_node'] for disk in disks] == ['0:1', '0:0']
+
+
+def make_saved_template(nic_count):
+    nic_setting_map = [vim.vm.customization.AdapterMapping(
+        adapter=vim.vm.customization.IPSettings(
+            ip=vim.vm.customization.FixedIp(ipAddress='10.0.0.%d' % i),
+            subnetMask='255.255.255.0'))
+        for i in range(nic_count)]
+    identity = vim.vm.customization.LinuxPrep(
+        hostName=vim.vm.customization.FixedName(name='localhost'),
+        domain='test.local')
+    return vm_utils.CustomizationTemplate(
+        identity, vim.vm.customization.GlobalIPSettings(), nic_setting_map)
+
+
+def adapter_ips(custom_spec):
+    return [getattr(m.adapter.ip, 'ipAddress', 'dhcp')
+            for m in custom_spec.nicSettingMap]
+
+
+def test_custom_template_truncates_saved_nic_settings():
+    template = make_saved_template(3)
+    custom_spec = template.make_spec({'name': 'vm01'},
+                                     [{'pg_moid': 'network-1'}])
+    assert adapter_ips(custom_spec) == ['10.0.0.0']
+    assert custom_spec.identity.hostName.name == 'vm01'
+
+
+def test_custom_template_skips_removed_nics():
+    template = make_saved_template(2)
+    custom_spec = template.make_spec(
+        {'name': 'vm01'},
+        [{'ip': '10.1.0.5', 'netmask': '255.255.0.0'}, None])
+    assert adapter_ips(custom_spec) == ['10.1.0.5']
+
+
+def test_custom_template_pads_with_dhcp():
+    template = make_saved_template(1)
+    custom_spec = template.make_spec({'name': 'vm01'},
+                                     [{'pg_moid': 'network-1'}] * 2)
+    assert adapter_ips(custom_spec) == ['10.0.0.0', 'dhcp']
+
+
+def test_custom_template_keeps_identity_of_template():
+    template = make_saved_template(0)
+    template.make_spec({'name': 'vm01'}, [])
+    assert template.identity.hostName.name == 'localhost'
+
+
+def make_vm_info(**kwargs):
+    vm_info = {
+        'numCpu': 2,
+        'memorySizeMB': 2048,
+        'network': [{'key': 4001, 'adapter_type': 'VMXNET3',
+                     'pg_moid': 'network-2'},
+                    {'key': 4000, 'adapter_type': 'VMXNET3',
+                     'pg_moid': 'network-1'}],
+        'disk': [{'key': 2000, 'vdev_node': '0:0', 'capacityKB': 20971520},
+                 {'key': 2001, 'vdev_node': '0:1', 'capacityKB': 10485760}],
+    }
+    vm_info.update(kwargs)
+    return vm_info
+
+
+def test_diff_vm_state_converged():
+    changes = vm_utils.diff_vm_state(
+        make_vm_info(), {'num_cpu': 2, 'memoryMB': 2048},
+        [{'pg_moid': 'network-1'}, {'pg_moid': 'network-2'}],
+        [{'vdev_node': '0:0', 'disk_size': 20}, {'disk_size': 10}])
+    assert changes == {}
+
+
+def test_diff_vm_state_cpu_memory():
+    changes = vm_utils.diff_vm_state(make_vm_info(),
+                                     {'num_cpu': '4', 'memoryMB': 2048})
+    assert changes == {'cpu_num': 4}
+
+
+def test_diff_vm_state_nics_in_key_order():
+    changes = vm_utils.diff_vm_state(
+        make_vm_info(), nics=[{'pg_moid': 'network-3'},
+                              {'pg_moid': 'network-2', 'adapter_type': 'E1000'},
+                              {'pg_moid': 'network-4'}])
+    assert changes == {
+        'edit_nics': [{'dev_key': 4000, 'pg_moid': 'network-3'}],
+        'del_nics': [{'dev_key': 4001}],
+        'add_nics': [{'pg_moid': 'network-2', 'adapter_type': 'E1000'},
+                     {'pg_moid': 'network-4'}],
+    }
+    changes = vm_utils.diff_vm_state(make_vm_info(),
+                                     nics=[{'pg_moid': 'network-1'}])
+    assert changes == {'del_nics': [{'dev_key': 4001}]}
+
+
+def test_diff_vm_state_disks():
+    changes = vm_utils.diff_vm_state(
+        make_vm_info(), disks=[{'vdev_node': '0:1', 'disk_size': 15},
+                               {'disk_size': None},
+                               {'disk_size': 5, 'ds_moid': 'datastore-1'}])
+    assert changes == {
+        'disks': [{'dev_key': 2001, 'disk_size': 15}],
+        'add_disks': [{'disk_size': 5, 'ds_moid': 'datastore-1'}],
+    }
+    try:
+        vm_utils.diff_vm_state(make_vm_info(),
+                               disks=[{'vdev_node': '0:0', 'disk_size': 10}])
+    except Exception as ex:
+        assert '0:0' in str(ex)
+    else:
+        raise AssertionError('Exception expected')
+
+
+def test_diff_vm_reads_config_hardware_only():
+    ds_mor = vim.Datastore('datastore-1', None)
+    disk = vim.vm.device.VirtualDisk(
+        key=2000, controllerKey=1000, capacityInKB=20971520,
+        deviceInfo=vim.Description(label='Hard disk 1', summary=''),
+        backing=vim.vm.device.VirtualDisk.FlatVer2BackingInfo(
+            fileName='[ds1] vm01/vm01.vmdk', datastore=ds_mor,
+            diskMode='persistent', thinProvisioned=True))
+    nic = vim.vm.device.VirtualVmxnet3(
+        key=4000,
+        deviceInfo=vim.Description(label='Network adapter 1',
+                                   summary='network-1'),
+        connectable=vim.vm.device.VirtualDevice.ConnectInfo(connected=True),
+        backing=vim.vm.device.VirtualEthernetCard.NetworkBackingInfo(
+            network=vim.Network('network-1', None)))
+    # the guest and summary are not prefetched, reading them would go to
+    # the server through the stub-less managed object
+    prefetched = vm.PrefetchedVM(
+        {'mor': vim.VirtualMachine('vm-1', None), 'name': 'vm01',
+         'config.hardware.numCPU': 2, 'config.hardware.memoryMB': 2048,
+         'config.hardware.device': [disk, nic]},
+        {'datastore-1': 'ds1'})
+    changes = vm_utils.diff_vm(prefetched, {'num_cpu': 2, 'memoryMB': 4096},
+                               [{'pg_moid': 'network-1'}],
+                               [{'vdev_node': '0:0', 'disk_size': 20}])
+    assert changes == {'memory_mb': 4096}
+
+
+def make_layout_disk(key, file_keys):
+    return vim.vm.FileLayoutEx.DiskLayout(
+        key=key, chain=[vim.vm.FileLayoutEx.DiskUnit(fileKey=[file_key])
+                        for file_key in file_keys])
+
+
+def make_layout():
+    files = [vim.vm.FileLayoutEx.FileInfo(key=0, name='[ds1] vm01/vm01.vmx',
+                                          size=4),
+             vim.vm.FileLayoutEx.FileInfo(key=1, name='[ds1] vm01/vm01.nvram',
+                                          size=6),
+             vim.vm.FileLayoutEx.FileInfo(key=2, name='[ds1] vm01/vm01.vmdk',
+                                          size=100),
+             vim.vm.FileLayoutEx.FileInfo(
+                 key=3, name='[ds1] vm01/vm01-000001.vmdk', size=20),
+             vim.vm.FileLayoutEx.FileInfo(key=4, name='[ds2] vm01/vm01.vmdk',
+                                          size=300)]
+    disks = [make_layout_disk(2000, [2, 3]), make_layout_disk(2001, [4])]
+    return files, disks
+
+
+def make_backed_disk(key, ds_moid):
+    return vim.vm.device.VirtualDisk(
+        key=key, backing=vim.vm.device.VirtualDisk.FlatVer2BackingInfo(
+            datastore=vim.Datastore(ds_moid, None)))
+
+
+def test_get_layout_sizes():
+    disk_sizes, home_size = vm_utils.get_layout_sizes(*make_layout())
+    assert disk_sizes == {2000: 120, 2001: 300}
+    assert home_size == 10
+    assert vm_utils.get_layout_sizes(None, None) == ({}, 0)
+
+
+def test_get_relocate_transfers_skips_pinned_disks():
+    devices = [make_backed_disk(2000, 'datastore-1'),
+               make_backed_disk(2001, 'datastore-2')]
+    sizes = vm_utils.get_layout_sizes(*make_layout())
+    spec = vim.vm.RelocateSpec(
+        datastore=vim.Datastore('datastore-3', None),
+        disk=[vim.vm.RelocateSpec.DiskLocator(
+            diskId=2001, datastore=vim.Datastore('datastore-2', None))])
+    transfers = vm_utils.get_relocate_transfers(devices, sizes,
+                                                'datastore-1', spec)
+    assert transfers == {('datastore-1', 'datastore-3'): 130}
+
+    spec = vim.vm.RelocateSpec(disk=[vim.vm.RelocateSpec.DiskLocator(
+        diskId=2001, datastore=vim.Datastore('datastore-3', None))])
+    transfers = vm_utils.get_relocate_transfers(devices, sizes,
+                                                'datastore-1', spec)
+    assert transfers == {('datastore-2', 'datastore-3'): 300}
+
+
+def test_copy_data_object_unbinds_managed_objects():
+    ds_mor = vim.Datastore('datastore-1', object())
+    disk = make_backed_disk(2000, 'datastore-1')
+    disk.backing.datastore = ds_mor
+    copied = vm_utils.copy_data_object(disk, unbind=True)
+    assert copied.backing.datastore._moId == 'datastore-1'
+    assert copied.backing.datastore._stub is None
+    assert disk.backing.datastore is ds_mor
+    assert vm_utils.copy_data_object(disk).backing.datastore is ds_mor
+
+
+def test_template_layout_devices_are_unbound():
+    disk = make_backed_disk(2000, 'datastore-1')
+    disk.backing.datastore = vim.Datastore('datastore-1', object())
+    nic = vim.vm.device.VirtualVmxnet3(
+        key=4000,
+        backing=vim.vm.device.VirtualEthernetCard.NetworkBackingInfo(
+            network=vim.Network('network-1', object())))
+    template = vm.PrefetchedVM(
+        {'mor': vim.VirtualMachine('vm-1', None), 'snapshot': None,
+         'config.hardware.device': [disk, nic],
+         'config.changeVersion': '1', 'config.guestId': 'otherGuest',
+         'config.template': True})
+    layout = vm_utils.TemplateLayout(template)
+    assert layout.disk_devices[0].backing.datastore._stub is None
+    assert layout.nic_devices[0].backing.network._stub is None
+    assert layout.nic_devices[0].backing.network._moId == 'network-1'
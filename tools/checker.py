@@ -1,9 +1,16 @@
 # -*- coding:utf-8 -*-
 
+import logging
+
 from pyVim import task
 from pyVmomi import vim
 from pyVmomi import vmodl
 
+from . import task_utils
+
+
+LOG = logging.getLogger(__name__)
+
 
 class CheckResult:
     """
@@ -13,15 +20,41 @@ class CheckResult:
     def __init__(self):
         # 状态 warning,error,success
         self.status = "success"
-        # 消息
+        # 消息, the first error or warning
         self.msg = ""
+        # all warning/error messages
+        self.warnings = []
+        self.errors = []
+
+    def add(self, result):
+        """
+        Add the warnings/errors of a vim.vm.check.Result.
+        """
+        self.warnings.extend(w.msg for w in result.warning or [])
+        self.errors.extend(e.msg for e in result.error or [])
+        self._update()
+
+    def add_error(self, msg):
+        self.errors.append(msg)
+        self._update()
+
+    def _update(self):
+        if self.errors:
+            self.status = 'error'
+            self.msg = self.errors[0]
+        elif self.warnings:
+            self.status = 'warning'
+            self.msg = self.warnings[0]
+        else:
+            self.status = 'success'
+            self.msg = "兼容性检查成功"
 
     def keys(self):
         """
         当对实例化对象使用dict(obj)的时候, 会调用这个方法。
         这里定义了字典的键, 其对应的值将以obj['name']的形式取。
         """
-        return ('status', 'msg')
+        return ('status', 'msg', 'warnings', 'errors')
 
     def __getitem__(self, item):
         """
@@ -37,8 +70,19 @@ class VmChecker():
     """
 
     def __init__(self, si):
-        self.vmProvisioningChecker = si.content.vmProvisioningChecker
-        self.vmCompatibilityChecker = si.content.vmCompatibilityChecker
+        """
+        @param si: the ServiceInstance, or a callable returning the one of
+                   the calling thread (the checkers are bound to its stub)
+        """
+        self._get_si = si if callable(si) else lambda: si
+
+    @property
+    def vmProvisioningChecker(self):
+        return self._get_si().content.vmProvisioningChecker
+
+    @property
+    def vmCompatibilityChecker(self):
+        return self._get_si().content.vmCompatibilityChecker
 
     def query_vmotion_compatibility(self, vm_mor, host_mor):
         """
@@ -70,15 +114,7 @@ class VmChecker():
             task_state = task.WaitForTask(task_mor)
             if task_state == 'success':
                 for result in task_mor.info.result:
-                    if result.warning:
-                        check_result.status = 'warning'
-                        check_result.msg = result.warning[0].msg
-                    elif result.error:
-                        check_result.status = 'error'
-                        check_result.msg = result.error[0].msg
-                    else:
-                        check_result.status = 'success'
-                        check_result.msg = "兼容性检查成功"
+                    check_result.add(result)
             else:
                 check_result.status = 'error'
                 check_result.msg = "兼容性检查失败"
@@ -110,15 +146,7 @@ class VmChecker():
             task_state = task.WaitForTask(task_mor)
             if task_state == 'success':
                 for result in task_mor.info.result:
-                    if result.warning:
-                        check_result.status = 'warning'
-                        check_result.msg = result.warning[0].msg
-                    elif result.error:
-                        check_result.status = 'error'
-                        check_result.msg = result.error[0].msg
-                    else:
-                        check_result.status = 'success'
-                        check_result.msg = "兼容性检查成功"
+                    check_result.add(result)
             else:
                 check_result.status = 'error'
                 check_result.msg = "兼容性检查失败"
@@ -153,15 +181,7 @@ class VmChecker():
             task_state = task.WaitForTask(task_mor)
             if task_state == 'success':
                 for result in task_mor.info.result:
-                    if result.warning:
-                        check_result.status = 'warning'
-                        check_result.msg = result.warning[0].msg
-                    elif result.error:
-                        check_result.status = 'error'
-                        check_result.msg = result.error[0].msg
-                    else:
-                        check_result.status = 'success'
-                        check_result.msg = "兼容性检查成功"
+                    check_result.add(result)
             else:
                 check_result.status = 'error'
                 check_result.msg = "兼容性检查失败"
@@ -175,3 +195,106 @@ class VmChecker():
             check_result.status = 'error'
             check_result.msg = "InvalidArgument: %s" % str(ex)
         return check_result
+
+    def _wait_checks(self, checks, timeout=None):
+        """
+        Wait for check tasks started at once, return
+        {vm moid: {host moid: CheckResult}}.
+
+        @param checks: {task key: (vm moids, host moid)}, the VMs and
+                       target host of every task
+        Every VM has an entry under the target host, a success unless a
+        finding names that host; the findings are keyed by the host they
+        name, e.g. a warning about the source host.
+        """
+        results = {}
+
+        def _get_result(vm_moid, host_moid):
+            return results.setdefault(vm_moid, {}).setdefault(
+                host_moid, CheckResult())
+
+        for task_info in task_utils.wait_for_tasks(
+                self._get_si(), list(checks.keys()), timeout):
+            vm_moids, host_moid = checks.pop(task_info.key)
+            if task_info.state != 'success':
+                error = task_info.error
+                msg = getattr(error, 'msg', None) or str(error)
+                for vm_moid in vm_moids:
+                    _get_result(vm_moid, host_moid).add_error(msg)
+                continue
+            for vm_moid in vm_moids:
+                # the target entry stays a success unless a finding names it
+                _get_result(vm_moid, host_moid)
+            for result in task_info.result or []:
+                if result.vm is None:
+                    continue
+                # a finding is keyed by the host it names
+                _get_result(result.vm._moId,
+                            result.host._moId if result.host else host_moid
+                            ).add(result)
+        for vm_moids, host_moid in checks.values():
+            for vm_moid in vm_moids:
+                _get_result(vm_moid, host_moid).add_error(
+                    "Timeout waiting for the check.")
+        return results
+
+    def check_migrate_vms(self, targets, power_state=None, test_type=None,
+                          timeout=None):
+        """
+        迁移检查, many VMs against many targets.
+
+        One CheckMigrate task checks all VMs of a target, the tasks of all
+        targets run at once and are waited on together.
+        targets: [(vm_mors, host_mor, res_pool_mor)]
+        power_state/test_type: see check_migrate
+        return: {vm moid: {host moid: CheckResult}}, host moid None if
+                neither the target nor the finding names a host
+        """
+        checks = {}
+        errors = []
+        for (vm_mors, host_mor, res_pool_mor) in targets:
+            vm_mors = list(vm_mors)
+            vm_moids = [vm_mor._moId for vm_mor in vm_mors]
+            host_moid = host_mor._moId if host_mor else None
+            try:
+                task_mor = self.vmProvisioningChecker.CheckMigrate(
+                    vm_mors, host_mor, res_pool_mor, power_state, test_type)
+                checks[task_mor._moId] = (vm_moids, host_moid)
+            except vmodl.MethodFault as ex:
+                LOG.exception(ex)
+                errors.append((vm_moids, host_moid, "%s: %s" % (
+                    ex.__class__.__name__.split('.')[-1], ex.msg)))
+        results = self._wait_checks(checks, timeout)
+        for (vm_moids, host_moid, msg) in errors:
+            for vm_moid in vm_moids:
+                results.setdefault(vm_moid, {}).setdefault(
+                    host_moid, CheckResult()).add_error(msg)
+        return results
+
+    def check_relocate_vms(self, relocates, test_type=None, timeout=None):
+        """
+        放置检查, many VMs.
+
+        CheckRelocate takes one VM, the tasks of all VMs run at once and
+        are waited on together.
+        relocates: [(vm_mor, relocate_spec)]
+        return: {vm moid: {host moid: CheckResult}}
+        """
+        checks = {}
+        errors = []
+        for (vm_mor, relocate_spec) in relocates:
+            host_moid = relocate_spec.host._moId if relocate_spec.host \
+                else None
+            try:
+                task_mor = self.vmProvisioningChecker.CheckRelocate(
+                    vm_mor, relocate_spec, test_type)
+                checks[task_mor._moId] = ([vm_mor._moId], host_moid)
+            except vmodl.MethodFault as ex:
+                LOG.exception(ex)
+                errors.append((vm_mor._moId, host_moid, "%s: %s" % (
+                    ex.__class__.__name__.split('.')[-1], ex.msg)))
+        results = self._wait_checks(checks, timeout)
+        for (vm_moid, host_moid, msg) in errors:
+            results.setdefault(vm_moid, {}).setdefault(
+                host_moid, CheckResult()).add_error(msg)
+        return results
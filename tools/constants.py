@@ -1,10 +1,34 @@
 # -*- coding:utf-8 -*-
 
-from pyVmomi import vim
+from pyVmomi import vim, vmodl
 
 
 MIN_VC_VERSION = '5.5.0'
 
+# managed object lookup mode
+MOR_LOOKUP_DIRECT = 'direct'
+MOR_LOOKUP_SCAN = 'scan'
+
+# vCenter managed object id prefix -> managed object type, the longest
+# prefix first.
+MOID_PREFIX_TYPES = [
+    ('dvportgroup-', vim.dvs.DistributedVirtualPortgroup),
+    ('datacenter-', vim.Datacenter),
+    ('datastore-', vim.Datastore),
+    ('resgroup-v', vim.VirtualApp),
+    ('resgroup-', vim.ResourcePool),
+    ('snapshot-', vim.vm.Snapshot),
+    ('domain-c', vim.ClusterComputeResource),
+    ('domain-s', vim.ComputeResource),
+    ('network-', vim.Network),
+    ('group-p', vim.StoragePod),
+    ('group-', vim.Folder),
+    ('host-', vim.HostSystem),
+    ('task-', vim.Task),
+    ('dvs-', vim.dvs.VmwareDistributedVirtualSwitch),
+    ('vm-', vim.VirtualMachine),
+]
+
 DISK_TYPE_THIN = 'thin'
 DISK_TYPE_PREALLOCATED = 'preallocated'
 DISK_TYPE_EAGER_ZEROED_THICK = 'eagerZeroedThick'
@@ -29,6 +53,109 @@ SCSI_CONTROLLER_NAME = {
     'vim.vm.device.ParaVirtualSCSIController': 'ParaVirtual',
 }
 
+# threads submitting tasks of a batch operation
+BATCH_CONCURRENCY = 8
+
+# vm power operation: (vim.VirtualMachine method, message name,
+#                      needs guest operations ready)
+VM_POWER_OPERATIONS = {
+    'poweron': ('PowerOnVM_Task', 'PowerOn VM', False),
+    'poweroff': ('PowerOffVM_Task', 'PowerOff VM', False),
+    'reset': ('ResetVM_Task', 'Reset VM', False),
+    'suspend': ('SuspendVM_Task', 'Suspend VM', False),
+    'shutdown': ('ShutdownGuest', 'Shutdown VM Guest', True),
+    'reboot': ('RebootGuest', 'Reboot VM Guest', True),
+}
+
+# PropertyCollector page size of the vm list
+VM_PAGE_SIZE = 200
+
+# PropertyCollector property paths of the inventory lists
+HOST_LIST_PROPERTIES = ['name', 'parent', 'runtime.connectionState',
+                        'runtime.powerState', 'runtime.inMaintenanceMode']
+DATASTORE_LIST_PROPERTIES = ['name', 'summary.type', 'summary.url',
+                             'summary.capacity', 'summary.freeSpace',
+                             'summary.accessible']
+
+# running clone tasks of a batch clone per host/per datastore/in total,
+# below the vCenter provisioning limits so its task queue keeps moving
+CLONE_HOST_LIMIT = 4
+CLONE_DATASTORE_LIMIT = 8
+CLONE_MAX_RUNNING = 32
+
+# template properties the clone specs are made from
+CLONE_TEMPLATE_PROPERTIES = ['name', 'config.changeVersion',
+                             'config.hardware.device', 'config.guestId',
+                             'config.template', 'snapshot.currentSnapshot']
+
+# linked clone: the base snapshot created on a source VM without snapshot,
+# and the relocate disk move type sharing the template disks
+LINKED_CLONE_SNAPSHOT_NAME = 'linked-clone-base'
+DISK_MOVE_TYPE_LINKED = 'createNewChildDiskBacking'
+
+# instant clone: the minimum vCenter version and the parent properties the
+# clone specs are made from
+MIN_INSTANT_CLONE_VC_VERSION = '6.7.0'
+INSTANT_CLONE_PARENT_PROPERTIES = ['name', 'config.hardware.device']
+
+# placement: the host/datastore properties of the placement state and the
+# secs the state of a scope is cached
+PLACEMENT_HOST_PROPERTIES = ['name', 'parent', 'datastore',
+                             'runtime.connectionState',
+                             'runtime.inMaintenanceMode',
+                             'summary.hardware.cpuMhz',
+                             'summary.hardware.numCpuCores',
+                             'summary.hardware.memorySize',
+                             'summary.quickStats.overallCpuUsage',
+                             'summary.quickStats.overallMemoryUsage']
+PLACEMENT_DATASTORE_PROPERTIES = ['name', 'summary.capacity',
+                                  'summary.freeSpace', 'summary.accessible',
+                                  'summary.maintenanceMode']
+PLACEMENT_REFRESH_SECONDS = 60
+
+# reconcile: vm.VM_HARDWARE_INFO_PROPERTIES the current state is diffed
+# from, and the config changeVersion the reconfigure spec is checked against
+RECONCILE_VM_PROPERTIES = ['name', 'config.hardware.numCPU',
+                           'config.hardware.memoryMB',
+                           'config.hardware.device', 'config.changeVersion']
+
+# host evacuation: running vMotions per source/destination host (vSphere
+# runs up to 8 per host on a 10GbE vMotion network), the VM properties the
+# evacuation plan is made from, and the retries of a vMotion failed with a
+# transient fault
+VMOTION_SOURCE_LIMIT = 8
+VMOTION_DESTINATION_LIMIT = 8
+EVACUATE_VM_PROPERTIES = ['name', 'datastore', 'runtime.powerState',
+                          'config.template', 'summary.config.memorySizeMB',
+                          'summary.quickStats.overallCpuUsage']
+MIGRATE_RETRIES = 3
+MIGRATE_TRANSIENT_FAULTS = (vim.fault.TaskInProgress, vim.fault.Timedout,
+                            vim.fault.ResourceInUse,
+                            vmodl.fault.HostCommunication)
+
+# rolling host maintenance: hosts per cluster in maintenance mode at a time
+HOST_ROLLING_WINDOW = 1
+
+# storage vMotion: running moves per source/destination datastore (vSphere
+# runs up to 8 per datastore) and the VM properties the moves are made from
+SVMOTION_SOURCE_LIMIT = 4
+SVMOTION_DESTINATION_LIMIT = 4
+RELOCATE_VM_PROPERTIES = ['name', 'datastore', 'layoutEx.file',
+                          'layoutEx.disk', 'config.files.vmPathName',
+                          'config.hardware.device']
+
+# datastore browsing: running SearchDatastoreSubFolders_Task in total and
+# the datastore properties the searches are started from
+DATASTORE_SEARCH_MAX_RUNNING = 16
+DATASTORE_SEARCH_PROPERTIES = ['name', 'browser', 'summary.accessible']
+
+# secs the distributed portgroup name index is cached
+PORTGROUP_INDEX_REFRESH_SECONDS = 60
+
+# the hostname a compiled customization template is made with, replaced by
+# the hostname of every VM
+CUSTOM_TEMPLATE_HOSTNAME = 'localhost'
+
 
 LINUX_OS_TYPES = set([
     'centos64Guest',
@@ -0,0 +1,154 @@
+# -*- coding:utf-8 -*-
+
+"""
+Datastore browsing tool functions.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import os
+
+from pyVmomi import vim
+
+
+LOG = logging.getLogger(__name__)
+
+# file extension: record type
+FILE_TYPES = {
+    '.vmdk': 'disk',
+    '.vmx': 'config',
+    '.vmtx': 'template',
+    '.vmsd': 'snapshot',
+    '.vmsn': 'snapshot',
+    '.vmem': 'memory',
+    '.vswp': 'swap',
+    '.nvram': 'nvram',
+    '.log': 'log',
+    '.iso': 'iso',
+    '.flp': 'floppy',
+}
+
+
+def make_search_spec(patterns=None):
+    """
+    Make the datastore browser search spec.
+
+    No query is set, so every file is returned as it is on the datastore,
+    the extents of a disk are not folded into its descriptor.
+    @param patterns: ['*.vmdk', '*.iso'], None for all files
+    """
+    details = vim.host.DatastoreBrowser.FileInfo.Details()
+    details.fileType = True
+    details.fileSize = True
+    details.modification = True
+    details.fileOwner = False
+    search_spec = vim.host.DatastoreBrowser.SearchSpec()
+    search_spec.details = details
+    search_spec.sortFoldersFirst = True
+    if patterns:
+        search_spec.matchPattern = list(patterns)
+    return search_spec
+
+
+def datastore_path(ds_name, path=None):
+    """
+    '[datastore1] vm/vm.vmx' of a path on a datastore.
+    """
+    path = (path or '').strip('/')
+    if not path:
+        return '[%s]' % ds_name
+    return '[%s] %s' % (ds_name, path)
+
+
+def parse_datastore_path(path):
+    """
+    (datastore name, path) of '[datastore1] vm/vm.vmx', (None, path) if
+    the path names no datastore.
+    """
+    path = path or ''
+    if not path.startswith('[') or ']' not in path:
+        return None, path
+    end = path.index(']')
+    return path[1:end], path[end + 1:].strip()
+
+
+def vm_home_folder(vm_path_name):
+    """
+    '[datastore1] vm01/' of the vmx path '[datastore1] vm01/vm01.vmx', the
+    datastore root '[datastore1]' if the vmx is not in a folder.
+    """
+    ds_name, path = parse_datastore_path(vm_path_name)
+    if ds_name is None:
+        return None
+    folder = path.rsplit('/', 1)[0] if '/' in path else ''
+    if not folder:
+        return datastore_path(ds_name)
+    return datastore_path(ds_name, folder) + '/'
+
+
+def classify_records(records, vm_files, unverified_prefixes):
+    """
+    Split file records into (orphans, unverified).
+
+    @param vm_files: the paths the VMs of the datastore own
+    @param unverified_prefixes: path prefixes which may belong to a VM
+                                whose files are not known
+    A record owned by a VM is in neither list.
+    """
+    orphans = []
+    unverified = []
+    for record in records:
+        if record['path'] in vm_files:
+            continue
+        if any(record['path'].startswith(prefix)
+               for prefix in unverified_prefixes):
+            unverified.append(record)
+        else:
+            orphans.append(record)
+    return orphans, unverified
+
+
+def join_datastore_path(folder_path, name):
+    """
+    Join a search result folderPath and a file name.
+    """
+    folder_path = folder_path.rstrip('/')
+    if folder_path.endswith(']'):
+        return '%s %s' % (folder_path, name)
+    return '%s/%s' % (folder_path, name)
+
+
+def file_type(name):
+    return FILE_TYPES.get(os.path.splitext(name)[1].lower(), 'file')
+
+
+def iter_search_records(ds_moid, ds_name, search_results):
+    """
+    Yield file records of the SearchDatastoreSubFolders_Task results of a
+    datastore, the subfolder entries are skipped.
+
+    record: {"ds_moid": "datastore-1", "datastore": "datastore1",
+             "folder": "[datastore1] vm", "path": "[datastore1] vm/vm.vmx",
+             "name": "vm.vmx", "type": "config", "size": 3072,
+             "modification": datetime}
+    """
+    search_results = search_results or []
+    folders = set(result.folderPath.rstrip('/') for result in search_results)
+    for result in search_results:
+        folder_path = result.folderPath.rstrip('/')
+        for file_info in result.file or []:
+            path = join_datastore_path(folder_path, file_info.path)
+            if path in folders or \
+                    isinstance(file_info, vim.host.DatastoreBrowser.FolderInfo):
+                continue
+            yield {
+                "ds_moid": ds_moid,
+                "datastore": ds_name,
+                "folder": folder_path,
+                "path": path,
+                "name": file_info.path,
+                "type": file_type(file_info.path),
+                "size": file_info.fileSize,
+                "modification": file_info.modification,
+            }
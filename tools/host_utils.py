@@ -0,0 +1,53 @@
+# -*- coding:utf-8 -*-
+
+"""
+ESXi host manipulation tool functions.
+"""
+
+from __future__ import absolute_import
+
+import logging
+
+from pyVmomi import vim
+
+
+LOG = logging.getLogger(__name__)
+
+
+def make_host_connect_spec(auth_info, force=False):
+    """
+    Make host connect spec.
+
+    @param auth_info: {"host": "192.168.1.10", "port": 443, "user": "root",
+                       "password": "", "ssl_thumbprint": "AB:CD:..."}
+    ssl_thumbprint: see HostClient.query_host_connection_info
+    @param force: take the host over from the vCenter managing it
+    """
+    connect_spec = vim.host.ConnectSpec()
+    connect_spec.hostName = auth_info['host']
+    connect_spec.port = int(auth_info.get('port') or 443)
+    connect_spec.userName = auth_info['user']
+    connect_spec.password = auth_info['password']
+    connect_spec.sslThumbprint = auth_info.get('ssl_thumbprint')
+    connect_spec.force = force
+    return connect_spec
+
+
+def host_connect_info_json(connect_info):
+    """
+    vim.host.ConnectInfo to json.
+    """
+    summary = connect_info.host
+    product = summary.config.product if summary and summary.config else None
+    hardware = summary.hardware if summary else None
+    return {
+        "name": summary.config.name if summary and summary.config else None,
+        "server_ip": connect_info.serverIp,
+        "in_das_cluster": connect_info.inDasCluster,
+        "product": product.fullName if product else None,
+        "version": product.version if product else None,
+        "vendor": hardware.vendor if hardware else None,
+        "model": hardware.model if hardware else None,
+        "vms": [vm.config.name for vm in connect_info.vm or []
+                if vm.config],
+    }
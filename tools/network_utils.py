@@ -0,0 +1,138 @@
+# -*- coding:utf-8 -*-
+
+"""
+Network manipulation tool functions.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import threading
+import time
+
+from pyVmomi import vim
+
+
+LOG = logging.getLogger(__name__)
+
+
+def make_dvportgroup_spec(dvpg):
+    """
+    Make distributed portgroup config spec.
+
+    @param dvpg: {"name": "tenant-a-100", "vlan_id": 100, "num_ports": 8,
+                  "type": "earlyBinding", "description": ""}
+    vlan_id: 0 or None for no VLAN
+    """
+    if not dvpg.get('name'):
+        raise Exception("The portgroup name is required.")
+    port_config = vim.dvs.VmwareDistributedVirtualSwitch.VmwarePortConfigPolicy()
+    port_config.vlan = vim.dvs.VmwareDistributedVirtualSwitch.VlanIdSpec(
+        vlanId=int(dvpg.get('vlan_id') or 0), inherited=False)
+
+    pg_spec = vim.dvs.DistributedVirtualPortgroup.ConfigSpec()
+    pg_spec.name = dvpg['name']
+    pg_spec.type = dvpg.get('type') or 'earlyBinding'
+    pg_spec.numPorts = int(dvpg.get('num_ports') or 8)
+    # static binding portgroups grow with the connected VMs
+    pg_spec.autoExpand = True
+    pg_spec.description = dvpg.get('description')
+    pg_spec.defaultPortConfig = port_config
+    return pg_spec
+
+
+class PortgroupIndex(object):
+    """
+    Cached names of the distributed portgroups of every datacenter,
+    refreshed at most once per refresh_seconds, or when a switch it does
+    not know is asked for. Portgroup names are unique in the network
+    folder of a datacenter, across all its switches.
+
+    The names of the portgroups being created are pending until their
+    task finishes, they count as existing and survive refreshes; they are
+    dropped when the task fails.
+
+    @param fetch_index: callable() returning ({dvs moid: dc moid},
+                        {dc moid: set(names)})
+    """
+
+    def __init__(self, fetch_index, refresh_seconds=60):
+        self._fetch_index = fetch_index
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        # (fetch time, {dvs moid: dc moid}, {dc moid: set(names)},
+        #  set(switch moids not found since the fetch))
+        self._index = None
+        # task key: (dvs moid, names)
+        self._pending = {}
+
+    def refresh(self):
+        """
+        Drop the cached index, the pending names are kept.
+        """
+        with self._lock:
+            self._index = None
+
+    def _get_index(self, dvs_moid):
+        if self._index is None or \
+                time.time() - self._index[0] >= self.refresh_seconds or \
+                (dvs_moid not in self._index[1] and
+                 dvs_moid not in self._index[3]):
+            switches, names = self._fetch_index()
+            self._index = (time.time(), switches, names, set())
+        switches, names, missing = self._index[1:]
+        if dvs_moid not in switches:
+            # a bad or deleted switch is fetched for once per refresh
+            missing.add(dvs_moid)
+            raise Exception("Not found dvswitch: %s" % dvs_moid)
+        return switches, names
+
+    def datacenter(self, dvs_moid):
+        """
+        The datacenter moid of a switch.
+        """
+        with self._lock:
+            return self._get_index(dvs_moid)[0][dvs_moid]
+
+    def names(self, dvs_moid):
+        """
+        The existing and pending portgroup names of the datacenter of a
+        switch.
+        """
+        with self._lock:
+            switches, names = self._get_index(dvs_moid)
+            dc_moid = switches[dvs_moid]
+            dc_names = set(names.get(dc_moid, ()))
+            for (pending_dvs_moid, pending_names) in self._pending.values():
+                if switches.get(pending_dvs_moid) == dc_moid:
+                    dc_names.update(pending_names)
+            return dc_names
+
+    def add_pending(self, task_key, dvs_moid, names):
+        """
+        Record the portgroups a task is creating on a switch.
+        """
+        with self._lock:
+            self._pending[task_key] = (dvs_moid, set(names))
+
+    def pending_tasks(self):
+        """
+        The keys of the tasks with pending names.
+        """
+        with self._lock:
+            return list(self._pending)
+
+    def finish(self, task_key, success):
+        """
+        Record the names of a finished task as existing, or drop them if
+        it failed.
+        """
+        with self._lock:
+            pending = self._pending.pop(task_key, None)
+            if not (success and pending and self._index):
+                return
+            dvs_moid, pending_names = pending
+            switches, names = self._index[1:3]
+            if dvs_moid in switches:
+                names.setdefault(switches[dvs_moid], set()).update(
+                    pending_names)
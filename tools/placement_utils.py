@@ -0,0 +1,210 @@
+# -*- coding:utf-8 -*-
+
+"""
+VM placement tool functions.
+
+Pick the host and datastore of new VMs from a cached view of the host
+cpu/memory headroom (summary.quickStats) and the datastore free space,
+refreshed periodically instead of queried for every VM.
+"""
+
+from __future__ import absolute_import
+
+import itertools
+import logging
+import threading
+import time
+
+
+LOG = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+GB = 1024 * 1024 * 1024
+
+
+def best_fit_policy(candidates, leftover):
+    """
+    Pick the candidate left with the least headroom, packs VMs on as few
+    hosts/datastores as possible.
+    """
+    return min(candidates, key=leftover)
+
+
+def spread_policy(candidates, leftover):
+    """
+    Pick the candidate left with the most headroom, spreads VMs evenly.
+    """
+    return max(candidates, key=leftover)
+
+
+PLACEMENT_POLICIES = {
+    'best_fit': best_fit_policy,
+    'spread': spread_policy,
+}
+
+
+class PlacementEngine(object):
+    """
+    Place VMs on hosts and datastores of a scope (datacenter/cluster).
+
+    The host and datastore states of a scope are fetched at most once per
+    refresh_seconds. Every placement reserves its cpu/memory/disk until it
+    is released (the VM exists and shows in the next refreshed state) or
+    reservation_seconds passed, so placements made before the next refresh
+    do not all pick the same host or datastore.
+
+    @param fetch_state: callable(scope) returning (hosts, datastores):
+        hosts: [{"moid": "host-1", "name": "esxi01", "parent_moid": "domain-c7",
+                 "cpu_capacity_mhz": 48000, "cpu_usage_mhz": 1200,
+                 "memory_mb": 262144, "memory_usage_mb": 65536,
+                 "datastores": ["datastore-1"], "available": True}]
+        datastores: [{"moid": "datastore-1", "name": "datastore01",
+                      "capacity": 1099511627776, "freeSpace": 549755813888,
+                      "available": True}]
+    @param policy: 'best_fit', 'spread' or callable(candidates, leftover)
+                   returning one of the candidates
+    """
+
+    def __init__(self, fetch_state, policy='spread', refresh_seconds=60,
+                 reservation_seconds=900):
+        self._fetch_state = fetch_state
+        self.policy = policy
+        self.refresh_seconds = refresh_seconds
+        self.reservation_seconds = reservation_seconds
+        self._lock = threading.Lock()
+        # scope: (fetch time, {host moid: host}, {datastore moid: datastore})
+        self._states = {}
+        # reservation key: reservation
+        self._reservations = {}
+        self._keys = itertools.count(1)
+
+    def _get_policy(self):
+        if callable(self.policy):
+            return self.policy
+        if self.policy not in PLACEMENT_POLICIES:
+            raise Exception("Unknown placement policy: %s" % self.policy)
+        return PLACEMENT_POLICIES[self.policy]
+
+    def refresh(self, scope=None):
+        """
+        Drop the cached state of a scope, all scopes by default.
+        """
+        with self._lock:
+            if scope is None:
+                self._states.clear()
+            else:
+                self._states.pop(scope, None)
+
+    def _get_state(self, scope):
+        state = self._states.get(scope)
+        if state is None or time.time() - state[0] >= self.refresh_seconds:
+            hosts, datastores = self._fetch_state(scope)
+            state = (time.time(),
+                     dict((h['moid'], h) for h in hosts),
+                     dict((d['moid'], d) for d in datastores))
+            self._states[scope] = state
+        return state[1], state[2]
+
+    def _reserved(self):
+        """
+        {moid: [cpu mhz, memory mb, disk bytes]} of the live reservations.
+        """
+        now = time.time()
+        reserved = {}
+        for key, reservation in list(self._reservations.items()):
+            if reservation['expires'] <= now:
+                del self._reservations[key]
+                continue
+            host = reserved.setdefault(reservation['host_moid'], [0, 0, 0])
+            host[0] += reservation['cpu_mhz']
+            host[1] += reservation['memory_mb']
+            ds = reserved.setdefault(reservation['ds_moid'], [0, 0, 0])
+            ds[2] += reservation['disk_bytes']
+        return reserved
+
+    def place(self, scope, memory_mb=0, disk_gb=0, cpu_mhz=0,
+              host_moid=None, ds_moid=None, exclude_host_moids=(),
+              require_ds_moids=()):
+        """
+        Place a VM and reserve its resources.
+
+        @param scope: the scope passed to fetch_state
+        @param host_moid/ds_moid: fixed by the caller, only the other one
+                                  is placed
+        @param exclude_host_moids: hosts not to place on, e.g. the host
+                                   being evacuated
+        @param require_ds_moids: datastores a host must mount, e.g. all
+                                 datastores of a VM moved by vMotion
+        @return: {"key": 1, "host_moid": "host-1", "host_name": "esxi01",
+                  "parent_moid": "domain-c7", "ds_moid": "datastore-1",
+                  "ds_name": "datastore01"}
+        """
+        disk_bytes = int(disk_gb * GB)
+        policy = self._get_policy()
+        with self._lock:
+            hosts, datastores = self._get_state(scope)
+            reserved = self._reserved()
+
+            def _ds_leftover(ds):
+                free = ds['freeSpace'] - reserved.get(ds['moid'], [0, 0, 0])[2]
+                return float(free - disk_bytes) / (ds['capacity'] or 1)
+
+            def _host_leftover(host):
+                used = reserved.get(host['moid'], [0, 0, 0])
+                cpu_free = host['cpu_capacity_mhz'] - host['cpu_usage_mhz'] - \
+                    used[0] - cpu_mhz
+                mem_free = host['memory_mb'] - host['memory_usage_mb'] - \
+                    used[1] - memory_mb
+                return min(float(cpu_free) / (host['cpu_capacity_mhz'] or 1),
+                           float(mem_free) / (host['memory_mb'] or 1))
+
+            def _host_datastores(host):
+                return [datastores[moid] for moid in host['datastores']
+                        if moid in datastores and
+                        datastores[moid]['available'] and
+                        (ds_moid is None or moid == ds_moid) and
+                        _ds_leftover(datastores[moid]) >= 0]
+
+            if host_moid:
+                if host_moid not in hosts:
+                    raise Exception("Not found host %s in %s." %
+                                    (host_moid, scope))
+                candidates = [hosts[host_moid]]
+            else:
+                candidates = [h for h in hosts.values() if h['available']
+                              and h['moid'] not in exclude_host_moids
+                              and _host_leftover(h) >= 0]
+            candidates = [h for h in candidates if _host_datastores(h) and
+                          set(require_ds_moids).issubset(h['datastores'])]
+            if not candidates:
+                raise Exception("No host/datastore in %s has %d MB memory "
+                                "and %s GB disk free." %
+                                (scope, memory_mb, disk_gb))
+            host = policy(candidates, _host_leftover)
+            ds = policy(_host_datastores(host), _ds_leftover)
+
+            key = next(self._keys)
+            self._reservations[key] = {
+                "host_moid": host['moid'],
+                "ds_moid": ds['moid'],
+                "cpu_mhz": cpu_mhz,
+                "memory_mb": memory_mb,
+                "disk_bytes": disk_bytes,
+                "expires": time.time() + self.reservation_seconds,
+            }
+        LOG.debug("Place VM on %s/%s.", host['moid'], ds['moid'])
+        return {"key": key,
+                "host_moid": host['moid'],
+                "host_name": host['name'],
+                "parent_moid": host['parent_moid'],
+                "ds_moid": ds['moid'],
+                "ds_name": ds['name']}
+
+    def release(self, placement):
+        """
+        Release the reservation of a placement.
+        """
+        if not placement:
+            return
+        with self._lock:
+            self._reservations.pop(placement['key'], None)
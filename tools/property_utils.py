@@ -0,0 +1,202 @@
+# -*- coding:utf-8 -*-
+
+"""
+PropertyCollector tool functions.
+
+Fetch many properties of many managed objects in a few paged
+RetrievePropertiesEx calls instead of one SOAP round trip per attribute.
+"""
+
+from __future__ import absolute_import
+
+import logging
+
+from pyVmomi import vim, vmodl
+
+
+LOG = logging.getLogger(__name__)
+
+
+def _get_vimtypes(vimtype):
+    if isinstance(vimtype, (list, tuple)):
+        return list(vimtype)
+    return [vimtype]
+
+
+def make_container_filter_spec(view_mor, vimtype, path_set):
+    """
+    Make filter spec selecting path_set of all objects in a ContainerView.
+
+    @param view_mor: vim.view.ContainerView
+    @param vimtype: [vim.VirtualMachine] or vim.VirtualMachine
+    @param path_set: ['name', 'summary.runtime.powerState']
+    """
+    traversal_spec = vmodl.query.PropertyCollector.TraversalSpec()
+    traversal_spec.name = 'traverseEntities'
+    traversal_spec.path = 'view'
+    traversal_spec.skip = False
+    traversal_spec.type = view_mor.__class__
+
+    obj_spec = vmodl.query.PropertyCollector.ObjectSpec()
+    obj_spec.obj = view_mor
+    obj_spec.skip = True
+    obj_spec.selectSet = [traversal_spec]
+
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+    filter_spec.objectSet = [obj_spec]
+    for t in _get_vimtypes(vimtype):
+        prop_spec = vmodl.query.PropertyCollector.PropertySpec()
+        prop_spec.type = t
+        prop_spec.pathSet = list(path_set)
+        prop_spec.all = not path_set
+        filter_spec.propSet.append(prop_spec)
+    return filter_spec
+
+
+def make_objects_filter_spec(mors, path_set):
+    """
+    Make filter spec selecting path_set of the given managed objects.
+
+    @param mors: managed object references, may be of different types
+    @param path_set: ['name'], or {vim type: ['name']} per type
+    """
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+    mor_types = []
+    for mor in mors:
+        obj_spec = vmodl.query.PropertyCollector.ObjectSpec()
+        obj_spec.obj = mor
+        obj_spec.skip = False
+        filter_spec.objectSet.append(obj_spec)
+        if mor.__class__ not in mor_types:
+            mor_types.append(mor.__class__)
+    for t in mor_types:
+        type_path_set = path_set.get(t, ()) if isinstance(path_set, dict) \
+            else path_set
+        prop_spec = vmodl.query.PropertyCollector.PropertySpec()
+        prop_spec.type = t
+        prop_spec.pathSet = list(type_path_set)
+        prop_spec.all = not type_path_set
+        filter_spec.propSet.append(prop_spec)
+    return filter_spec
+
+
+def object_exists(pc, mor):
+    """
+    Check a managed object exists with a retrieval of no property, which
+    works for every managed object type.
+    """
+    prop_spec = vmodl.query.PropertyCollector.PropertySpec()
+    prop_spec.type = mor.__class__
+    prop_spec.pathSet = []
+    prop_spec.all = False
+    obj_spec = vmodl.query.PropertyCollector.ObjectSpec()
+    obj_spec.obj = mor
+    obj_spec.skip = False
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+    filter_spec.objectSet = [obj_spec]
+    filter_spec.propSet = [prop_spec]
+    try:
+        result = pc.RetrievePropertiesEx(
+            specSet=[filter_spec],
+            options=vmodl.query.PropertyCollector.RetrieveOptions())
+    except vmodl.fault.ManagedObjectNotFound:
+        return False
+    return bool(result and result.objects)
+
+
+def iter_retrieve_pages(pc, filter_spec, page_size=None):
+    """
+    Page through RetrievePropertiesEx/ContinueRetrievePropertiesEx.
+
+    Yield a list of vmodl.query.PropertyCollector.ObjectContent per page.
+    An unfinished retrieval is cancelled when the generator is closed.
+
+    @param pc: vmodl.query.PropertyCollector
+    @param page_size: the maximum number of objects per page, None lets
+                      the server decide.
+    """
+    options = vmodl.query.PropertyCollector.RetrieveOptions()
+    if page_size:
+        options.maxObjects = int(page_size)
+    token = None
+    try:
+        result = pc.RetrievePropertiesEx(specSet=[filter_spec],
+                                         options=options)
+        while result:
+            token = result.token
+            yield result.objects
+            if not token:
+                break
+            result = pc.ContinueRetrievePropertiesEx(token=token)
+        token = None
+    finally:
+        if token:
+            try:
+                pc.CancelRetrievePropertiesEx(token=token)
+            except vmodl.MethodFault as ex:
+                LOG.debug("Cancel retrieve properties error: %s", str(ex))
+
+
+def object_content_to_dict(obj_content, path_set=()):
+    """
+    ObjectContent to {'mor': <mor>, 'moid': 'vm-1', <path>: <value>}.
+
+    Properties which are unset (left out of propSet) or not readable
+    (missingSet) are None, every path of path_set is a key.
+    """
+    props = dict((path, None) for path in path_set)
+    props['mor'] = obj_content.obj
+    props['moid'] = obj_content.obj._moId
+    for prop in obj_content.propSet:
+        props[prop.name] = prop.val
+    for missing in obj_content.missingSet or []:
+        props[missing.path] = None
+    return props
+
+
+def get_path_set(filter_spec):
+    """
+    The property paths selected by filter_spec.
+    """
+    path_set = []
+    for prop_spec in filter_spec.propSet:
+        for path in prop_spec.pathSet or []:
+            if path not in path_set:
+                path_set.append(path)
+    return path_set
+
+
+def iter_retrieve(pc, filter_spec, page_size=None):
+    """
+    Yield property dicts of all objects selected by filter_spec.
+    """
+    path_set = get_path_set(filter_spec)
+    for objects in iter_retrieve_pages(pc, filter_spec, page_size):
+        for obj_content in objects:
+            yield object_content_to_dict(obj_content, path_set)
+
+
+def retrieve_objects_properties(pc, mors, path_set):
+    """
+    Retrieve path_set of the given managed objects in one call.
+
+    Objects which do not exist any more are left out of the result.
+
+    @return: {moid: property dict}
+    """
+    mors = list(mors)
+    objects = {}
+    while mors:
+        filter_spec = make_objects_filter_spec(mors, path_set)
+        try:
+            for props in iter_retrieve(pc, filter_spec):
+                objects[props['moid']] = props
+            break
+        except vmodl.fault.ManagedObjectNotFound as ex:
+            missing_moid = ex.obj._moId if ex.obj else None
+            left = [m for m in mors if m._moId != missing_moid]
+            if len(left) == len(mors):
+                raise
+            LOG.debug("Managed object %s not found.", missing_moid)
+            mors = left
+    return objects
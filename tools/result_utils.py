@@ -38,4 +38,20 @@ class DataResult(object):
         """
         当使用obj['name']的形式的时候, 将调用这个方法, 这里返回的结果就是值
         """
-        return getattr(self, item)
\ No newline at end of file
+        return getattr(self, item)
+
+
+def aggregate_results(results):
+    """
+    Aggregate the DataResults of a batch operation:
+        $ result.status   # True if all succeeded
+        $ result.message  # "2 succeeded, 1 failed."
+        $ result.data     # {"results": {moid: DataResult}}
+    """
+    result = DataResult()
+    failed = [k for k, r in results.items() if not r.status]
+    result.status = not failed
+    result.message = "%d succeeded, %d failed." % (len(results) - len(failed),
+                                                   len(failed))
+    result.data = {"results": results}
+    return result
@@ -0,0 +1,140 @@
+# -*- coding:utf-8 -*-
+
+"""
+Task scheduling tool functions.
+
+Start many vCenter tasks under per-resource concurrency limits (per host,
+per datastore, ...) and hand them back as they finish, so a batch never
+floods the vCenter task queue.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import time
+
+from pyVmomi import vim
+
+
+LOG = logging.getLogger(__name__)
+
+
+class TaskScheduler(object):
+    """
+    Admission control for tasks of a batch operation.
+
+    Every submitted item names the resources it occupies while its task
+    runs, e.g. [('host', 'host-1'), ('datastore', 'datastore-2')]. An item
+    is started only when none of its resources is at the limit of its
+    kind; items which cannot start wait in submission order, and later
+    items whose resources are free overtake them.
+
+    @param tracker: task_utils.TaskTracker the started tasks are waited on
+    @param limits: {'host': 2, 'datastore': 4}, the max running tasks per
+                   resource of a kind, kinds not listed are unlimited
+    @param max_running: the max running tasks of the batch, None unlimited
+    """
+
+    def __init__(self, tracker, limits=None, max_running=None):
+        self._tracker = tracker
+        self._limits = dict(limits or {})
+        self._max_running = max_running
+        # [(item key, start, resources)]
+        self._queue = []
+        # task key: (item key, resources)
+        self._running = {}
+        # (kind, resource id): running tasks
+        self._usage = {}
+
+    @property
+    def queued(self):
+        return len(self._queue)
+
+    @property
+    def running(self):
+        return len(self._running)
+
+    def submit(self, key, start, resources=()):
+        """
+        Queue an item.
+
+        @param key: the item key yielded back by run()
+        @param start: callable starting the task, returns the vim.Task or
+                      its task key
+        @param resources: [(kind, resource id)], None ids are ignored
+        """
+        resources = list(set(r for r in resources if r[1] is not None))
+        self._queue.append((key, start, resources))
+
+    def _can_start(self, resources):
+        if self._max_running and len(self._running) >= self._max_running:
+            return False
+        for resource in resources:
+            limit = self._limits.get(resource[0])
+            # a limit below 1 would never start anything
+            if limit and self._usage.get(resource, 0) >= max(limit, 1):
+                return False
+        return True
+
+    def _start_ready(self):
+        """
+        Start the queued items which can start now, return
+        [(item key, None, error)] of the items failed to start.
+        """
+        failed = []
+        waiting = []
+        for item in self._queue:
+            key, start, resources = item
+            if not self._can_start(resources):
+                waiting.append(item)
+                continue
+            try:
+                task = start()
+            except Exception as ex:
+                LOG.exception(ex)
+                failed.append((key, None, str(ex)))
+                continue
+            task_key = task._moId if isinstance(task, vim.Task) else task
+            self._running[task_key] = (key, resources)
+            for resource in resources:
+                self._usage[resource] = self._usage.get(resource, 0) + 1
+            self._tracker.track([task_key])
+        self._queue = waiting
+        return failed
+
+    def _finish(self, task_key):
+        key, resources = self._running.pop(task_key)
+        for resource in resources:
+            self._usage[resource] -= 1
+            if not self._usage[resource]:
+                del self._usage[resource]
+        return key
+
+    def run(self, timeout=None):
+        """
+        Start the queued items and yield (item key, vim.TaskInfo, error)
+        as their tasks finish.
+
+        error is the message of an item which could not start or was not
+        finished within timeout secs, its TaskInfo is None then.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self._queue or self._running:
+            for failed in self._start_ready():
+                yield failed
+            if not self._running:
+                continue
+            wait_timeout = None
+            if deadline is not None:
+                wait_timeout = max(deadline - time.time(), 0)
+            for task_info in self._tracker.wait(wait_timeout):
+                if task_info.key in self._running:
+                    yield (self._finish(task_info.key), task_info, None)
+            if deadline is not None and time.time() >= deadline:
+                break
+        for task_key in list(self._running.keys()):
+            yield (self._finish(task_key), None,
+                   "Timeout waiting for the task %s." % task_key)
+        queue, self._queue = self._queue, []
+        for key, start, resources in queue:
+            yield (key, None, "Timeout before the task was started.")
@@ -0,0 +1,244 @@
+# -*- coding:utf-8 -*-
+
+"""
+Task tracking tool functions.
+
+Wait on many tasks at once through one private PropertyCollector and
+WaitForUpdatesEx instead of polling every task on its own.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import math
+import time
+
+from pyVmomi import vim, vmodl
+
+from . import property_utils
+
+
+LOG = logging.getLogger(__name__)
+
+TASK_DONE_STATES = ('success', 'error')
+
+
+def task_info_json(task_info):
+    """
+    vim.TaskInfo to json.
+    """
+    error = task_info.error
+    result = task_info.result
+    entity = task_info.entity
+    return {
+        "key": task_info.key,
+        "name": task_info.name,
+        "descriptionId": task_info.descriptionId,
+        "entity_moid": entity._moId if entity else None,
+        "entity_name": task_info.entityName,
+        "state": task_info.state,
+        "progress": task_info.progress,
+        "cancelable": task_info.cancelable,
+        "cancelled": task_info.cancelled,
+        "error": (getattr(error, 'msg', None) or str(error)) if error else None,
+        "result_moid": result._moId
+        if isinstance(result, vim.ManagedObject) else None,
+        "queueTime": task_info.queueTime,
+        "startTime": task_info.startTime,
+        "completeTime": task_info.completeTime,
+    }
+
+
+def _missing_task_info(task_mor):
+    """
+    TaskInfo standing in for a task vCenter does not know (any more).
+    """
+    fault = vmodl.fault.ManagedObjectNotFound(
+        obj=task_mor, msg="The task %s is not found." % task_mor._moId)
+    return vim.TaskInfo(key=task_mor._moId, task=task_mor, state='error',
+                        error=fault)
+
+
+def get_tasks_info(pc, task_mors):
+    """
+    Return {task key: vim.TaskInfo} of the given tasks in one call,
+    unknown tasks get an error TaskInfo.
+    """
+    objects = property_utils.retrieve_objects_properties(pc, task_mors,
+                                                         ['info'])
+    tasks_info = {}
+    for mor in task_mors:
+        props = objects.get(mor._moId)
+        if props and props.get('info'):
+            tasks_info[mor._moId] = props['info']
+        else:
+            tasks_info[mor._moId] = _missing_task_info(mor)
+    return tasks_info
+
+
+class TaskTracker(object):
+    """
+    Track the completion of many tasks through one private
+    PropertyCollector: every track() call adds one PropertyFilter on the
+    tasks' info.state and wait() blocks in WaitForUpdatesEx until some of
+    them finish. The full TaskInfo is fetched only for finished tasks.
+
+    A tracker is bound to the stub of the si it was created with and
+    must be used from one thread; close() it when done.
+    """
+
+    def __init__(self, si, max_wait_seconds=60):
+        self._stub = si._stub
+        self._root_pc = si.content.propertyCollector
+        self._pc = self._root_pc.CreatePropertyCollector()
+        self._max_wait_seconds = max_wait_seconds
+        self._version = ''
+        # filter moid: [vmodl.query.PropertyCollector.Filter, set(task keys)]
+        self._filters = {}
+        # task key: filter moid
+        self._tasks = {}
+        self._done = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    @property
+    def pending(self):
+        """
+        The keys of the tracked tasks which have not finished yet.
+        """
+        return list(self._tasks.keys())
+
+    def track(self, task_keys):
+        """
+        Start tracking tasks.
+
+        @param task_keys: ['task-1', 'task-2'] or vim.Task list
+        """
+        mors = {}
+        for key in task_keys:
+            if isinstance(key, vim.Task):
+                key = key._moId
+            if key and key not in self._tasks and key not in mors:
+                mors[key] = vim.Task(key, self._stub)
+        mors = list(mors.values())
+        while mors:
+            filter_spec = property_utils.make_objects_filter_spec(
+                mors, ['info.state'])
+            try:
+                pf = self._pc.CreateFilter(filter_spec, partialUpdates=False)
+            except vmodl.fault.ManagedObjectNotFound as ex:
+                missing_key = ex.obj._moId if ex.obj else None
+                left = [m for m in mors if m._moId != missing_key]
+                if len(left) == len(mors):
+                    raise
+                self._done.append(_missing_task_info(ex.obj))
+                mors = left
+                continue
+            keys = set(m._moId for m in mors)
+            self._filters[pf._moId] = [pf, keys]
+            for key in keys:
+                self._tasks[key] = pf._moId
+            break
+
+    def _untrack(self, task_key):
+        filter_moid = self._tasks.pop(task_key, None)
+        entry = self._filters.get(filter_moid)
+        if entry is None:
+            return
+        entry[1].discard(task_key)
+        if not entry[1]:
+            del self._filters[filter_moid]
+            try:
+                entry[0].DestroyPropertyFilter()
+            except vmodl.MethodFault as ex:
+                LOG.debug("Destroy task filter error: %s", str(ex))
+
+    def wait(self, timeout=None):
+        """
+        Block until at least one tracked task finishes or timeout secs
+        passed, return the list of finished vim.TaskInfo.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while not self._done and self._tasks:
+            max_wait = self._max_wait_seconds
+            if deadline is not None:
+                # maxWaitSeconds is whole secs: round up, a 0 below the
+                # last sec would poll vCenter in a busy loop; 0 only once
+                # the deadline passed, for a last poll
+                remaining = deadline - time.time()
+                if remaining > 0:
+                    max_wait = max(int(math.ceil(min(max_wait, remaining))),
+                                   1)
+                else:
+                    max_wait = 0
+            options = vmodl.query.PropertyCollector.WaitOptions(
+                maxWaitSeconds=max_wait)
+            update = self._pc.WaitForUpdatesEx(self._version, options)
+            if update is not None:
+                self._version = update.version
+                finished = []
+                for filter_update in update.filterSet:
+                    for obj_update in filter_update.objectSet:
+                        key = obj_update.obj._moId
+                        if key not in self._tasks:
+                            continue
+                        if obj_update.kind == 'leave':
+                            self._untrack(key)
+                            self._done.append(
+                                _missing_task_info(obj_update.obj))
+                            continue
+                        for change in obj_update.changeSet:
+                            if change.name == 'info.state' and \
+                                    change.val in TASK_DONE_STATES:
+                                finished.append(obj_update.obj)
+                if finished:
+                    for key in [m._moId for m in finished]:
+                        self._untrack(key)
+                    tasks_info = get_tasks_info(self._root_pc, finished)
+                    self._done.extend(tasks_info.values())
+            if deadline is not None and time.time() >= deadline:
+                break
+        done, self._done = self._done, []
+        return done
+
+    def iter_completed(self, timeout=None):
+        """
+        Yield vim.TaskInfo of the tracked tasks as they finish, until all
+        finished or timeout secs passed.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self._tasks or self._done:
+            wait_timeout = None
+            if deadline is not None:
+                wait_timeout = max(deadline - time.time(), 0)
+            for task_info in self.wait(wait_timeout):
+                yield task_info
+            if deadline is not None and time.time() >= deadline:
+                break
+
+    def close(self):
+        """
+        Destroy the private PropertyCollector and its filters.
+        """
+        self._filters = {}
+        self._tasks = {}
+        if self._pc is not None:
+            try:
+                self._pc.DestroyPropertyCollector()
+            except vmodl.MethodFault as ex:
+                LOG.debug("Destroy task collector error: %s", str(ex))
+            self._pc = None
+
+
+def wait_for_tasks(si, task_keys, timeout=None):
+    """
+    Yield vim.TaskInfo of the tasks as they finish.
+    """
+    with TaskTracker(si) as tracker:
+        tracker.track(task_keys)
+        for task_info in tracker.iter_completed(timeout):
+            yield task_info
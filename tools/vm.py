@@ -31,6 +31,116 @@ from . import constants
 from . import common_utils
 
 
+# PropertyCollector property paths prefetched for the info builders
+VM_INFO_PROPERTIES = ['name', 'parent', 'summary', 'guest',
+                      'config.hardware.device']
+VM_GUEST_INFO_PROPERTIES = ['name', 'parent', 'guest',
+                            'config.hardware.device']
+VM_HARDWARE_INFO_PROPERTIES = ['name', 'config.hardware.numCPU',
+                               'config.hardware.memoryMB',
+                               'config.hardware.device']
+
+
+class _PropertyNode(object):
+    """
+    Attribute access to the nested part of prefetched property paths,
+    e.g. 'hardware' of 'config.hardware.device'.
+    """
+
+    def __init__(self, values):
+        self._values = values
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['_values'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def _make_property_tree(values):
+    """
+    {'config.hardware.device': []} -> {'config': Node(hardware=Node(device=[]))}
+
+    A node whose properties are all unset is None, like an unset
+    vm_mor.config of a creating vm.
+    """
+    tree = {}
+    for path, val in values.items():
+        parts = path.split('.')
+        node = tree
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = val
+
+    def _to_node(node):
+        children = {}
+        for name, val in node.items():
+            if isinstance(val, dict):
+                val = _to_node(val)
+            children[name] = val
+        if all(val is None for val in children.values()):
+            return None
+        return _PropertyNode(children)
+
+    return dict((name, _to_node(val) if isinstance(val, dict) else val)
+                for name, val in tree.items())
+
+
+class PrefetchedVM(object):
+    """
+    A vim.VirtualMachine stand-in built from one PropertyCollector result.
+
+    The info builders read the prefetched properties without any server
+    round trip; attributes which were not prefetched are read from the
+    real managed object.
+
+    @param props: {'mor': <vim.VirtualMachine>, 'name': 'vm01',
+                   'config.hardware.device': [...], ...}
+    @param mor_names: {moid: name} of the referenced hosts/datastores
+    """
+
+    def __init__(self, props, mor_names=None):
+        self.mor = props['mor']
+        self.mor_names = mor_names or {}
+        self._tree = _make_property_tree(
+            dict((k, v) for k, v in props.items() if k not in ('mor', 'moid')))
+
+    @property
+    def _moId(self):
+        return self.mor._moId
+
+    def __getattr__(self, name):
+        tree = self.__dict__.get('_tree', {})
+        if name in tree:
+            return tree[name]
+        return getattr(self.__dict__['mor'], name)
+
+
+def get_vm_referenced_mors(props):
+    """
+    Get the hosts/datastores whose names the info builders need from
+    prefetched vm properties.
+    """
+    mors = {}
+    summary = props.get('summary')
+    if summary and summary.runtime and summary.runtime.host:
+        mors[summary.runtime.host._moId] = summary.runtime.host
+    for dev in props.get('config.hardware.device') or []:
+        if isinstance(dev, vim.vm.device.VirtualDisk) and \
+                getattr(dev.backing, 'datastore', None):
+            mors[dev.backing.datastore._moId] = dev.backing.datastore
+    return list(mors.values())
+
+
+def _get_mor_name(mor, mor_names=None):
+    """
+    Get managed object name, from the prefetched names if present.
+    """
+    if mor_names and mor._moId in mor_names:
+        return mor_names[mor._moId]
+    return mor.name
+
+
 def _get_nic_adapter_type(device):
     adapter_type = ""
     if isinstance(device, vim.vm.device.VirtualVmxnet3):
@@ -62,7 +172,7 @@ def _get_vm_controllers_type_info(vm_mor):
     scsi_ctls_type = {}
     for dev in vm_mor.config.hardware.device:
         if dev.key in [1000, 1001, 1002, 1003]:
-            scsi_ctls_sharedbus[dev.key] = dev_mor.sharedBus
+            scsi_ctls_sharedbus[dev.key] = dev.sharedBus
             if isinstance(dev, vim.vm.device.ParaVirtualSCSIController):
                 scsi_ctls_type[dev.key] = 'ParaVirtual'
             elif isinstance(dev, vim.vm.device.VirtualLsiLogicSASController):
@@ -171,7 +281,8 @@ def _vm_runtime_info(vm_mor):
     """
     run_info = {
         "powerState": vm_mor.summary.runtime.powerState,
-        "host": vm_mor.summary.runtime.host.name,
+        "host": _get_mor_name(vm_mor.summary.runtime.host,
+                              getattr(vm_mor, 'mor_names', None)),
         "host_moid": vm_mor.summary.runtime.host._moId,
         "bootTime": vm_mor.summary.runtime.bootTime,
         "maxCpuUsage": vm_mor.summary.runtime.maxCpuUsage,
@@ -193,7 +304,8 @@ def _vm_storage_info(vm_mor):
     return storage_info
 
 
-def _vm_disk_info(disk_device, scsi_ctls_type, scsi_ctls_sharedbus):
+def _vm_disk_info(disk_device, scsi_ctls_type, scsi_ctls_sharedbus,
+                  mor_names=None):
     """
     VM config hardware device: disk
     """
@@ -206,7 +318,8 @@ def _vm_disk_info(disk_device, scsi_ctls_type, scsi_ctls_sharedbus):
     disk_info['capacityKB'] = disk_device.capacityInKB
     disk_info['disk_mode'] = disk_device.backing.diskMode
     disk_info['contentid'] = disk_device.backing.contentId
-    disk_info['ds_name'] = disk_device.backing.datastore.name
+    disk_info['ds_name'] = _get_mor_name(disk_device.backing.datastore,
+                                         mor_names)
     disk_info['ds_moid'] = disk_device.backing.datastore._moId
     disk_info['key'] = disk_device.key
     disk_info['scsi_type'] = scsi_ctls_type.get(disk_device.controllerKey)
@@ -245,7 +358,8 @@ def get_vm_disk_info(vm_mor, vdev_node):
         v_n = common_utils.get_vdev_node(device.key)
         if v_n != vdev_node:
             continue
-        disk_info = _vm_disk_info(device, scsi_ctls_type, scsi_ctls_sharedbus)
+        disk_info = _vm_disk_info(device, scsi_ctls_type, scsi_ctls_sharedbus,
+                                  getattr(vm_mor, 'mor_names', None))
     return disk_info
 
 
@@ -258,7 +372,8 @@ def get_vm_disks_info(vm_mor):
     for device in vm_mor.config.hardware.device:
         if not isinstance(device, vim.vm.device.VirtualDisk):
             continue
-        disk_info = _vm_disk_info(device, scsi_ctls_type, scsi_ctls_sharedbus)
+        disk_info = _vm_disk_info(device, scsi_ctls_type, scsi_ctls_sharedbus,
+                                  getattr(vm_mor, 'mor_names', None))
         disks_info.append(disk_info)
     return disks_info
 
@@ -484,6 +599,25 @@ def vm_info_json(vm_mor):
     return vm_info
 
 
+def vm_hardware_info_json(vm_mor):
+    """
+    The configured hardware of a VM, read from config.hardware only, the
+    guest and runtime properties are not touched.
+    @ vm_mor: vim.VirtualMachine
+    """
+    vm_info = {}
+    if not (vm_mor and vm_mor.config):
+        # vm creating
+        return vm_info
+    vm_info['name'] = vm_mor.name
+    vm_info['moid'] = vm_mor._moId
+    vm_info['numCpu'] = vm_mor.config.hardware.numCPU
+    vm_info['memorySizeMB'] = vm_mor.config.hardware.memoryMB
+    vm_info['disk'] = get_vm_disks_info(vm_mor)
+    vm_info['network'] = get_vm_nics_info(vm_mor)
+    return vm_info
+
+
 def vm_guest_info_json(vm_mor):
     vm_info = {}
     if not (vm_mor and vm_mor.config):
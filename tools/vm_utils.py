@@ -32,6 +32,35 @@ def _set_disk_type(disk_backing, disk_type):
     return disk_backing
 
 
+def copy_data_object(obj, unbind=False):
+    """
+    Copy a data object for editing.
+
+    Nested data objects and arrays are copied, managed object references
+    are kept as they are (copy.deepcopy would copy their stub too).
+    @param unbind: replace the managed object references by references
+                   without a stub; they still serialize by moid, but can
+                   not call the server through the connection they were
+                   read on
+    """
+    if isinstance(obj, vim.ManagedObject):
+        if unbind:
+            return obj.__class__(obj._moId, None,
+                                 getattr(obj, '_serverGuid', None))
+        return obj
+    if isinstance(obj, vmodl.DynamicData):
+        new_obj = obj.__class__()
+        for prop in obj._GetPropertyList():
+            value = getattr(obj, prop.name)
+            # unset required properties can not be set to None
+            if value is not None:
+                setattr(new_obj, prop.name, copy_data_object(value, unbind))
+        return new_obj
+    if isinstance(obj, list):
+        return obj.__class__([copy_data_object(item, unbind) for item in obj])
+    return obj
+
+
 def _make_extra_config(options):
     extra_cfgs = []
     for k, v in options.items():
@@ -48,24 +77,45 @@ def make_disk_enable_uuid_extra_config():
     return extra_cfgs[0]
 
 
-def make_add_nic_device_spec(pg_mor, adapter_type):
+def make_nic_backing(pg_mor):
+    """
+    Make the nic backing connecting to a portgroup.
+
+    The backing can be made once and copied into many nic specs, which
+    saves reading the portgroup attributes for every nic.
+    """
+    if isinstance(pg_mor, vim.dvs.DistributedVirtualPortgroup):
+        # dvsp
+        backing = vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo()
+        backing.port = vim.dvs.PortConnection()
+        backing.port.portgroupKey = pg_mor.key
+        backing.port.switchUuid = pg_mor.config.distributedVirtualSwitch.uuid
+    else:
+        # svsp
+        backing = vim.vm.device.VirtualEthernetCard.NetworkBackingInfo()
+        backing.network = pg_mor
+        backing.deviceName = pg_mor.name
+    return backing
+
+
+def _make_nic_device(adapter_type):
+    # a new device each time, the constants are shared templates
+    return copy_data_object(constants.NIC_DEVICE_SPCE[adapter_type])
+
+
+def make_add_nic_device_spec(pg_mor, adapter_type, backing=None):
     """
     Make add nic device spec.
+    @param backing: made by make_nic_backing, copied instead of made from
+                    pg_mor
     """
     nic_spec = vim.vm.device.VirtualDeviceSpec()
     nic_spec.operation = 'add'
-    nic_spec.device = constants.NIC_DEVICE_SPCE[adapter_type]
-    if isinstance(pg_mor, vim.dvs.DistributedVirtualPortgroup):
-        # add dvsp
-        nic_spec.device.backing = vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo()
-        nic_spec.device.backing.port = vim.dvs.PortConnection()
-        nic_spec.device.backing.port.portgroupKey = pg_mor.key
-        nic_spec.device.backing.port.switchUuid = pg_mor.config.distributedVirtualSwitch.uuid
+    nic_spec.device = _make_nic_device(adapter_type)
+    if backing is not None:
+        nic_spec.device.backing = copy_data_object(backing)
     else:
-        # add svsp
-        nic_spec.device.backing = vim.vm.device.VirtualEthernetCard.NetworkBackingInfo()
-        nic_spec.device.backing.network = pg_mor
-        nic_spec.device.backing.deviceName = pg_mor.name
+        nic_spec.device.backing = make_nic_backing(pg_mor)
     nic_spec.device.connectable = vim.vm.device.VirtualDevice.ConnectInfo()
     nic_spec.device.connectable.startConnected = True
     nic_spec.device.connectable.allowGuestControl = True
@@ -90,17 +140,7 @@ def make_edit_nic_device_spec(vm_mor, nic_dev_key, pg_mor):
         raise Exception("The vm %s nic device %s not found!" %
                         (vm_mor.name, nic_dev_key))
     nic_spec.device = device
-    if isinstance(pg_mor, vim.dvs.DistributedVirtualPortgroup):
-        # edit dvsp
-        nic_spec.device.backing = vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo()
-        nic_spec.device.backing.port = vim.dvs.PortConnection()
-        nic_spec.device.backing.port.portgroupKey = pg_mor.key
-        nic_spec.device.backing.port.switchUuid = pg_mor.config.distributedVirtualSwitch.uuid
-    else:
-        # edit svsp
-        nic_spec.device.backing = vim.vm.device.VirtualEthernetCard.NetworkBackingInfo()
-        nic_spec.device.backing.network = pg_mor
-        nic_spec.device.backing.deviceName = pg_mor.name
+    nic_spec.device.backing = make_nic_backing(pg_mor)
     return nic_spec
 
 
@@ -133,6 +173,129 @@ def make_resize_disk_device_spec(vm_mor, dev_key, disk_size):
     return device_spec
 
 
+_SCSI_BUS_COUNT = 4
+_SCSI_UNIT_COUNT = 16
+_SCSI_CONTROLLER_UNIT = 7
+_SCSI_BUS_UNITS = (1 << _SCSI_UNIT_COUNT) - 1
+_SCSI_ALL_UNITS = (1 << (_SCSI_BUS_COUNT * _SCSI_UNIT_COUNT)) - 1
+_SCSI_CONTROLLER_UNITS = sum(1 << (b * _SCSI_UNIT_COUNT + _SCSI_CONTROLLER_UNIT)
+                             for b in range(_SCSI_BUS_COUNT))
+
+
+class ScsiSlotAllocator(object):
+    """
+    The SCSI slots (vdev nodes "bus:unit") of a VM as a bitmap of 4 buses x
+    16 units, unit 7 is the controller itself and never handed out.
+
+    allocate/free/reserve are a few integer bit operations each.
+
+    @param used: the bitmap, bit bus * 16 + unit set for a used slot
+    """
+
+    def __init__(self, used=0):
+        self._used = used | _SCSI_CONTROLLER_UNITS
+
+    def copy(self):
+        return ScsiSlotAllocator(self._used)
+
+    @staticmethod
+    def _bit(vdev_node):
+        try:
+            (bus_number, unit_number) = [int(n) for n in vdev_node.split(':')]
+        except (AttributeError, ValueError):
+            raise Exception("The vdev node error: %s" % vdev_node)
+        if not (0 <= bus_number < _SCSI_BUS_COUNT and
+                0 <= unit_number < _SCSI_UNIT_COUNT) or \
+                unit_number == _SCSI_CONTROLLER_UNIT:
+            raise Exception("The vdev node error: %s" % vdev_node)
+        return 1 << (bus_number * _SCSI_UNIT_COUNT + unit_number)
+
+    def is_free(self, vdev_node):
+        return not self._used & self._bit(vdev_node)
+
+    def reserve(self, vdev_node):
+        """
+        Take the given slot.
+        """
+        bit = self._bit(vdev_node)
+        if self._used & bit:
+            raise Exception("The vdev node %s is in use !" % vdev_node)
+        self._used |= bit
+
+    def allocate(self, bus_number=None):
+        """
+        Take the lowest free slot, of the given bus if any.
+        """
+        free = ~self._used & _SCSI_ALL_UNITS
+        if bus_number is not None:
+            free &= _SCSI_BUS_UNITS << (int(bus_number) * _SCSI_UNIT_COUNT)
+        if not free:
+            raise Exception("No SCSI controllers are available !")
+        bit = free & -free
+        self._used |= bit
+        return "%d:%d" % divmod(bit.bit_length() - 1, _SCSI_UNIT_COUNT)
+
+    def free(self, vdev_node):
+        self._used &= ~self._bit(vdev_node)
+
+
+def make_scsi_slot_allocator(devices):
+    """
+    Make the ScsiSlotAllocator of a VM seeded with the slots taken by its
+    devices.
+
+    @param devices: vm_mor.config.hardware.device
+    """
+    bus_numbers = dict((dev.key, dev.busNumber) for dev in devices
+                       if isinstance(dev, vim.vm.device.VirtualSCSIController))
+    used = 0
+    for dev in devices:
+        if dev.controllerKey in bus_numbers and dev.unitNumber is not None \
+                and dev.unitNumber < _SCSI_UNIT_COUNT:
+            used |= 1 << (bus_numbers[dev.controllerKey] * _SCSI_UNIT_COUNT +
+                          dev.unitNumber)
+    return ScsiSlotAllocator(used)
+
+
+def assign_vdev_nodes(allocator, disks):
+    """
+    Set the vdev_node of the disks: the given vdev nodes are reserved
+    first, the disks without one get the lowest free slots.
+    """
+    for disk in disks:
+        if disk.get('vdev_node'):
+            allocator.reserve(disk['vdev_node'])
+    for disk in disks:
+        if not disk.get('vdev_node'):
+            disk['vdev_node'] = allocator.allocate()
+
+
+def make_scsi_controller_spec(bus_number, controller_type,
+                              sharedbus_mode='noSharing'):
+    """
+    Make add scsi controller device spec.
+
+    @param controller_type: BusLogic, LsiLogic, LsiLogicSAS, ParaVirtual
+    """
+    scsi_ctl_spec = constants.SCSI_CONTROLLER_SPEC.get(controller_type)
+    if not scsi_ctl_spec:
+        raise Exception("The scsi controller type error: %s" %
+                        controller_type)
+    LOG.info("Add SCSI controller: %s." % controller_type)
+    controller_spec = vim.vm.device.VirtualDeviceSpec()
+    controller_spec.operation = 'add'
+    # a new device each time, the constants are shared templates
+    controller_spec.device = copy_data_object(scsi_ctl_spec)
+    controller_spec.device.key = 1000 + bus_number
+    controller_spec.device.controllerKey = 100
+    controller_spec.device.unitNumber = 3 + bus_number
+    controller_spec.device.busNumber = bus_number
+    controller_spec.device.hotAddRemove = True
+    controller_spec.device.sharedBus = sharedbus_mode
+    controller_spec.device.scsiCtlrUnitNumber = 7
+    return controller_spec
+
+
 def _check_or_add_controller(scsi_controllers, bus_number,
                              sharedbus_mode='noSharing'):
     """
@@ -151,23 +314,9 @@ def _check_or_add_controller(scsi_controllers, bus_number,
     if not f_controller:
         if not scsi_controller0_type:
             raise Exception("Not found SCSI controller 0 !")
-
-        scsi_ctl_spec = constants.SCSI_CONTROLLER_SPEC.get(
-            scsi_controller0_type)
-        if not scsi_ctl_spec:
-            raise Exception("The scsi controller type error: %s" %
-                            scsi_controller0_type)
-        LOG.info("Add SCSI controller: %s." % scsi_controller0_type)
-        controller_spec = vim.vm.device.VirtualDeviceSpec()
-        controller_spec.operation = 'add'
-        controller_spec.device = scsi_ctl_spec
-        controller_spec.device.key = 1000 + bus_number
-        controller_spec.device.controllerKey = 100
-        controller_spec.device.unitNumber = 3 + bus_number
-        controller_spec.device.busNumber = bus_number
-        controller_spec.device.hotAddRemove = True
-        controller_spec.device.sharedBus = sharedbus_mode
-        controller_spec.device.scsiCtlrUnitNumber = 7
+        controller_spec = make_scsi_controller_spec(bus_number,
+                                                    scsi_controller0_type,
+                                                    sharedbus_mode)
     else:
         if sharedbus_mode != f_controller.sharedBus:
             LOG.error(
@@ -315,15 +464,386 @@ def make_fileinfo(ds_name, vm_name):
     return fileinfo
 
 
-def _clone_vm_config_nic(config_spec, template_mor, nets):
+class ReconfigureTransaction(object):
+    """
+    Gather the edits of a VM into one vim.vm.ConfigSpec and commit them
+    with one ReconfigVM_Task, i.e. one VMX rewrite and one stun.
+
+    The VM config is read once, on the first edit of an existing device.
+    Edits of the same device are merged into one device spec, the spec
+    carries the config changeVersion read so the commit fails instead of
+    overwriting an edit made by someone else in between.
+
+    @param vm_mor: vim.VirtualMachine
+    @param config: vm_mor.config if already read
+    """
+
+    def __init__(self, vm_mor, config=None):
+        self.vm_mor = vm_mor
+        self._config = config
+        self._cpu_num = None
+        self._memory_mb = None
+        # device key: VirtualDeviceSpec, in edit order
+        self._device_specs = {}
+        self._device_keys = []
+        self._added_specs = []
+        self._extra_config = {}
+        self._tools = None
+
+    @property
+    def config(self):
+        if self._config is None:
+            self._config = self.vm_mor.config
+        return self._config
+
+    @property
+    def is_empty(self):
+        return self._cpu_num is None and self._memory_mb is None and \
+            not self._device_specs and not self._added_specs and \
+            not self._extra_config and self._tools is None
+
+    def _get_device(self, dev_key):
+        for device in self.config.hardware.device:
+            if device.key == dev_key:
+                return device
+        raise Exception("The vm %s device %s not found!" %
+                        (self.vm_mor._moId, dev_key))
+
+    def _edit_device(self, dev_key):
+        """
+        Return the device spec editing a device, the device is copied on
+        its first edit.
+        """
+        device_spec = self._device_specs.get(dev_key)
+        if device_spec is not None:
+            if device_spec.operation == 'remove':
+                raise Exception("The vm %s device %s is removed!" %
+                                (self.vm_mor._moId, dev_key))
+            return device_spec
+        device_spec = vim.vm.device.VirtualDeviceSpec()
+        device_spec.operation = 'edit'
+        device_spec.device = copy_data_object(self._get_device(dev_key))
+        self._device_specs[dev_key] = device_spec
+        self._device_keys.append(dev_key)
+        return device_spec
+
+    def set_cpu(self, cpu_num):
+        self._cpu_num = int(cpu_num)
+
+    def set_memory(self, memory_mb):
+        self._memory_mb = int(memory_mb)
+
+    def resize_disk(self, dev_key, disk_size):
+        """
+        Grow a disk to disk_size GB.
+        """
+        device_spec = self._edit_device(dev_key)
+        if not isinstance(device_spec.device, vim.vm.device.VirtualDisk):
+            raise Exception("The vm device %s is not a disk!" % dev_key)
+        capacity_kb = int(disk_size) * 1024 * 1024
+        if capacity_kb < device_spec.device.capacityInKB:
+            raise Exception("The vm disk %s can not shrink!" % dev_key)
+        device_spec.device.capacityInKB = capacity_kb
+        device_spec.device.capacityInBytes = capacity_kb * 1024
+
+    def add_nic(self, pg_mor, adapter_type='VMXNET3', backing=None):
+        """
+        Add a nic connected to pg_mor, or to a copy of backing made by
+        make_nic_backing.
+        """
+        nic_spec = make_add_nic_device_spec(pg_mor, adapter_type, backing)
+        self.add_device_spec(nic_spec)
+
+    def edit_nic(self, dev_key, pg_mor=None, backing=None):
+        """
+        Reconnect a nic to pg_mor, or to a copy of backing.
+        """
+        if dev_key < 4000 or dev_key >= 4100:
+            raise Exception("The vm nic device key error!")
+        device_spec = self._edit_device(dev_key)
+        if backing is not None:
+            device_spec.device.backing = copy_data_object(backing)
+        else:
+            device_spec.device.backing = make_nic_backing(pg_mor)
+
+    def delete_nic(self, dev_key):
+        if dev_key < 4000 or dev_key >= 4100:
+            raise Exception("The vm nic device key error!")
+        self.remove_device(dev_key)
+
+    def remove_device(self, dev_key, file_operation=None):
+        """
+        Remove a device, earlier edits of it are dropped.
+        """
+        device = self._get_device(dev_key)
+        if dev_key not in self._device_specs:
+            self._device_keys.append(dev_key)
+        self._device_specs[dev_key] = make_remove_device_spec(
+            device, file_operation)
+
+    def add_device_spec(self, device_spec):
+        """
+        Add a device spec made by the make_*_device_spec functions, new
+        devices without a key get a temporary negative one so several of
+        them can be added at once.
+        """
+        if device_spec.operation == 'add' and not device_spec.device.key:
+            device_spec.device.key = -(len(self._added_specs) + 1)
+        self._added_specs.append(device_spec)
+
+    def attach_disks(self, disks, share_disk=False):
+        """
+        Attach scsi disks, see VMClient.attach_scsi_disks; the disks
+        without vdev_node get the lowest free slots.
+        """
+        devices = self.config.hardware.device
+        scsi_controllers = [dev for dev in devices if isinstance(
+            dev, vim.vm.device.VirtualSCSIController)]
+        scsi_controllers.extend(
+            spec.device for spec in self._added_specs if isinstance(
+                spec.device, vim.vm.device.VirtualSCSIController))
+        allocator = make_scsi_slot_allocator(
+            list(devices) + [spec.device for spec in self._added_specs])
+        assign_vdev_nodes(allocator, disks)
+        for disk in disks:
+            controller_spec = check_and_make_scsi_controller_spec(
+                scsi_controllers, disk, share_disk)
+            if controller_spec:
+                scsi_controllers.append(controller_spec.device)
+                self.add_device_spec(controller_spec)
+            self.add_device_spec(
+                make_attach_scsi_disk_device_spec(disk, share_disk))
+            if share_disk and not disk.get("is_raw"):
+                self.set_extra_config({'disk.EnableUUID': 'true'})
+
+    def set_extra_config(self, options):
+        """
+        Add or update extra config options, later values win.
+        """
+        self._extra_config.update(options)
+
+    def set_tools(self, sync_host_time=None, auto_upgrade=None):
+        """
+        Set the VMware tools options, None keeps the current one.
+        """
+        if self._tools is None:
+            self._tools = vim.vm.ToolsConfigInfo()
+        if sync_host_time is not None:
+            self._tools.syncTimeWithHost = bool(sync_host_time)
+        if auto_upgrade is not None:
+            self._tools.toolsUpgradePolicy = "upgradeAtPowerCycle" \
+                if auto_upgrade else "manual"
+
+    def make_spec(self):
+        """
+        Make the ConfigSpec of the gathered edits, None if there is none.
+        """
+        if self.is_empty:
+            return None
+        config_spec = vim.vm.ConfigSpec()
+        if self._config is not None:
+            config_spec.changeVersion = self._config.changeVersion
+        if self._cpu_num is not None:
+            config_spec.numCPUs = self._cpu_num
+        if self._memory_mb is not None:
+            config_spec.memoryMB = self._memory_mb
+        for dev_key in self._device_keys:
+            config_spec.deviceChange.append(self._device_specs[dev_key])
+        for device_spec in self._added_specs:
+            config_spec.deviceChange.append(device_spec)
+        if self._extra_config:
+            config_spec.extraConfig = _make_extra_config(self._extra_config)
+        if self._tools is not None:
+            config_spec.tools = self._tools
+        return config_spec
+
+    def commit(self):
+        """
+        Start the ReconfigVM_Task of the gathered edits.
+
+        @return: vim.Task, None if there is nothing to reconfigure
+        """
+        config_spec = self.make_spec()
+        if config_spec is None:
+            return None
+        return self.vm_mor.ReconfigVM_Task(spec=config_spec)
+
+
+def diff_vm(vm_mor, vm_cfg=None, nics=None, disks=None):
+    """
+    diff_vm_state of a vim.VirtualMachine or vm.PrefetchedVM with
+    constants.RECONCILE_VM_PROPERTIES.
+    """
+    vm_info = vm.vm_hardware_info_json(vm_mor)
+    if not vm_info:
+        raise Exception("The vm %s has no config yet." % vm_mor._moId)
+    return diff_vm_state(vm_info, vm_cfg, nics, disks)
+
+
+def _match_vm_disks(current_disks, disks):
+    """
+    Pair the desired disks with the current ones: by vdev_node if given,
+    else in order with the current disks not paired yet.
+
+    @return: [(desired disk, current disk info or None)]
+    """
+    by_node = dict((d['vdev_node'], d) for d in current_disks)
+    nodes = set(disk['vdev_node'] for disk in disks if disk.get('vdev_node'))
+    unpinned = [d for d in current_disks if d['vdev_node'] not in nodes]
+    pairs = []
+    for disk in disks:
+        if disk.get('vdev_node'):
+            pairs.append((disk, by_node.get(disk['vdev_node'])))
+        else:
+            pairs.append((disk, unpinned.pop(0) if unpinned else None))
+    return pairs
+
+
+def diff_vm_state(vm_info, vm_cfg=None, nics=None, disks=None):
+    """
+    Diff the desired state of a VM against its current state, return the
+    VMClient.reconfigure_vm changes converging it, {} if it is converged.
+
+    Only what is given is reconciled:
+        vm_cfg: {"num_cpu": 4, "memoryMB": 2048}, num_cpu the total vCPUs
+        nics: [{"pg_moid": "network-11", "adapter_type": "VMXNET3"}], the
+              vm nics in order; a nic of another adapter type is replaced,
+              the nics beyond the list are deleted
+        disks: [{"vdev_node": "0:1", "disk_size": 20, ...}], paired with the
+               current disks by vdev_node or in order; smaller disks are
+               grown, missing ones attached (the attach_scsi_disks keys),
+               disks not listed are kept
+
+    @param vm_info: tools.vm.vm_hardware_info_json of the VM
+    """
+    changes = {}
+    vm_cfg = vm_cfg or {}
+    if vm_cfg.get('num_cpu') is not None and \
+            int(vm_cfg['num_cpu']) != vm_info['numCpu']:
+        changes['cpu_num'] = int(vm_cfg['num_cpu'])
+    if vm_cfg.get('memoryMB') is not None and \
+            int(vm_cfg['memoryMB']) != vm_info['memorySizeMB']:
+        changes['memory_mb'] = int(vm_cfg['memoryMB'])
+
+    if nics is not None:
+        current_nics = sorted(vm_info.get('network') or [],
+                              key=lambda n: n['key'])
+        add_nics, edit_nics, del_nics = [], [], []
+        for (i, nic) in enumerate(nics):
+            current = current_nics[i] if i < len(current_nics) else None
+            adapter_type = nic.get('adapter_type')
+            if current is None:
+                add_nics.append(nic)
+            elif adapter_type and adapter_type != current['adapter_type']:
+                del_nics.append({"dev_key": current['key']})
+                add_nics.append(nic)
+            elif nic['pg_moid'] != current['pg_moid']:
+                edit_nics.append({"dev_key": current['key'],
+                                  "pg_moid": nic['pg_moid']})
+        for current in current_nics[len(nics):]:
+            del_nics.append({"dev_key": current['key']})
+        for (name, items) in (('add_nics', add_nics), ('edit_nics', edit_nics),
+                              ('del_nics', del_nics)):
+            if items:
+                changes[name] = items
+
+    if disks is not None:
+        resize_disks, add_disks = [], []
+        for (disk, current) in _match_vm_disks(vm_info.get('disk') or [],
+                                               disks):
+            if current is None:
+                add_disks.append(dict(disk))
+                continue
+            if disk.get('disk_size') is None:
+                continue
+            capacity_kb = int(disk['disk_size']) * 1024 * 1024
+            if capacity_kb > current['capacityKB']:
+                resize_disks.append({"dev_key": current['key'],
+                                     "disk_size": disk['disk_size']})
+            elif capacity_kb < current['capacityKB']:
+                raise Exception("The vm disk %s can not shrink!" %
+                                current['vdev_node'])
+        if resize_disks:
+            changes['disks'] = resize_disks
+        if add_disks:
+            changes['add_disks'] = add_disks
+    return changes
+
+
+class TemplateLayout(object):
+    """
+    The device layout of a clone template, compiled once from one read of
+    the template config; clone specs are made from it in memory.
+
+    The template devices are shared by the clone specs made from a layout,
+    they are copied before any edit. A layout is cached across calls and
+    connections, so it keeps the moids of the template and its snapshot
+    only, and the managed object references in the device backings
+    (datastores, networks) are unbound from the connection the template
+    was read on: they are only sent by moid in the specs.
+
+    @param template_mor: vim.VirtualMachine or vm.PrefetchedVM with
+                         constants.CLONE_TEMPLATE_PROPERTIES
+    """
+
+    def __init__(self, template_mor):
+        config = template_mor.config
+        devices = [copy_data_object(dev, unbind=True)
+                   for dev in config.hardware.device]
+        self.moid = template_mor._moId
+        snapshot = template_mor.snapshot
+        current_snapshot = snapshot.currentSnapshot if snapshot else None
+        self.snapshot_moid = current_snapshot._moId if current_snapshot \
+            else None
+        self.change_version = config.changeVersion
+        self.guest_id = config.guestId
+        # a VM marked as template, it cannot take a snapshot
+        self.is_template = bool(config.template)
+        self.nic_devices = [dev for dev in devices if isinstance(
+            dev, vim.vm.device.VirtualEthernetCard)]
+        self.disk_devices = [dev for dev in devices if isinstance(
+            dev, vim.vm.device.VirtualDisk)]
+        self.scsi_controllers = [dev for dev in devices if isinstance(
+            dev, vim.vm.device.VirtualSCSIController)]
+        self.scsi_slots = make_scsi_slot_allocator(devices)
+
+
+class TemplateLayoutCache(object):
+    """
+    TemplateLayouts by template moid. A layout is valid as long as the
+    template config.changeVersion is unchanged, any edit of the template
+    (devices, snapshots) invalidates it.
+    """
+
+    def __init__(self):
+        self._layouts = {}
+
+    def get(self, template_moid, change_version):
+        layout = self._layouts.get(template_moid)
+        if layout is not None and layout.change_version == change_version:
+            return layout
+        return None
+
+    def put(self, layout):
+        self._layouts[layout.moid] = layout
+
+    def invalidate(self, template_moid=None):
+        if template_moid is None:
+            self._layouts.clear()
+        else:
+            self._layouts.pop(template_moid, None)
+
+
+def _clone_vm_config_nic(config_spec, layout, nets):
     """
+    @param layout: TemplateLayout
     @param nets:
         [{'ip': '10.0.0.13', 'netmask': '255.255.255.0', 'gateway': '10.0.0.1',
         'pg_moid': 'dvportgroup-391', 'adapter_type': 'E1000',
-        'pg_mor': <object>},
+        'pg_mor': <object>, 'backing': <optional, made by make_nic_backing>},
         ]
     """
-    template_nic_devs = vm._get_vm_nic_adapter_devices(template_mor)
+    template_nic_devs = list(layout.nic_devices)
     while len(template_nic_devs) > len(nets):
         nets.append(None)
     while len(template_nic_devs) < len(nets):
@@ -335,29 +855,20 @@ def _clone_vm_config_nic(config_spec, template_mor, nets):
             nic_spec.operation = "remove"
             nic_spec.device = dev
         else:
-            pg_mor = net['pg_mor']
             adapter_type = net.get('adapter_type', 'VMXNET3')
-            is_pg_dvsp = isinstance(
-                pg_mor, vim.dvs.DistributedVirtualPortgroup)
             if dev is None:
                 # add
                 nic_spec.operation = 'add'
-                nic_spec.device = constants.NIC_DEVICE_SPCE.get(adapter_type)
+                nic_spec.device = _make_nic_device(adapter_type)
             else:
                 nic_spec.operation = "edit"
-                nic_spec.device = dev
-
-            if is_pg_dvsp:
-                # add dvsp
-                nic_spec.device.backing = vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo()
-                nic_spec.device.backing.port = vim.dvs.PortConnection()
-                nic_spec.device.backing.port.portgroupKey = pg_mor.key
-                nic_spec.device.backing.port.switchUuid = pg_mor.config.distributedVirtualSwitch.uuid
+                # the template device may be shared, edit a copy
+                nic_spec.device = copy_data_object(dev)
+
+            if net.get('backing'):
+                nic_spec.device.backing = copy_data_object(net['backing'])
             else:
-                # add svsp
-                nic_spec.device.backing = vim.vm.device.VirtualEthernetCard.NetworkBackingInfo()
-                nic_spec.device.backing.network = pg_mor
-                nic_spec.device.backing.deviceName = pg_mor.name
+                nic_spec.device.backing = make_nic_backing(net['pg_mor'])
         nic_spec.device.connectable = vim.vm.device.VirtualDevice.ConnectInfo()
         nic_spec.device.connectable.startConnected = True
         nic_spec.device.connectable.allowGuestControl = True
@@ -368,31 +879,30 @@ def _clone_vm_config_nic(config_spec, template_mor, nets):
         config_spec.deviceChange.append(nic_spec)
 
 
-def _get_available_vdev_node(devs, allocated_vdev_node):
-    all_vdev_node = ["%d:%d" % (a, b) for a in range(4)
-                     for b in range(16) if b != 7]
-    used_vdev_node = ["%d:%d" % (
-        dev.controllerKey-1000, dev.unitNumber) for dev in devs if dev]
-    available_vdev_node = [
-        n for n in all_vdev_node if n not in used_vdev_node and n not in allocated_vdev_node]
-    if len(available_vdev_node) < 1:
-        raise Exception("No SCSI controllers are available !")
-    return available_vdev_node[0]
-
-
-def _clone_vm_config_disk(config_spec, template_mor, disks):
+def _clone_vm_config_disk(config_spec, layout, disks,
+                          keep_template_disks=False):
     """
     @@@@ disk_type: [None|thin|eagerZeroedThick|preallocated]
+
+    @param layout: TemplateLayout
+
+    @param keep_template_disks: leave the template disks as they are,
+        a linked clone shares them and only adds the extra disks
     """
-    template_disk_devs = vm._get_vm_disk_devices(template_mor)
-    template_scsi_controllers = vm._get_vm_scsi_controller_devices(template_mor)
+    template_disk_devs = list(layout.disk_devices)
+    template_scsi_controllers = list(layout.scsi_controllers)
 
     while len(template_disk_devs) > len(disks):
         disks.append(None)
     while len(template_disk_devs) < len(disks):
         template_disk_devs.append(None)
-    allocated_vdev_node = []
+    # set the scsi vdev nodes of the added disks
+    assign_vdev_nodes(layout.scsi_slots.copy(),
+                      [disk for (dev, disk) in zip(template_disk_devs, disks)
+                       if dev is None and disk])
     for (dev, disk) in zip(template_disk_devs, disks):
+        if keep_template_disks and dev is not None:
+            continue
         disk_spec = vim.vm.device.VirtualDeviceSpec()
         if disk is None:
             # remove
@@ -410,32 +920,24 @@ def _clone_vm_config_disk(config_spec, template_mor, disks):
                 disk_spec.device.backing.diskMode = 'persistent'
                 if disk.get('ds_name'):
                     disk_spec.device.backing.fileName = "[%s]" % disk['ds_name']
-                # set scsi vdev node
-                available_vdev_node = disk.get('vdev_node')
-                if not available_vdev_node:
-                    available_vdev_node = _get_available_vdev_node(
-                        template_disk_devs, allocated_vdev_node)
-                    allocated_vdev_node.append(available_vdev_node)
-                    disk['vdev_node'] = available_vdev_node
-
-                (c_bus_number, d_unit_number) = available_vdev_node.split(':')
+                (c_bus_number, d_unit_number) = disk['vdev_node'].split(':')
 
                 controller_spec = check_and_make_scsi_controller_spec(
                     template_scsi_controllers, disk)
                 if controller_spec:
                     template_scsi_controllers.append(controller_spec.device)
-                    config_spec.append(controller_spec)
+                    config_spec.deviceChange.append(controller_spec)
 
                 disk_spec.device.unitNumber = int(d_unit_number)
                 disk_spec.device.controllerKey = 1000 + int(c_bus_number)
                 disk_spec.device.key = 2000 + \
                     int(c_bus_number) * 16 + int(d_unit_number)
             else:
-                # edit
+                # edit, the template device may be shared, edit a copy
                 disk_spec.operation = "edit"
-                disk_spec.device = dev
+                disk_spec.device = copy_data_object(dev)
             # for relocate use
-            disk_spec.device.backing.datastore = disk['ds_mor']
+            disk_spec.device.backing.datastore = disk.get('ds_mor')
             # update disk type
             disk_spec.device.backing = _set_disk_type(disk_spec.device.backing,
                                                       disk['disk_type'])
@@ -446,10 +948,16 @@ def _clone_vm_config_disk(config_spec, template_mor, disks):
         config_spec.deviceChange.append(disk_spec)
 
 
-def make_clone_config_spec(template_mor, vm_cfg, nics, disks):
+def make_clone_config_spec(template_mor, vm_cfg, nics, disks, linked=False,
+                           layout=None):
     """
     Make clone config spec.
 
+    A linked clone keeps the template disks, disks beyond them are added.
+
+    @param layout: TemplateLayout of the template, compiled from
+                   template_mor if not given
+
     vim.vm.ConfigSpec()
     vim.vm.device.VirtualDiskSpec()
     """
@@ -465,16 +973,23 @@ def make_clone_config_spec(template_mor, vm_cfg, nics, disks):
     config_spec.uuid = vm_cfg['uuid']
 
     # update device config
-    _clone_vm_config_nic(config_spec, template_mor, nics)
-    _clone_vm_config_disk(config_spec, template_mor, disks)
+    if layout is None:
+        layout = TemplateLayout(template_mor)
+    _clone_vm_config_nic(config_spec, layout, nics)
+    _clone_vm_config_disk(config_spec, layout, disks,
+                          keep_template_disks=linked)
 
     return config_spec
 
 
-def make_clone_relocate_spec(clone_spec, res_pool_mor, esxi_mor, datastore_mor):
+def make_clone_relocate_spec(clone_spec, res_pool_mor, esxi_mor, datastore_mor,
+                             disk_move_type=None):
     """
     Make clone relocate spec.
 
+    @param disk_move_type: vim.vm.RelocateSpec.DiskMoveOptions, e.g.
+        'createNewChildDiskBacking' for a linked clone, default full copy
+
     Disk Transform Rule:
         [thin, preallocated, eagerZeroedThick] -> thin
         [thin, preallocated]                   -> preallocated
@@ -485,6 +1000,8 @@ def make_clone_relocate_spec(clone_spec, res_pool_mor, esxi_mor, datastore_mor):
     relocate_spec.pool = res_pool_mor
     relocate_spec.host = esxi_mor
     relocate_spec.datastore = datastore_mor
+    if disk_move_type:
+        relocate_spec.diskMoveType = disk_move_type
 
     for disk_spec in clone_spec.config.deviceChange:
         if isinstance(disk_spec.device, vim.vm.device.VirtualDisk) \
@@ -498,6 +1015,56 @@ def make_clone_relocate_spec(clone_spec, res_pool_mor, esxi_mor, datastore_mor):
     return relocate_spec
 
 
+def make_instant_clone_guest_config(vm_cfg, nics):
+    """
+    Make the guestinfo extraConfig of an instant clone.
+
+    An instant clone is not customized, a script in the parent guest reads
+    its identity after the fork, e.g.
+    `vmware-rpctool "info-get guestinfo.hostname"`:
+        guestinfo.hostname, guestinfo.domain, guestinfo.dns,
+        guestinfo.nic<N>.ip/netmask/gateway/ipv6/prefixv6/gatewayv6
+    """
+    options = {
+        'guestinfo.hostname': common_utils.sanitize_hostname(
+            vm_cfg['name'], vm_cfg.get('hostname')),
+    }
+    if vm_cfg.get('domain'):
+        options['guestinfo.domain'] = vm_cfg['domain']
+    if vm_cfg.get('dns_list'):
+        options['guestinfo.dns'] = ','.join(vm_cfg['dns_list'])
+    for index, nic in enumerate(nics):
+        for key in ('ip', 'netmask', 'gateway',
+                    'ipv6', 'prefixv6', 'gatewayv6'):
+            if nic.get(key):
+                options['guestinfo.nic%d.%s' % (index, key)] = str(nic[key])
+    return _make_extra_config(options)
+
+
+def make_instant_clone_nic_specs(parent_mor, nics):
+    """
+    Make the nic specs of an instant clone.
+
+    An instant clone can not add or remove nics, the parent nics are
+    reconnected to the nics' portgroups in order.
+    """
+    parent_nic_devs = vm._get_vm_nic_adapter_devices(parent_mor)
+    if len(nics) > len(parent_nic_devs):
+        raise Exception("The parent VM has only %d nics !" %
+                        len(parent_nic_devs))
+    nic_specs = []
+    for (dev, nic) in zip(parent_nic_devs, nics):
+        nic_spec = vim.vm.device.VirtualDeviceSpec()
+        nic_spec.operation = 'edit'
+        nic_spec.device = copy_data_object(dev)
+        if nic.get('backing'):
+            nic_spec.device.backing = copy_data_object(nic['backing'])
+        else:
+            nic_spec.device.backing = make_nic_backing(nic['pg_mor'])
+        nic_specs.append(nic_spec)
+    return nic_specs
+
+
 def sysprep_customization(hostname, domain='localhost.domain',
                           workgroup='WORKGROUP', passwd='password',
                           os_type='linux'):
@@ -573,39 +1140,189 @@ def dns_customization(dnslist):
     return vim.vm.customization.GlobalIPSettings(dnsServerList=dnslist)
 
 
-def make_custom_spec(vm_mor, vm_cfg, nics, dnslist):
+class CustomizationTemplate(object):
     """
-    Make vm custom spec.
+    A customization spec compiled once, the per VM specs only get the
+    hostname and the nic addresses applied to a copy of it.
+
+    @param identity: vim.vm.customization.IdentitySettings, None for a
+                     guest which can not be customized
+    @param global_ip_settings: vim.vm.customization.GlobalIPSettings
+    @param nic_setting_map: [vim.vm.customization.AdapterMapping] kept for
+                            the nics without addresses
     """
-    # Verify vm hostname
-    hostname = common_utils.sanitize_hostname(
-        vm_cfg['name'], vm_cfg.get('hostname'))
 
-    # Get vm system type
-    vm_cfg['os_type'] = common_utils.get_os_type(vm_mor.config.guestId)
+    def __init__(self, identity, global_ip_settings, nic_setting_map=None,
+                 options=None, encryption_key=None):
+        self.identity = identity
+        self.global_ip_settings = global_ip_settings
+        self.nic_setting_map = list(nic_setting_map or [])
+        self.options = options
+        self.encryption_key = encryption_key
+
+    def _apply_hostname(self, identity, hostname):
+        fixedname = vim.vm.customization.FixedName(name=hostname)
+        if isinstance(identity, vim.vm.customization.LinuxPrep):
+            identity.hostName = fixedname
+        elif isinstance(identity, vim.vm.customization.Sysprep):
+            identity.userData.computerName = fixedname
+            if identity.userData.fullName == constants.CUSTOM_TEMPLATE_HOSTNAME:
+                identity.userData.fullName = hostname
+            if identity.userData.orgName == constants.CUSTOM_TEMPLATE_HOSTNAME:
+                identity.userData.orgName = hostname
+
+    def make_spec(self, vm_cfg, nics):
+        """
+        Make the custom spec of a VM, None if the guest can not be
+        customized.
+
+        @param vm_cfg: {"name": "vm01", "hostname": "vm01"}
+        @param nics: see network_customization, a nic without addresses
+                     keeps the template nic settings, or gets DHCP; None
+                     for a removed nic. The map gets one entry per nic of
+                     the VM, vCenter rejects any other count.
+        """
+        if self.identity is None:
+            return None
+        custom_spec = vim.vm.customization.Specification()
+        custom_spec.identity = copy_data_object(self.identity)
+        self._apply_hostname(custom_spec.identity,
+                             common_utils.sanitize_hostname(
+                                 vm_cfg['name'], vm_cfg.get('hostname')))
+        custom_spec.globalIPSettings = self.global_ip_settings
+        custom_spec.options = self.options
+        custom_spec.encryptionKey = self.encryption_key
+
+        nic_setting_map = []
+        for index, nic in enumerate([nic for nic in nics if nic]):
+            if index < len(self.nic_setting_map) and \
+                    not (nic.get('ip') or nic.get('ipv6')):
+                nic_setting_map.append(self.nic_setting_map[index])
+            else:
+                nic_setting_map.extend(network_customization([nic]))
+        custom_spec.nicSettingMap = nic_setting_map
+        return custom_spec
+
+
+def compile_custom_template(guest_id, vm_cfg):
+    """
+    Compile the customization template of a guest OS.
+
+    @param guest_id: the template config.guestId
+    @param vm_cfg: {"domain": "test.local", "dns_list": []}
+    """
+    identity = sysprep_customization(
+        hostname=constants.CUSTOM_TEMPLATE_HOSTNAME,
+        domain=vm_cfg.get('domain') or 'localhost.domain',
+        os_type=common_utils.get_os_type(guest_id))
+    return CustomizationTemplate(identity,
+                                 dns_customization(vm_cfg.get('dns_list') or []))
+
+
+def make_saved_custom_template(custom_spec):
+    """
+    Make the customization template of a spec saved in the vCenter
+    CustomizationSpecManager.
+
+    @param custom_spec: vim.vm.customization.Specification
+    """
+    return CustomizationTemplate(custom_spec.identity,
+                                 custom_spec.globalIPSettings,
+                                 custom_spec.nicSettingMap,
+                                 custom_spec.options,
+                                 custom_spec.encryptionKey)
 
-    custom_spec = vim.vm.customization.Specification()
-    # Make sysprep (hostname/domain/timezone/workgroup) customization
-    custom_spec.identity = sysprep_customization(
-        hostname=hostname,
-        domain=vm_cfg.get('domain'),
-        os_type=vm_cfg('os_type'))
-    # Make network customization
-    custom_spec.nicSettingMap = network_customization(nics)
-    # Make dns customization
-    custom_spec.globalIPSettings = dns_customization(dnslist)
 
-    return custom_spec
+def make_custom_spec(vm_mor, vm_cfg, nics, dnslist=None):
+    """
+    Make vm custom spec.
 
+    @param dnslist: default vm_cfg['dns_list']
+    """
+    # Get vm system type
+    guest_id = vm_mor.config.guestId
+    vm_cfg['os_type'] = common_utils.get_os_type(guest_id)
 
-def make_disk_locator_spec(relocate_spec, disk_dev, ds_mor, disk_type=None):
+    settings = {'domain': vm_cfg.get('domain'),
+                'dns_list': dnslist if dnslist is not None
+                else vm_cfg.get('dns_list')}
+    return compile_custom_template(guest_id, settings).make_spec(vm_cfg, nics)
+
+
+def make_disk_locator_spec(disk_dev, ds_mor, disk_type=None):
     """
     Make disk locator spec.
+
+    @param disk_dev: the vim.vm.device.VirtualDisk to move
+    @param disk_type: thin/preallocated/eagerZeroedThick, default the
+                      current one
     """
     disk_locator = vim.vm.RelocateSpec.DiskLocator()
     disk_locator.datastore = ds_mor
     disk_locator.diskId = disk_dev.key
-    # set disk type
-    disk_locator.diskBackingInfo = _set_disk_type(disk_dev.backing,
-                                                    disk_type)
-    relocate_spec.disk.append(disk_locator)
\ No newline at end of file
+    if disk_type:
+        # set disk type
+        disk_locator.diskBackingInfo = _set_disk_type(
+            copy_data_object(disk_dev.backing), disk_type)
+    return disk_locator
+
+
+def get_layout_sizes(layout_files, layout_disks):
+    """
+    Bytes of the files of a VM, from its layoutEx.
+
+    @param layout_files: layoutEx.file
+    @param layout_disks: layoutEx.disk
+    @return: ({disk device key: bytes of the files of its chain},
+              bytes of the other files, i.e. of the VM home)
+    """
+    file_sizes = dict((f.key, f.size or 0) for f in layout_files or [])
+    disk_sizes = {}
+    disk_file_keys = set()
+    for disk in layout_disks or []:
+        file_keys = set()
+        for unit in disk.chain or []:
+            file_keys.update(unit.fileKey or [])
+        disk_sizes[disk.key] = sum(file_sizes.get(key, 0) for key in file_keys)
+        disk_file_keys.update(file_keys)
+    home_size = sum(size for (key, size) in file_sizes.items()
+                    if key not in disk_file_keys)
+    return disk_sizes, home_size
+
+
+def get_relocate_transfers(devices, layout_sizes, home_ds_moid,
+                           relocate_spec):
+    """
+    The bytes a RelocateSpec copies between datastores.
+
+    The home moves to the spec datastore; a disk moves to its locator
+    datastore, else with the home. A disk whose target is its current
+    datastore is pinned and copies nothing.
+    @param devices: config.hardware.device of the VM
+    @param layout_sizes: get_layout_sizes of the VM
+    @param home_ds_moid: the datastore of the VM home, None if unknown
+    @return: {(source ds moid, destination ds moid): bytes}
+    """
+    disk_sizes, home_size = layout_sizes
+    dest_moid = relocate_spec.datastore._moId if relocate_spec.datastore \
+        else None
+    locators = dict((locator.diskId, locator.datastore._moId)
+                    for locator in relocate_spec.disk or []
+                    if locator.datastore)
+    transfers = {}
+
+    def _add(source_moid, target_moid, size):
+        if source_moid and target_moid and source_moid != target_moid:
+            key = (source_moid, target_moid)
+            transfers[key] = transfers.get(key, 0) + size
+
+    _add(home_ds_moid, dest_moid, home_size)
+    for dev in devices or []:
+        if not isinstance(dev, vim.vm.device.VirtualDisk):
+            continue
+        disk_ds = getattr(dev.backing, 'datastore', None)
+        if disk_ds is None:
+            continue
+        _add(disk_ds._moId, locators.get(dev.key, dest_moid),
+             disk_sizes.get(dev.key, 0))
+    return transfers
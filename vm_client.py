@@ -2,21 +2,31 @@
 
 from __future__ import absolute_import
 
+import functools
 import logging
+import time
 import uuid
 
 from pyVmomi import vim, vmodl
 
 from .base_client import BaseClient
+from .session import leased_methods, unleased
 from .tools import constants
+from .tools import datastore_utils
 from .tools import vm_utils
 from .tools import checker
+from .tools import placement_utils
+from .tools import result_utils
+from .tools import scheduler_utils
+from .tools import task_utils
+from .tools import version_utils as v_utils
 from .tools.result_utils import DataResult
 
 
 LOG = logging.getLogger(__name__)
 
 
+@leased_methods
 class VMClient(BaseClient):
     """
     VMware Manager VM Client.
@@ -24,7 +34,90 @@ class VMClient(BaseClient):
 
     def __init__(self, vc_info):
         super(VMClient, self).__init__(vc_info)
-        self.checker = checker.VmChecker(self.si)
+        # the checkers of the connection leased by the calling thread
+        self.checker = checker.VmChecker(lambda: self.si)
+        # compiled clone template layouts
+        self.template_layouts = vm_utils.TemplateLayoutCache()
+        # host/datastore placement of VMs whose location lacks them
+        self.placement = placement_utils.PlacementEngine(
+            self._fetch_placement_state,
+            refresh_seconds=constants.PLACEMENT_REFRESH_SECONDS)
+
+    def place_vm(self, location, memory_mb, disk_gb=0):
+        """
+        Fill the missing host_moid/ds_moid of a location from the placement
+        engine, the datastore also as ds_name. When neither rp_moid nor
+        cluster_moid is given, the host's cluster is set as cluster_moid,
+        the resource pool of a standalone host as rp_moid.
+
+        Given host_moid and ds_moid are kept, the host must mount the
+        datastore.
+        @return: the placement to release (self.placement.release) when
+            the VM failed or exists, None if host_moid and ds_moid were
+            given
+        """
+        placement = None
+        need_pool = not (location.get('rp_moid') or
+                         location.get('cluster_moid'))
+        if location.get('host_moid') and location.get('ds_moid'):
+            host_mor = self._make_mor([vim.HostSystem], location['host_moid'])
+            ds_mor = self._make_mor([vim.Datastore], location['ds_moid'])
+            objects = self.retrieve_mors_properties(
+                [host_mor, ds_mor],
+                {vim.HostSystem: ['parent', 'datastore'],
+                 vim.Datastore: ['name']})
+            for moid in (location['host_moid'], location['ds_moid']):
+                if moid not in objects:
+                    raise Exception("Not found host/datastore: %s" % moid)
+            host_ds_moids = [ds._moId for ds in
+                             objects[location['host_moid']]['datastore'] or []]
+            if location['ds_moid'] not in host_ds_moids:
+                raise Exception("The host %s does not mount the datastore "
+                                "%s." % (location['host_moid'],
+                                         location['ds_moid']))
+            location['ds_name'] = objects[location['ds_moid']]['name']
+            parent = objects[location['host_moid']]['parent']
+            parent_moid = parent._moId if parent else None
+        else:
+            scope = (location.get('dc_moid'), location.get('cluster_moid'))
+            placement = self.placement.place(
+                scope, memory_mb=memory_mb, disk_gb=disk_gb,
+                host_moid=location.get('host_moid'),
+                ds_moid=location.get('ds_moid'))
+            location['host_moid'] = placement['host_moid']
+            location['ds_moid'] = placement['ds_moid']
+            location['ds_name'] = placement['ds_name']
+            parent_moid = placement['parent_moid']
+        if need_pool and parent_moid:
+            parent_mor = self._make_mor([vim.ComputeResource], parent_moid)
+            if isinstance(parent_mor, vim.ClusterComputeResource):
+                location['cluster_moid'] = parent_moid
+            else:
+                # a standalone host, domain-s*
+                props = self.retrieve_mors_properties(
+                    [parent_mor], ['resourcePool']).get(parent_moid)
+                if props and props['resourcePool']:
+                    location['rp_moid'] = props['resourcePool']._moId
+        return placement
+
+    def _clone_disk_gb(self, layout, disks, linked=False):
+        """
+        The disk GB a clone takes on its datastore, the template disks of
+        a linked clone are shared.
+        """
+        template_gbs = [dev.capacityInKB / 1024.0 / 1024.0
+                        for dev in layout.disk_devices]
+        disk_gb = 0
+        for index, disk in enumerate(disks):
+            if not disk:
+                continue
+            if index < len(template_gbs):
+                if linked:
+                    continue
+                disk_gb += max(float(disk['disk_size']), template_gbs[index])
+            else:
+                disk_gb += float(disk['disk_size'])
+        return disk_gb
 
     def create_vm(self, vm_cfg, location, nics, disks, cdroms):
         """
@@ -35,8 +128,11 @@ class VMClient(BaseClient):
 
         @param location: {"dc_moid": "datacenter-2", "cluster_moid": "domain-c14",
                    "folder_moid": "group-v4263", "ds_name": "datastore01",
-                   "rp_moid": "resgroup-15"}
-        可选参数rp_moid, folder_moid
+                   "rp_moid": "resgroup-15", "host_moid": "host-1"}
+        可选参数rp_moid, folder_moid, host_moid
+        Without ds_name the host and datastore are placed, see place_vm;
+        given host_moid and ds_moid are kept, the host must mount the
+        datastore and ds_name is read from it.
 
         @param nics: [{"pg_moid": "network-11"}]
 
@@ -45,7 +141,9 @@ class VMClient(BaseClient):
                 ]
         vdev_node: 0:0-0:6,0:8-0:15, 1:0-1:6,1:8-1:15,
                    2:0-2:6,2:8-2:15, 3:0-3:6,3:8-3:15
+                   optional, the lowest free one by default
         disk_type: thin,eagerZeroedThick,preallocated
+        vm_cfg "scsi_type": the scsi controller type, default LsiLogic
 
         @param cdroms = [{"vdev_node": "0:0",
                     "iso_file": "[datastore1] CentOS-7-x86_64-Minimal-1810.iso"}
@@ -53,7 +151,18 @@ class VMClient(BaseClient):
         vdev_node: 0:0, 0:1, 1:0, 1:1
         """
         result = DataResult()
+        placement = None
         try:
+            if not location.get('ds_name') or \
+                    (location.get('host_moid') and location.get('ds_moid')):
+                location = dict(location)
+                placement = self.place_vm(
+                    location, vm_cfg['memoryMB'],
+                    sum(float(disk.get('disk_size') or 0) for disk in disks))
+            host_mor = None
+            if location.get('host_moid'):
+                host_mor = self.get_host_mor(location['host_moid'])
+
             # get dest folder
             vmfolder_mor = self.get_folder_mor(location.get('folder_moid'))
             if not vmfolder_mor:
@@ -86,14 +195,19 @@ class VMClient(BaseClient):
 
             # virtual device: disk
             scsi_controllers = []
+            if disks:
+                controller_spec = vm_utils.make_scsi_controller_spec(
+                    0, vm_cfg.get('scsi_type', 'LsiLogic'))
+                scsi_controllers.append(controller_spec.device)
+                config_spec.deviceChange.append(controller_spec)
+            vm_utils.assign_vdev_nodes(vm_utils.ScsiSlotAllocator(), disks)
             for disk in disks:
                 controller_spec = vm_utils.check_and_make_scsi_controller_spec(
                     scsi_controllers, disk)
                 if controller_spec:
                     scsi_controllers.append(controller_spec.device)
-                    config_spec.append(controller_spec)
-                disk_spec = vm_utils.make_attach_scsi_disk_device_spec(
-                    disk, scsi_controllers)
+                    config_spec.deviceChange.append(controller_spec)
+                disk_spec = vm_utils.make_attach_scsi_disk_device_spec(disk)
                 config_spec.deviceChange.append(disk_spec)
 
             # virtual device: cdrom
@@ -102,15 +216,19 @@ class VMClient(BaseClient):
                 config_spec.deviceChange.append(cdrom_spec)
 
             task_mor = vmfolder_mor.CreateVM_Task(config=config_spec,
-                                                  pool=res_pool_mor)
+                                                  pool=res_pool_mor,
+                                                  host=host_mor)
+            result.data = {'location': location}
             result.task_key = task_mor._moId
         except Exception as ex:
             LOG.exception(ex)
+            self.placement.release(placement)
             result.status = False
             result.message = "Create VM error: %s" % str(ex)
         return result
 
-    def clone_vm(self, template_moid, vm_cfg, location, nics, disks, poweron=False, template=False):
+    def clone_vm(self, template_moid, vm_cfg, location, nics, disks, poweron=False, template=False,
+                 linked=False, custom_spec_name=None):
         """
         Clone a VM from a template/VM.
 
@@ -121,8 +239,9 @@ class VMClient(BaseClient):
 
         @param location: {"dc_moid": "datacenter-2", "cluster_moid": "domain-c14",
                         "host_moid": "host-1", "rp_moid": "resgroup-15",
-                        "folder_moid": "group-v4263", "ds_name": "datastore01"}
+                        "folder_moid": "group-v4263", "ds_moid": "datastore-11"}
         可选参数rp_moid, folder_moid
+        Without host_moid/ds_moid they are placed, see place_vm.
 
         @param nics: [{'ip': '10.0.0.13', 'netmask': '255.255.255.0', 'gateway': '10.0.0.1',
                     'pg_moid': 'dvportgroup-391', 'adapter_type': 'E1000'}]
@@ -133,68 +252,420 @@ class VMClient(BaseClient):
         vdev_node: 0:0-0:6,0:8-0:15, 1:0-1:6,1:8-1:15,
                    2:0-2:6,2:8-2:15, 3:0-3:6,3:8-3:15
         disk_type: thin,eagerZeroedThick,preallocated
+
+        @param linked: linked clone from the template's current snapshot,
+            the clone gets child disks of the template disks instead of
+            copies. A base snapshot is created on a source VM without
+            snapshot; a source marked as template cannot take one and
+            must have a snapshot already, the clone fails otherwise.
+            The template disks are kept as they are, the disks beyond
+            them are added.
+        @param custom_spec_name: customize with a spec saved in the vCenter
+            CustomizationSpecManager, the hostname and the nics with
+            addresses of the VM are applied to it
         """
         result = DataResult()
+        placement = None
         try:
-            # get vm template managed object reference
-            template_mor = self.get_vm_mor(template_moid)
-
-            # get dest folder
-            vmfolder_mor = self.get_folder_mor(location.get('folder_moid'))
-            if not vmfolder_mor:
-                vmfolder_mor = self.get_dc_vm_folder_mor(location['dc_moid'])
-
-            if location.get('rp_moid'):
-                # get resource pool managed object reference
-                res_pool_mor = self.get_res_pool_mor(location['rp_moid'])
-            else:
-                # get cluster managed object reference
-                cluster_mor = self.get_cluster_mor(location['cluster_moid'])
-                res_pool_mor = cluster_mor.resourcePool
-
-            # get host managed object reference
-            host_mor = self.get_host_mor(location.get('host_moid'))
-
-            # get vm dest datastore managed object reference
-            datastore_mor = self.get_datastore_mor(location['ds_moid'])
-
-            # Extended network pg_mor attribute
-            for nic in nics:
-                nic['pg_mor'] = self.get_portgroup_mor(nic['pg_moid')
-
-            # make clone spec
-            clone_spec = vim.vm.CloneSpec()
-            clone_spec.powerOn = vm_cfg.get('poweron', False)
-            clone_spec.template = vm_cfg.get('template', False)
-
-            # config spec
-            clone_spec.config = make_clone_config_spec(template_mor, vm_cfg, nics, disks)
-            # relocate spec
-            clone_spec.location = vm_utils.make_clone_relocate_spec(clone_spec, res_pool_mor, esxi_mor, datastore_mor)
-            # customization spec
-            clone_spec.customization = vm_utils.make_custom_spec(vm_cfg, nics, dnslist)
-
+            # get vm template device layout
+            layout = self.get_template_layout(template_moid)
+            # the flags, uuid and resolved devices are set on copies, the
+            # dicts a caller reuses keep their own
+            vm_cfg = dict(vm_cfg)
+            nics = [dict(nic) for nic in nics]
+            disks = [dict(disk) for disk in disks]
+            vm_cfg.setdefault('poweron', poweron)
+            vm_cfg.setdefault('template', template)
+            location = dict(location)
+            placement = self.place_vm(location, vm_cfg['memoryMB'],
+                                      self._clone_disk_gb(layout, disks, linked))
             try:
-                task_mor = template_mor.Clone(name=vm_name,
-                                            folder=vmfolder_mor,
-                                            spec=clone_spec)
+                task_mor = self._start_clone(layout, vm_cfg, location,
+                                             nics, disks, {}, linked=linked,
+                                             custom_spec_name=custom_spec_name)
             except vmodl.MethodFault as ex:
                 LOG.exception(ex)
                 raise Exception("Clone vm error: %s" % str(ex))
-            vm_info= {"name": vm_cfg['name'],
-                        "uuid": vm_cfg['uuid'],
-                        "num_cpu": vm_cfg['num_cpu'],
-                        "num_core": vm_cfg['num_core'],
-                        "memoryMB": vm_cfg['memoryMB']
-                        }
-            result.data = {'vm_info': vm_info}
+            result.data = {'vm_info': self._clone_vm_info(vm_cfg),
+                           'location': location}
             result.task_key = task_mor._moId
         except Exception as ex:
             LOG.exception(ex)
+            self.placement.release(placement)
             result.status = False
             result.message = "Clone VM error: %s" % str(ex)
         return result
 
+    def clone_vms(self, template_moid, location, vms, host_limit=None,
+                  ds_limit=None, max_running=None, timeout=None, linked=False,
+                  custom_spec_name=None):
+        """
+        Clone many VMs from one template.
+
+        The template, folders, resource pools, hosts, datastores and
+        portgroups are resolved once for the whole batch. The clone tasks
+        are started under per-host and per-datastore limits and a
+        DataResult is yielded per VM as its task finishes.
+
+        @param location: the default location of the VMs, see clone_vm
+        @param vms: [{"vm_cfg": {"name": "vm01", ...}, "nics": [...],
+                      "disks": [...], "location": {"host_moid": "host-2"}}]
+                    see clone_vm, "location" is optional and overrides
+                    keys of the default location; VMs without
+                    host_moid/ds_moid are placed, see place_vm
+        @param host_limit: max running clones per host,
+                           default constants.CLONE_HOST_LIMIT
+        @param ds_limit: max running clones per datastore,
+                         default constants.CLONE_DATASTORE_LIMIT
+        @param max_running: max running clones in total,
+                            default constants.CLONE_MAX_RUNNING
+        @param linked: linked clones, see clone_vm
+        @param custom_spec_name: see clone_vm
+        @return: DataResult per VM,
+            data: {"vm_info": {...}, "vm_moid": "vm-12", "location": {...}}
+        """
+        try:
+            layout = self.get_template_layout(template_moid)
+        except Exception as ex:
+            LOG.exception(ex)
+            for vm in vms:
+                result = DataResult()
+                result.status = False
+                result.message = "Clone VM error: %s" % str(ex)
+                result.data = {'vm_info': self._clone_vm_info(vm['vm_cfg'])}
+                yield result
+            return
+
+        limits = {
+            'host': host_limit or constants.CLONE_HOST_LIMIT,
+            'datastore': ds_limit or constants.CLONE_DATASTORE_LIMIT,
+        }
+        # resolved managed objects shared by the VMs of the batch
+        cache = {}
+        vm_cfgs = {}
+        locations = {}
+        placements = {}
+        with self.get_task_tracker() as tracker:
+            scheduler = scheduler_utils.TaskScheduler(
+                tracker, limits, max_running or constants.CLONE_MAX_RUNNING)
+            for index, vm in enumerate(vms):
+                vm_cfg = dict(vm['vm_cfg'])
+                vm_location = dict(location, **vm.get('location', {}))
+                nics = [dict(nic) for nic in vm.get('nics', [])]
+                disks = [dict(disk) for disk in vm.get('disks', [])]
+                vm_cfgs[index] = vm_cfg
+                locations[index] = vm_location
+                try:
+                    placements[index] = self.place_vm(
+                        vm_location, vm_cfg['memoryMB'],
+                        self._clone_disk_gb(layout, disks, linked))
+                except Exception as ex:
+                    LOG.exception(ex)
+                    result = DataResult()
+                    result.status = False
+                    result.message = "Clone VM error: %s" % str(ex)
+                    result.data = {'vm_info': self._clone_vm_info(vm_cfg)}
+                    yield result
+                    continue
+                resources = [('host', vm_location.get('host_moid')),
+                             ('datastore', vm_location.get('ds_moid'))]
+                resources.extend(('datastore', disk.get('ds_moid'))
+                                 for disk in disks)
+                scheduler.submit(
+                    index,
+                    functools.partial(self._start_clone, layout, vm_cfg,
+                                      vm_location, nics, disks, cache,
+                                      linked=linked,
+                                      custom_spec_name=custom_spec_name),
+                    resources)
+
+            for index, task_info, error in scheduler.run(timeout):
+                # the task finished, the next refreshed placement state
+                # accounts a created VM
+                self.placement.release(placements.get(index))
+                result = DataResult()
+                result.data = {'vm_info': self._clone_vm_info(vm_cfgs[index]),
+                               'location': locations[index]}
+                if task_info is not None:
+                    info = task_utils.task_info_json(task_info)
+                    result.task_key = info['key']
+                    error = info['error']
+                    result.data['vm_moid'] = info['result_moid']
+                if error:
+                    result.status = False
+                    result.message = "Clone VM error: %s" % error
+                yield result
+
+    def get_template_layout(self, template_moid):
+        """
+        Get the vm_utils.TemplateLayout of a clone template.
+
+        A cached layout costs one config.changeVersion read, the template
+        is read again only when its config changed.
+        """
+        template_mor = self._make_mor([vim.VirtualMachine], template_moid)
+        props = self.retrieve_mors_properties(
+            [template_mor], ['config.changeVersion']).get(template_moid)
+        if props is None:
+            raise Exception("Not found template: %s" % template_moid)
+        layout = self.template_layouts.get(template_moid,
+                                           props['config.changeVersion'])
+        if layout is None:
+            template = self.prefetch_vms(
+                [template_mor],
+                constants.CLONE_TEMPLATE_PROPERTIES).get(template_moid)
+            if template is None:
+                raise Exception("Not found template: %s" % template_moid)
+            layout = vm_utils.TemplateLayout(template)
+            self.template_layouts.put(layout)
+        return layout
+
+    def get_saved_custom_template(self, spec_name):
+        """
+        Get the vm_utils.CustomizationTemplate of a spec saved in the
+        vCenter CustomizationSpecManager.
+        """
+        spec_manager = self.content.customizationSpecManager
+        try:
+            spec_item = spec_manager.GetCustomizationSpec(name=spec_name)
+        except vim.fault.NotFound:
+            raise Exception("Not found customization spec: %s" % spec_name)
+        return vm_utils.make_saved_custom_template(spec_item.spec)
+
+    def _get_custom_template(self, layout, vm_cfg, cache,
+                             custom_spec_name=None):
+        """
+        Get the customization template of a clone, compiled once per
+        batch for each spec name or domain/dns settings.
+        """
+        if custom_spec_name:
+            return self._cached(cache, ('custom_spec', custom_spec_name),
+                                self.get_saved_custom_template,
+                                custom_spec_name)
+        key = ('custom', vm_cfg.get('domain'),
+               tuple(vm_cfg.get('dns_list') or []))
+        return self._cached(cache, key, vm_utils.compile_custom_template,
+                            layout.guest_id, vm_cfg)
+
+    def _cached(self, cache, key, func, *args):
+        """
+        Return func(*args), computed once per key for a batch.
+        """
+        if key not in cache:
+            cache[key] = func(*args)
+        return cache[key]
+
+    def _resolve_clone_location(self, location, cache):
+        """
+        Resolve the folder/resource pool/host/datastore of a clone location.
+        """
+        vmfolder_mor = None
+        if location.get('folder_moid'):
+            vmfolder_mor = self._cached(cache, ('folder', location['folder_moid']),
+                                        self.get_folder_mor,
+                                        location['folder_moid'])
+        if not vmfolder_mor:
+            vmfolder_mor = self._cached(cache, ('vm_folder', location['dc_moid']),
+                                        self.get_dc_vm_folder_mor,
+                                        location['dc_moid'])
+
+        if location.get('rp_moid'):
+            # get resource pool managed object reference
+            res_pool_mor = self._cached(cache, ('rp', location['rp_moid']),
+                                        self.get_res_pool_mor,
+                                        location['rp_moid'])
+        else:
+            # get cluster managed object reference
+            def _get_cluster_pool(c_moid):
+                cluster_mor = self.get_cluster_mor(c_moid)
+                if not cluster_mor:
+                    raise Exception("Not found cluster: %s" % c_moid)
+                return cluster_mor.resourcePool
+            res_pool_mor = self._cached(cache, ('rp', location['cluster_moid']),
+                                        _get_cluster_pool,
+                                        location['cluster_moid'])
+        if not res_pool_mor:
+            raise Exception("Not found resource pool: %s" %
+                            location.get('rp_moid'))
+
+        # get host managed object reference
+        host_mor = None
+        if location.get('host_moid'):
+            host_mor = self._cached(cache, ('host', location['host_moid']),
+                                    self.get_host_mor, location['host_moid'])
+            if not host_mor:
+                raise Exception("Not found host: %s" % location['host_moid'])
+
+        # get vm dest datastore managed object reference
+        datastore_mor = self._cached(cache, ('ds', location['ds_moid']),
+                                     self.get_datastore_mor,
+                                     location['ds_moid'])
+        if not datastore_mor:
+            raise Exception("Not found datastore: %s" % location['ds_moid'])
+        return vmfolder_mor, res_pool_mor, host_mor, datastore_mor
+
+    def _resolve_clone_devices(self, nics, disks, cache):
+        """
+        Extend the nics with pg_mor/backing and the disks with ds_mor.
+        """
+        for nic in nics:
+            nic['pg_mor'] = self._cached(cache, ('pg', nic['pg_moid']),
+                                         self.get_portgroup_mor,
+                                         nic['pg_moid'])
+            if not nic['pg_mor']:
+                raise Exception("Not found portgroup: %s" % nic['pg_moid'])
+            nic['backing'] = self._cached(cache, ('backing', nic['pg_moid']),
+                                          vm_utils.make_nic_backing,
+                                          nic['pg_mor'])
+        for disk in disks:
+            if disk.get('ds_moid'):
+                disk['ds_mor'] = self._cached(cache, ('ds', disk['ds_moid']),
+                                              self.get_datastore_mor,
+                                              disk['ds_moid'])
+            elif disk.get('ds_name'):
+                ds_mors = self._cached(cache, ('ds_name', disk['ds_name']),
+                                       self.get_mors_by_name,
+                                       [vim.Datastore], disk['ds_name'])
+                disk['ds_mor'] = ds_mors[0] if ds_mors else None
+
+    def _get_linked_clone_snapshot(self, layout, template_mor):
+        """
+        Get the current snapshot of the template, create the base snapshot
+        of linked clones on a source VM which has none.
+        """
+        if layout.snapshot_moid:
+            return self._make_mor([vim.vm.Snapshot], layout.snapshot_moid)
+        if layout.is_template:
+            raise Exception(
+                "Template %s has no snapshot for linked clones, convert it "
+                "to a VM, take a snapshot and mark it as a template again." %
+                layout.moid)
+        LOG.info("Create linked clone base snapshot of %s." % template_mor._moId)
+        task_mor = template_mor.CreateSnapshot(
+            constants.LINKED_CLONE_SNAPSHOT_NAME,
+            "The base snapshot of linked clones.", False, False)
+        for task_info in task_utils.wait_for_tasks(self.si, [task_mor]):
+            if task_info.state != 'success':
+                raise Exception("Create linked clone base snapshot error: %s" %
+                                task_utils.task_info_json(task_info)['error'])
+            return task_info.result
+        raise Exception("Create linked clone base snapshot error: no result")
+
+    def _start_clone(self, layout, vm_cfg, location, nics, disks, cache,
+                     linked=False, custom_spec_name=None):
+        """
+        Resolve the clone objects, make the clone spec from the template
+        layout and start the task.
+        """
+        # the layout is cached across connections, bind the template to
+        # the leased one
+        template_mor = self._make_mor([vim.VirtualMachine], layout.moid)
+        (vmfolder_mor, res_pool_mor,
+         host_mor, datastore_mor) = self._resolve_clone_location(location,
+                                                                 cache)
+        self._resolve_clone_devices(nics, disks, cache)
+
+        # make clone spec
+        clone_spec = vim.vm.CloneSpec()
+        clone_spec.powerOn = vm_cfg.get('poweron', False)
+        clone_spec.template = vm_cfg.get('template', False)
+
+        disk_move_type = None
+        if linked:
+            clone_spec.snapshot = self._cached(
+                cache, ('snapshot', template_mor._moId),
+                self._get_linked_clone_snapshot, layout, template_mor)
+            disk_move_type = constants.DISK_MOVE_TYPE_LINKED
+
+        # config spec
+        clone_spec.config = vm_utils.make_clone_config_spec(template_mor, vm_cfg,
+                                                            nics, disks,
+                                                            linked=linked,
+                                                            layout=layout)
+        # relocate spec
+        clone_spec.location = vm_utils.make_clone_relocate_spec(
+            clone_spec, res_pool_mor, host_mor, datastore_mor,
+            disk_move_type=disk_move_type)
+        # customization spec
+        custom_template = self._get_custom_template(layout, vm_cfg, cache,
+                                                    custom_spec_name)
+        clone_spec.customization = custom_template.make_spec(vm_cfg, nics)
+        return template_mor.Clone(name=vm_cfg['name'],
+                                  folder=vmfolder_mor,
+                                  spec=clone_spec)
+
+    def _clone_vm_info(self, vm_cfg):
+        return {"name": vm_cfg.get('name'),
+                "uuid": vm_cfg.get('uuid'),
+                "num_cpu": vm_cfg.get('num_cpu'),
+                "num_core": vm_cfg.get('num_core'),
+                "memoryMB": vm_cfg.get('memoryMB')
+                }
+
+    def instant_clone_vm(self, parent_moid, vm_cfg, location, nics):
+        """
+        Instant clone a VM from a running parent VM.
+
+        The clone forks the running parent and shares its memory and disks,
+        there is no guest customization: the identity is passed in the
+        guestinfo extraConfig (see vm_utils.make_instant_clone_guest_config)
+        for a script in the parent guest to apply. The cpu/memory/disks of
+        the parent are kept. Requires vCenter 6.7 or greater.
+
+        @param parent_moid: vm-10, a powered on VM
+        @param vm_cfg: {"name": "vm01", "hostname": "vm01",
+                        "domain": "test.local", "uuid": "xxx", "dns_list": []}
+        @param location: see clone_vm
+        @param nics: see clone_vm, reconnect the parent nics in order
+        """
+        result = DataResult()
+        try:
+            vc_version = self.get_vc_version()
+            if v_utils.convert_version_to_int(vc_version) < \
+                    v_utils.convert_version_to_int(
+                        constants.MIN_INSTANT_CLONE_VC_VERSION):
+                raise Exception("Instant clone requires vCenter version %s "
+                                "or greater, detected %s." %
+                                (constants.MIN_INSTANT_CLONE_VC_VERSION,
+                                 vc_version))
+            parent_mor = self.prefetch_vms(
+                [self._make_mor([vim.VirtualMachine], parent_moid)],
+                constants.INSTANT_CLONE_PARENT_PROPERTIES).get(parent_moid)
+            if parent_mor is None:
+                raise Exception("Not found parent VM: %s" % parent_moid)
+
+            cache = {}
+            (vmfolder_mor, res_pool_mor,
+             host_mor, datastore_mor) = self._resolve_clone_location(location,
+                                                                     cache)
+            self._resolve_clone_devices(nics, [], cache)
+
+            if not vm_cfg.get('uuid'):
+                vm_cfg['uuid'] = str(uuid.uuid1())
+            relocate_spec = vim.vm.RelocateSpec()
+            relocate_spec.folder = vmfolder_mor
+            relocate_spec.pool = res_pool_mor
+            relocate_spec.host = host_mor
+            relocate_spec.datastore = datastore_mor
+            relocate_spec.deviceChange = vm_utils.make_instant_clone_nic_specs(
+                parent_mor, nics)
+
+            instant_clone_spec = vim.vm.InstantCloneSpec()
+            instant_clone_spec.name = vm_cfg['name']
+            instant_clone_spec.location = relocate_spec
+            instant_clone_spec.config = vm_utils.make_instant_clone_guest_config(
+                vm_cfg, nics)
+            instant_clone_spec.biosUuid = vm_cfg['uuid']
+
+            task_mor = parent_mor.InstantClone_Task(spec=instant_clone_spec)
+            result.data = {'vm_info': self._clone_vm_info(vm_cfg)}
+            result.task_key = task_mor._moId
+        except Exception as ex:
+            LOG.exception(ex)
+            result.status = False
+            result.message = "Instant clone VM error: %s" % str(ex)
+        return result
+
     def clone_template(self, template_moid, vm_cfg, location, nics, disks, poweron=False):
         return self.clone_vm(template_moid, vm_cfg, location, nics, disks, poweron=poweron, template=True)
 
@@ -318,6 +789,215 @@ class VMClient(BaseClient):
             result.message = "Shutdown VM Guest error: %s" % str(ex)
         return result
 
+    def _batch_power_vms(self, vms, operation, concurrency=None, wait=False,
+                         timeout=None):
+        """
+        Run a power operation on many VMs.
+
+        All VMs are resolved in one inventory call, the operation is
+        submitted from up to concurrency threads and the per-VM
+        DataResults are aggregated.
+        """
+        method_name, op_name, need_guest_ops = \
+            constants.VM_POWER_OPERATIONS[operation]
+        results = {}
+        vm_moids = []
+        for vm in vms:
+            vm_moid = vm.get('moid')
+            if vm_moid and vm_moid not in results:
+                results[vm_moid] = DataResult()
+                vm_moids.append(vm_moid)
+
+        with self.lease():
+            vm_mors = [self._make_mor([vim.VirtualMachine], vm_moid)
+                       for vm_moid in vm_moids]
+            vms_props = self.retrieve_mors_properties(
+                vm_mors, ['name', 'guest.guestOperationsReady'])
+        todo = []
+        for vm_moid in vm_moids:
+            props = vms_props.get(vm_moid)
+            result = results[vm_moid]
+            if not props:
+                result.status = False
+                result.message = "Not found VM: %s" % vm_moid
+            elif need_guest_ops and not props['guest.guestOperationsReady']:
+                result.status = False
+                result.message = "This operation is not supported in the current state."
+            else:
+                todo.append(vm_moid)
+
+        def _submit(vm_moid):
+            result = results[vm_moid]
+            try:
+                # bind to the stub of the leased connection
+                vm_mor = self._make_mor([vim.VirtualMachine], vm_moid)
+                task_mor = getattr(vm_mor, method_name)()
+                if task_mor:
+                    result.task_key = task_mor._moId
+            except Exception as ex:
+                LOG.exception(ex)
+                result.status = False
+                result.message = "%s error: %s" % (op_name, str(ex))
+
+        self._run_concurrently(_submit, todo, concurrency)
+        if wait:
+            self._wait_task_results(results, timeout)
+        return result_utils.aggregate_results(results)
+
+    @unleased
+    def batch_poweron_vms(self, vms, concurrency=None, wait=False,
+                          timeout=None):
+        """
+        PowerOn VMs.
+
+        @param vms: [{"moid": "vm-10"}, {"moid": "vm-11"}]
+        @param concurrency: threads submitting tasks, default
+                            constants.BATCH_CONCURRENCY
+        @param wait: wait for the tasks, a failed task fails its VM result
+        @return: DataResult, data: {"results": {vm_moid: DataResult}}
+        """
+        return self._batch_power_vms(vms, 'poweron', concurrency, wait,
+                                     timeout)
+
+    @unleased
+    def batch_poweroff_vms(self, vms, concurrency=None, wait=False,
+                           timeout=None):
+        """
+        PowerOff VMs.
+        """
+        return self._batch_power_vms(vms, 'poweroff', concurrency, wait,
+                                     timeout)
+
+    @unleased
+    def batch_reset_vms(self, vms, concurrency=None, wait=False,
+                        timeout=None):
+        """
+        Reset VMs.
+        """
+        return self._batch_power_vms(vms, 'reset', concurrency, wait,
+                                     timeout)
+
+    @unleased
+    def batch_suspend_vms(self, vms, concurrency=None, wait=False,
+                          timeout=None):
+        """
+        Suspend VMs.
+        """
+        return self._batch_power_vms(vms, 'suspend', concurrency, wait,
+                                     timeout)
+
+    @unleased
+    def batch_shutdown_vms(self, vms, concurrency=None):
+        """
+        Shutdown VMs Guest.
+        """
+        return self._batch_power_vms(vms, 'shutdown', concurrency)
+
+    @unleased
+    def batch_reboot_vms(self, vms, concurrency=None):
+        """
+        Reboot VMs Guest.
+        """
+        return self._batch_power_vms(vms, 'reboot', concurrency)
+
+    def poweron_vms_multi(self, vms, options=None, timeout=None):
+        """
+        PowerOn VMs with Datacenter.PowerOnMultiVM_Task, DRS places all
+        VMs of a datacenter in one pass.
+
+        The VMs are grouped by datacenter and one multi-VM task is issued
+        per group; the per-VM results are parsed from the tasks'
+        ClusterPowerOnVmResult.
+
+        @param vms: [{"moid": "vm-10"}, {"moid": "vm-11"}]
+        @param options: {"OverrideAutomationLevel": "fullyAutomated",
+                         "ReserveResources": False}
+        @return: DataResult, data: {"results": {vm_moid: DataResult}}
+            attempted VM: task_key of its power on task
+            not attempted VM: status False, message the fault
+            VMs DRS reports but that were not requested are left out
+        """
+        results = {}
+        vm_mors = []
+        for vm in vms:
+            vm_moid = vm.get('moid')
+            if vm_moid and vm_moid not in results:
+                results[vm_moid] = DataResult()
+                vm_mors.append(self._make_mor([vim.VirtualMachine], vm_moid))
+
+        dc_groups = {}
+        try:
+            datacenters = self.get_mors_datacenters(vm_mors)
+        except Exception as ex:
+            LOG.exception(ex)
+            datacenters = {}
+            for result in results.values():
+                result.status = False
+                result.message = "PowerOn VM error: %s" % str(ex)
+        for vm_mor in vm_mors:
+            dc_mor = datacenters.get(vm_mor._moId)
+            if dc_mor is None:
+                if results[vm_mor._moId].status:
+                    results[vm_mor._moId].status = False
+                    results[vm_mor._moId].message = \
+                        "Not found VM: %s" % vm_mor._moId
+                continue
+            dc_groups.setdefault(dc_mor._moId, (dc_mor, []))[1].append(vm_mor)
+
+        option = vm_utils._make_extra_config(options) if options else None
+        task_groups = {}
+        for dc_mor, group in dc_groups.values():
+            try:
+                task_mor = dc_mor.PowerOnMultiVM_Task(vm=group, option=option)
+                task_groups[task_mor._moId] = group
+            except Exception as ex:
+                LOG.exception(ex)
+                for vm_mor in group:
+                    results[vm_mor._moId].status = False
+                    results[vm_mor._moId].message = \
+                        "PowerOn VM error: %s" % str(ex)
+
+        for task_info in task_utils.wait_for_tasks(
+                self.si, list(task_groups.keys()), timeout):
+            group = task_groups.pop(task_info.key)
+            if task_info.state != 'success':
+                error = task_utils.task_info_json(task_info)['error']
+                for vm_mor in group:
+                    results[vm_mor._moId].status = False
+                    results[vm_mor._moId].message = \
+                        "PowerOn VM error: %s" % error
+                continue
+            attempted = set()
+            power_on_result = task_info.result
+            # DRS may power on VMs that were not requested (e.g. by VM
+            # dependency rules), those are skipped
+            for info in power_on_result.attempted if power_on_result else []:
+                vm_result = results.get(info.vm._moId)
+                if vm_result is None:
+                    continue
+                attempted.add(info.vm._moId)
+                if info.task:
+                    vm_result.task_key = info.task._moId
+            for info in power_on_result.notAttempted if power_on_result else []:
+                vm_result = results.get(info.vm._moId)
+                if vm_result is None:
+                    continue
+                attempted.add(info.vm._moId)
+                vm_result.status = False
+                vm_result.message = "PowerOn VM error: %s" % (
+                    getattr(info.fault, 'msg', None) or str(info.fault))
+            for vm_mor in group:
+                if vm_mor._moId not in attempted:
+                    results[vm_mor._moId].status = False
+                    results[vm_mor._moId].message = \
+                        "PowerOn VM error: not attempted"
+        for group in task_groups.values():
+            for vm_mor in group:
+                results[vm_mor._moId].status = False
+                results[vm_mor._moId].message = \
+                    "PowerOn VM error: timeout waiting for the task"
+        return result_utils.aggregate_results(results)
+
     def destroy_vm(self, vm):
         """
         Reboot VM.
@@ -373,63 +1053,194 @@ class VMClient(BaseClient):
             raise Exception("Precheck resize vm cpu memery error!")
         return result
 
-    def resize_cpu(self, vm_moid, cpu_num):
+    def reconfigure_vm(self, vm_moid, changes):
         """
-        Resize VM CPU num.
+        Reconfigure a VM with one ReconfigVM_Task.
+
+        All the changes go into one vim.vm.ConfigSpec, e.g. resize + add
+        nic + extra config is one task, one VMX rewrite and one stun.
+        @param changes: {
+            "cpu_num": 4,
+            "memory_mb": 8192,
+            "disks": [{'dev_key': 2000, 'disk_size': 32}],
+            "add_nics": [{"pg_moid": "", "adapter_type": 'E1000'}],
+            "edit_nics": [{"pg_moid": "", "dev_key": 4000}],
+            "del_nics": [{"dev_key": 4001}],
+            "add_disks": [{"ds_name": "datastore01", "disk_type": "thin",
+                           "disk_size": 10}],
+            "share_disk": False,
+            "extra_config": {'disk.EnableUUID': 'true'},
+            "tools": {"sync_host_time": True, "auto_upgrade": False},
+        }
+        all optional, add_disks/share_disk see attach_scsi_disks
+        @return: DataResult, no task_key if there is nothing to change
         """
+        return self._reconfigure_vm(vm_moid, changes, "Reconfigure vm error")
+
+    def _reconfigure_vm(self, vm_moid, changes, error_message):
         result = DataResult()
         try:
             vm_mor = self.get_vm_mor(vm_moid)
-
-            config_spec = vim.vm.ConfigSpec()
-            config_spec.numCPUs = int(cpu_num)
-            task_mor = vm_mor.ReconfigVM_Task(spec=config_spec)
-            result.task_key = task_mor._moId
+            transaction = self._make_reconfigure_transaction(vm_mor, changes)
+            task_mor = transaction.commit()
+            if task_mor is None:
+                result.message = "Nothing to reconfigure."
+            else:
+                result.task_key = task_mor._moId
         except Exception as ex:
             LOG.exception(ex)
             result.status = False
-            result.message = "Resize vm cpu error: %s" % str(ex)
+            result.message = "%s: %s" % (error_message, str(ex))
         return result
 
+    def _make_reconfigure_transaction(self, vm_mor, changes, config=None,
+                                      cache=None):
+        """
+        Make the vm_utils.ReconfigureTransaction of reconfigure_vm changes,
+        more edits can be added to it before its commit.
+
+        @param config: vm_mor.config if already read
+        @param cache: nic backings by portgroup moid, a portgroup is read
+                      once
+        """
+        transaction = vm_utils.ReconfigureTransaction(vm_mor, config)
+        cache = {} if cache is None else cache
+        if changes.get('cpu_num') is not None:
+            transaction.set_cpu(changes['cpu_num'])
+        if changes.get('memory_mb') is not None:
+            transaction.set_memory(changes['memory_mb'])
+        for disk in changes.get('disks') or []:
+            transaction.resize_disk(disk['dev_key'], disk['disk_size'])
+        for nic in changes.get('del_nics') or []:
+            transaction.delete_nic(nic['dev_key'])
+        for nic in changes.get('edit_nics') or []:
+            backing = self._cached(cache, nic['pg_moid'], self._get_nic_backing,
+                                   nic['pg_moid'])
+            transaction.edit_nic(nic['dev_key'], backing=backing)
+        for nic in changes.get('add_nics') or []:
+            backing = self._cached(cache, nic['pg_moid'], self._get_nic_backing,
+                                   nic['pg_moid'])
+            transaction.add_nic(None, nic.get("adapter_type", "VMXNET3"),
+                                backing=backing)
+        if changes.get('add_disks'):
+            transaction.attach_disks(changes['add_disks'],
+                                     changes.get('share_disk', False))
+        if changes.get('extra_config'):
+            transaction.set_extra_config(changes['extra_config'])
+        tools_conf = changes.get('tools')
+        if tools_conf:
+            transaction.set_tools(tools_conf.get('sync_host_time'),
+                                  tools_conf.get('auto_upgrade'))
+        return transaction
+
+    @unleased
+    def reconcile_vm(self, vm_moid, vm_cfg=None, nics=None, disks=None):
+        """
+        Converge a VM to a desired state.
+
+        The desired state is diffed against the current one
+        (tools.vm.vm_hardware_info_json) and only the drifted settings are
+        reconfigured, with one ReconfigVM_Task; a converged VM is not
+        touched.
+        @param vm_cfg/nics/disks: the desired state, see
+                                  vm_utils.diff_vm_state
+        @return: DataResult, data: {"changes": reconfigure_vm changes},
+                 no task_key if the VM is converged
+        """
+        result = self.reconcile_vms([{"moid": vm_moid, "vm_cfg": vm_cfg,
+                                      "nics": nics, "disks": disks}])
+        return result.data['results'][vm_moid]
+
+    @unleased
+    def reconcile_vms(self, vms, concurrency=None, wait=False, timeout=None):
+        """
+        Converge many VMs to their desired states, see reconcile_vm.
+
+        The current states of all VMs are read in one PropertyCollector
+        call, only the drifted VMs are reconfigured.
+        @param vms: [{"moid": "vm-10", "vm_cfg": {"num_cpu": 4},
+                      "nics": [{"pg_moid": "network-11"}], "disks": []}]
+        @param wait: wait for the tasks, a failed task fails its VM result
+        @return: DataResult, data: {"results": {vm_moid: DataResult}}
+        """
+        results = {}
+        desired = {}
+        for vm in vms:
+            if vm.get('moid') and vm['moid'] not in results:
+                results[vm['moid']] = DataResult()
+                desired[vm['moid']] = vm
+
+        with self.lease():
+            vm_mors = [self._make_mor([vim.VirtualMachine], vm_moid)
+                       for vm_moid in desired]
+            current = self.prefetch_vms(vm_mors,
+                                        constants.RECONCILE_VM_PROPERTIES)
+        todo = []
+        for (vm_moid, vm) in desired.items():
+            result = results[vm_moid]
+            try:
+                if vm_moid not in current:
+                    raise Exception("Not found VM: %s" % vm_moid)
+                result.data = {"changes": vm_utils.diff_vm(
+                    current[vm_moid], vm.get('vm_cfg'), vm.get('nics'),
+                    vm.get('disks'))}
+            except Exception as ex:
+                LOG.exception(ex)
+                result.status = False
+                result.message = "Reconcile vm error: %s" % str(ex)
+                continue
+            if result.data['changes']:
+                todo.append(vm_moid)
+            else:
+                result.message = "Nothing to reconfigure."
+
+        # portgroup backings, shared by the VMs
+        cache = {}
+
+        def _submit(vm_moid):
+            result = results[vm_moid]
+            try:
+                # bind to the stub of the leased connection
+                vm_mor = self._make_mor([vim.VirtualMachine], vm_moid)
+                transaction = self._make_reconfigure_transaction(
+                    vm_mor, result.data['changes'], current[vm_moid].config,
+                    cache)
+                result.task_key = transaction.commit()._moId
+            except Exception as ex:
+                LOG.exception(ex)
+                result.status = False
+                result.message = "Reconcile vm error: %s" % str(ex)
+
+        if todo:
+            self._run_concurrently(_submit, todo, concurrency)
+        if wait:
+            self._wait_task_results(results, timeout)
+        return result_utils.aggregate_results(results)
+
+    def _get_nic_backing(self, pg_moid):
+        return vm_utils.make_nic_backing(self.get_portgroup_mor(pg_moid))
+
+    def resize_cpu(self, vm_moid, cpu_num):
+        """
+        Resize VM CPU num.
+        """
+        return self._reconfigure_vm(vm_moid, {"cpu_num": cpu_num},
+                                    "Resize vm cpu error")
+
     def resize_memory(self, vm_moid, memoryMB):
         """
         Resize VM memory size(MB).
         """
-        result = DataResult()
-        try:
-            vm_mor = self.get_vm_mor(vm_moid)
-
-            config_spec = vim.vm.ConfigSpec()
-            config_spec.memoryMB = memoryMB
-            task_mor = vm_mor.ReconfigVM_Task(spec=config_spec)
-            result.task_key = task_mor._moId
-        except Exception as ex:
-            LOG.exception(ex)
-            result.status = False
-            result.message = "Resize vm memory error: %s" % str(ex)
-        return result
+        return self._reconfigure_vm(vm_moid, {"memory_mb": memoryMB},
+                                    "Resize vm memory error")
 
     def resize_vmdk_disks(self, vm_moid, disks):
         """
         Resize vm disk.
         @param disks: [{'dev_key': 2000, 'disk_size': 32}]
         """
-        result = DataResult()
-        try:
-            vm_mor = self.get_vm_mor(vm_moid)
-
-            config_spec = vim.vm.ConfigSpec()
-            for disk in disks:
-                disk_spec = vm_utils.make_resize_disk_device_spec(vm_mor, disk["dev_key"], disk["disk_size"])
-                config_spec.deviceChange.append(disk_spec)
-
-            task_mor = vm_mor.ReconfigVM_Task(spec=config_spec)
-            result.task_key = task_mor._moId
-        except Exception as ex:
-            LOG.exception(ex)
-            result.status = False
-            result.message = "Resize vmdk disk error: %s" % str(ex)
-        return result
+        return self._reconfigure_vm(vm_moid, {"disks": disks},
+                                    "Resize vmdk disk error")
 
     def attach_scsi_disks(self, vm_moid, disks, share_disk=False):
         """
@@ -450,39 +1261,15 @@ class VMClient(BaseClient):
             'disk_mode': 'persistent',
             },
         ]
+        vdev_node: optional, the lowest free one by default
         disk_mode:
             independent_persistent / persistent / independent_nonpersistent
         compatibility_mode:
             virtualMode / physicalMode
         """
-        result = DataResult()
-        try:
-            vm_mor = self.get_vm_mor(vm_moid)
-
-            # get vm scsi controllers
-            scsi_controllers = vm_utils._get_vm_scsi_controller_devices(vm_mor)
-            disk_enable_uuid = False
-            config_spec = vim.vm.ConfigSpec()
-            for disk in disks:
-                controller_spec = vm_utils.check_and_make_scsi_controller_spec(scsi_controllers, disk, share_disk)
-                if controller_spec:
-                    scsi_controllers.append(controller_spec.device)
-                    config_spec.append(controller_spec)
-                disk_spec = vm_utils.make_attach_scsi_disk_device_spec(disk, scsi_controllers, share_disk)
-                config_spec.deviceChange.append(disk_spec)
-                if share_disk and not disk.get("is_raw"):
-                    disk_enable_uuid = True
-            if disk_enable_uuid:
-                extra_cfg = vm_utils.make_disk_enable_uuid_extra_config()
-                config_spec.deviceChange.append(extra_cfg)
-
-            task_mor = vm_mor.ReconfigVM_Task(spec=config_spec)
-            result.task_key = task_mor._moId
-        except Exception as ex:
-            LOG.exception(ex)
-            result.status = False
-            result.message = "Attach scsi disks error: %s" % str(ex)
-        return result
+        return self._reconfigure_vm(
+            vm_moid, {"add_disks": disks, "share_disk": share_disk},
+            "Attach scsi disks error")
 
     def detach_scsi_disks(self, vm_moid, disks):
         """
@@ -542,24 +1329,8 @@ class VMClient(BaseClient):
         @param vm_moid: 'vm-18'
         @param nics: [{"pg_moid": "", "adapter_type": 'E1000'}]
         """
-        result = DataResult()
-        try:
-            vm_mor = self.get_vm_mor(vm_moid)
-
-            config_spec = vim.vm.ConfigSpec()
-            for nic in nics:
-                pg_mor = self.get_portgroup_mor(nic["pg_moid"])
-                nic_spec = vm_utils.make_add_nic_device_spec(
-                    pg_mor, nic.get("adapter_type", "VMXNET3"))
-                config_spec.deviceChange.append(nic_spec)
-
-            task_mor = vm_mor.ReconfigVM_Task(spec=config_spec)
-            result.task_key = task_mor._moId
-        except Exception as ex:
-            LOG.exception(ex)
-            result.status = False
-            result.message = "Add nics error: %s" % str(ex)
-        return result
+        return self._reconfigure_vm(vm_moid, {"add_nics": nics},
+                                    "Add nics error")
 
     def edit_nics(self, vm_moid, nics):
         """
@@ -567,50 +1338,19 @@ class VMClient(BaseClient):
         @param vm_moid: 'vm-18'
         @param nics: [{"pg_moid": "", "dev_key": "int, >=4000, <4100"}]
         """
-        result = DataResult()
-        try:
-            vm_mor = self.get_vm_mor(vm_moid)
-
-            config_spec = vim.vm.ConfigSpec()
-            for nic in nics:
-                pg_mor = self.get_portgroup_mor(nic['pg_moid'])
-                nic_spec = vm_utils.make_edit_nic_device_spec(
-                    vm_mor, nic['dev_key'], pg_mor)
-                config_spec.deviceChange.append(nic_spec)
-
-            task_mor = vm_mor.ReconfigVM_Task(spec=config_spec)
-            result.task_key = task_mor._moId
-        except Exception as ex:
-            LOG.exception(ex)
-            result.status = False
-            result.message = "Edit nics error: %s" % str(ex)
-        return result
+        return self._reconfigure_vm(vm_moid, {"edit_nics": nics},
+                                    "Edit nics error")
 
     def del_nics(self, vm_moid, nics):
         """
         Delete network adapters.
         @param nics: [{"dev_key": "int, >=4000, <4010"}]
         """
-        result = DataResult()
-        try:
-            vm_mor = self.get_vm_mor(vm_moid)
-
-            config_spec = vim.vm.ConfigSpec()
-            for nic in nics:
-                nic_spec = vm_utils.make_delete_nic_device_spec(
-                    vm_mor, nic['dev_key'])
-                config_spec.deviceChange.append(nic_spec)
-
-            task_mor = vm_mor.ReconfigVM_Task(spec=config_spec)
-            result.task_key = task_mor._moId
-        except Exception as ex:
-            LOG.exception(ex)
-            result.status = False
-            result.message = "Delete nics error: %s" % str(ex)
-        return result
+        return self._reconfigure_vm(vm_moid, {"del_nics": nics},
+                                    "Delete nics error")
 
     def mark_as_template(self, vm_moid):
-         """
+        """
         Mark vm as template.
         """
         result = DataResult()
@@ -649,23 +1389,10 @@ class VMClient(BaseClient):
             "auto_upgrade": False,
         }
         """
-        result= DataResult()
-        try:
-            vm_mor= self.get_vm_mor(vm_moid)
-            config_spec= vim.vm.ConfigSpec()
-            config_spec.tools= vm_mor.config.tools
-            config_spec.tools.syncTimeWithHost= tools_config.get('sync_host_time', False)
-            if tools_config.get('auto_upgrade', False):
-                spec.tools.toolsUpgradePolicy= "upgradeAtPowerCycle"
-            else:
-                spec.tools.toolsUpgradePolicy= "manual"
-            task_mor= vm_mor.ReconfigVM_Task(spec=config_spec)
-            result.task_key = task_mor._moId
-        except Exception as ex:
-            LOG.exception(ex)
-            result.status = False
-            result.message = "Reconfigure VM VMware tools error: %s" % str(ex)
-        return result
+        tools_conf = {"sync_host_time": tools_conf.get('sync_host_time', False),
+                      "auto_upgrade": tools_conf.get('auto_upgrade', False)}
+        return self._reconfigure_vm(vm_moid, {"tools": tools_conf},
+                                    "Reconfigure VM VMware tools error")
 
     def vm_extra_config(self, vm_moid, options):
         """
@@ -673,17 +1400,8 @@ class VMClient(BaseClient):
 
         @param options: {'disk.EnableUUID': 'true'}
         """
-        result= DataResult()
-        try:
-            vm_mor= self.get_vm_mor(vm_moid)
-            config_spec= vm_utils._make_extra_config(options)
-            task_mor= vm_mor.ReconfigVM_Task(spec=config_spec)
-            result.task_key = task_mor._moId
-        except Exception as ex:
-            LOG.exception(ex)
-            result.status = False
-            result.message = "Add or update vm extra configure error: %s" % str(ex)
-        return result
+        return self._reconfigure_vm(vm_moid, {"extra_config": options},
+                                    "Add or update vm extra configure error")
 
     def check_vm_migrate(self, vm_moid, host_moid, cluster_moid):
         """
@@ -696,6 +1414,51 @@ class VMClient(BaseClient):
         check_result = self.checker.check_migrate(vm_mor, host_mor, res_pool_mor)
         return check_result
 
+    def check_vms_migrate(self, vm_moids, host_moids=None, cluster_moid=None,
+                          power_state=None, timeout=None):
+        """
+        Check the vMotion of many VMs to many hosts, e.g. the pre-flight of
+        a host evacuation.
+
+        One CheckMigrate task checks all VMs against a host, the tasks of
+        all hosts run at once.
+        @param host_moids: the target hosts, or only the cluster_moid
+                           resource pool
+        @return: DataResult, data: {vm_moid: {host_moid: {"status": "",
+                 "msg": "", "warnings": [], "errors": []}}}
+        """
+        result = DataResult()
+        try:
+            vm_mors = [self._make_mor([vim.VirtualMachine], vm_moid)
+                       for vm_moid in vm_moids]
+            found = self.retrieve_mors_properties(vm_mors, ['name'])
+            cluster_mor = self.get_cluster_mor(cluster_moid)
+            res_pool_mor = cluster_mor.resourcePool if cluster_mor else None
+            vm_mors = [vm_mor for vm_mor in vm_mors if vm_mor._moId in found]
+            host_mors = [self._make_mor([vim.HostSystem], host_moid)
+                         for host_moid in host_moids or []] or [None]
+            checks = {}
+            if vm_mors:
+                checks = self.checker.check_migrate_vms(
+                    [(vm_mors, host_mor, res_pool_mor)
+                     for host_mor in host_mors], power_state,
+                    timeout=timeout)
+            data = {}
+            for vm_moid in vm_moids:
+                if vm_moid not in found:
+                    check_result = checker.CheckResult()
+                    check_result.add_error("Not found VM: %s" % vm_moid)
+                    checks[vm_moid] = {None: check_result}
+                data[vm_moid] = dict(
+                    (host_moid, dict(check_result)) for (host_moid, check_result)
+                    in checks.get(vm_moid, {}).items())
+            result.data = data
+        except Exception as ex:
+            LOG.exception(ex)
+            result.status = False
+            result.message = "Check vms migrate error: %s" % str(ex)
+        return result
+
     def migrate_vm(self, vm_moid, host_moid=None, cluster_moid=None,
                     priority='defaultPriority'):
         """
@@ -718,90 +1481,146 @@ class VMClient(BaseClient):
             result.message = "VM vMotion error: %s" % str(ex)
         return result
 
-    def check_vm_relocate(self, vm_moid, relocate_config):
+    def _make_relocate_spec(self, vm_mor, relocate_config, cache=None,
+                            devices=None):
         """
-        Check vm relocate.
+        Make the RelocateSpec of a relocate_config, see relocate_vm.
 
-        @param relocate_config[
-            'host_moid': "",
-            'ds_moid': "",
-            'folder_moid': "",
-            'nic': ["dev_key": "", "pg_moid": ""],
-            'disk': ["dev_key": "", "ds_moid": "", "ds_type": ""],
-            ]
+        @param cache: resolved managed objects shared by the VMs of a batch
+        @param devices: vm_mor.config.hardware.device if already read
         """
-        vm_mor = self.get_vm_mor(vm_moid)
-        host_mor = self.get_host_mor(relocate_config.get('host_moid'))
-        cluster_mor = self.get_cluster_mor(relocate_config.get('cluster_moid'))
-        res_pool_mor = cluster_mor.resourcePool if cluster_mor else None
-        ds_mor = utils.get_datastore_mor(relocate_config.get('ds_moid'))
-        folder_mor = utils.get_folder_mor(relocate_config.get('folder_moid'))
-
+        cache = {} if cache is None else cache
         relocate_spec = vim.vm.RelocateSpec()
-        relocate_spec.folder = folder_mor
-        relocate_spec.host = host_mor
-        relocate_spec.pool = res_pool_mor
-        relocate_spec.datastore = ds_mor
-
+        relocate_spec.folder = self._cached(
+            cache, ('folder', relocate_config.get('folder_moid')),
+            self.get_folder_mor, relocate_config.get('folder_moid'))
+        relocate_spec.host = self._cached(
+            cache, ('host', relocate_config.get('host_moid')),
+            self.get_host_mor, relocate_config.get('host_moid'))
+        cluster_mor = self._cached(
+            cache, ('cluster', relocate_config.get('cluster_moid')),
+            self.get_cluster_mor, relocate_config.get('cluster_moid'))
+        relocate_spec.pool = cluster_mor.resourcePool if cluster_mor else None
+        relocate_spec.datastore = self._cached(
+            cache, ('datastore', relocate_config.get('ds_moid')),
+            self.get_datastore_mor, relocate_config.get('ds_moid'))
+
+        nics_cfg = relocate_config.get("nics_cfg") or []
+        disks_cfg = relocate_config.get("disks_cfg") or []
+        if nics_cfg or disks_cfg:
+            if devices is None:
+                devices = vm_mor.config.hardware.device
+            devices = dict((dev.key, dev) for dev in devices)
         # nic device change spec
-        for nic_cfg in relocate_config.get("nics_cfg", []):
-            pg_mor = self.get_portgroup_mor(nic_cfg['pg_moid'])
-            nic_spec = vm_utils.make_edit_nic_device_spec(
-                vm_mor, nic_cfg['dev_key'], pg_mor)
+        for nic_cfg in nics_cfg:
+            if nic_cfg['dev_key'] not in devices:
+                raise Exception("The vm %s nic device %s not found!" %
+                                (vm_mor._moId, nic_cfg['dev_key']))
+            backing = self._cached(cache, ('backing', nic_cfg['pg_moid']),
+                                   self._get_nic_backing, nic_cfg['pg_moid'])
+            nic_spec = vim.vm.device.VirtualDeviceSpec()
+            nic_spec.operation = 'edit'
+            nic_spec.device = vm_utils.copy_data_object(
+                devices[nic_cfg['dev_key']])
+            nic_spec.device.backing = vm_utils.copy_data_object(backing)
             relocate_spec.deviceChange.append(nic_spec)
-
         # disk device locat spec
-        for disk_cfg in relocate_config.get("disks_cfg", []):
-            ds_mor= utils.get_datastore_mor(disk_cfg['ds_moid'])
-            disk_loc_spec= vm_utils.make_disk_locator_spec(vm_mor,
-                                disk_cfg["dev_key"],
-                                ds_mor,
-                                disk_cfg.get("disk_type"))
-            relocate_spec.disk.append(disk_loc_spec)
+        for disk_cfg in disks_cfg:
+            if disk_cfg['dev_key'] not in devices:
+                raise Exception("The vm %s disk device %s not found!" %
+                                (vm_mor._moId, disk_cfg['dev_key']))
+            ds_mor = self._cached(cache, ('datastore', disk_cfg['ds_moid']),
+                                  self.get_datastore_mor, disk_cfg['ds_moid'])
+            relocate_spec.disk.append(vm_utils.make_disk_locator_spec(
+                devices[disk_cfg['dev_key']], ds_mor,
+                disk_cfg.get("disk_type")))
+        return relocate_spec
 
+    def check_vm_relocate(self, vm_moid, relocate_config):
+        """
+        Check vm relocate.
+
+        @param relocate_config: see relocate_vm
+        """
+        vm_mor = self.get_vm_mor(vm_moid)
+        relocate_spec = self._make_relocate_spec(vm_mor, relocate_config)
         check_result = self.checker.check_relocate(vm_mor, relocate_spec)
         return check_result
 
+    def check_vms_relocate(self, vms, test_type=None, timeout=None):
+        """
+        Check the relocation of many VMs, e.g. the pre-flight of
+        relocate_vms.
+
+        One CheckRelocate task checks a VM, the tasks of all VMs run at
+        once.
+        @param vms: [{"moid": "vm-10", "relocate_config": {...}}], see
+                    relocate_vm
+        @return: DataResult, data: {vm_moid: {host_moid: {"status": "",
+                 "msg": "", "warnings": [], "errors": []}}}
+        """
+        result = DataResult()
+        try:
+            vm_mors = [self._make_mor([vim.VirtualMachine], vm['moid'])
+                       for vm in vms]
+            found = self.retrieve_mors_properties(vm_mors,
+                                                  ['config.hardware.device'])
+            cache = {}
+            relocates = []
+            checks = {}
+            for vm in vms:
+                if vm['moid'] not in found:
+                    continue
+                props = found[vm['moid']]
+                try:
+                    relocate_spec = self._make_relocate_spec(
+                        props['mor'], vm['relocate_config'], cache,
+                        props['config.hardware.device'] or [])
+                except Exception as ex:
+                    LOG.exception(ex)
+                    check_result = checker.CheckResult()
+                    check_result.add_error(str(ex))
+                    checks[vm['moid']] = {None: check_result}
+                    continue
+                relocates.append((props['mor'], relocate_spec))
+            if relocates:
+                checks.update(self.checker.check_relocate_vms(
+                    relocates, test_type, timeout=timeout))
+            data = {}
+            for vm in vms:
+                vm_moid = vm['moid']
+                if vm_moid not in found:
+                    check_result = checker.CheckResult()
+                    check_result.add_error("Not found VM: %s" % vm_moid)
+                    checks[vm_moid] = {None: check_result}
+                data[vm_moid] = dict(
+                    (host_moid, dict(check_result)) for (host_moid, check_result)
+                    in checks.get(vm_moid, {}).items())
+            result.data = data
+        except Exception as ex:
+            LOG.exception(ex)
+            result.status = False
+            result.message = "Check vms relocate error: %s" % str(ex)
+        return result
+
     def relocate_vm(self, vm_moid, relocate_config, priority='defaultPriority'):
         """
         VM Storage vMotion.
 
-        @param relocate_config[
+        @param relocate_config: {
             'host_moid': "",
+            'cluster_moid': "",
             'ds_moid': "",
             'folder_moid': "",
-            'nic': ["dev_key": "", "pg_moid": ""],
-            'disk': ["dev_key": "", "ds_moid": "", "ds_type": ""],
-            ]
+            'nics_cfg': [{"dev_key": 4000, "pg_moid": ""}],
+            'disks_cfg': [{"dev_key": 2000, "ds_moid": "", "disk_type": ""}],
+            }
+        all optional
         """
         result= DataResult()
         try:
             vm_mor = self.get_vm_mor(vm_moid)
-            host_mor = self.get_host_mor(relocate_config.get('host_moid'))
-            cluster_mor = self.get_cluster_mor(relocate_config.get('cluster_moid'))
-            res_pool_mor = cluster_mor.resourcePool if cluster_mor else None
-            ds_mor = utils.get_datastore_mor(relocate_config.get('ds_moid'))
-            folder_mor = utils.get_folder_mor(relocate_config.get('folder_moid'))
-
-            relocate_spec = vim.vm.RelocateSpec()
-            relocate_spec.folder = folder_mor
-            relocate_spec.host = host_mor
-            relocate_spec.pool = res_pool_mor
-            relocate_spec.datastore = ds_mor
-
-            # nic device change spec
-            for nic_cfg in relocate_config.get("nics_cfg", []):
-                pg_mor = self.get_portgroup_mor(nic_cfg['pg_moid'])
-                nic_spec = vm_utils.make_edit_nic_device_spec(
-                    vm_mor, nic_cfg['dev_key'], pg_mor)
-                relocate_spec.deviceChange.append(nic_spec)
-
-            # disk device locat spec
-            for disk_cfg in relocate_config.get("disks_cfg", []):
-                ds_mor= utils.get_datastore_mor(disk_cfg['ds_moid'])
-                disk_loc_spec= vm_utils.make_disk_locator_spec(vm_mor, disk_cfg["dev_key"], ds_mor, disk_cfg.get("disk_type"))
-                relocate_spec.disk.append(disk_loc_spec)
-
+            relocate_spec = self._make_relocate_spec(vm_mor, relocate_config)
             priority = vim.VirtualMachine.MovePriority(priority)
 
             task_mor = vm_mor.Relocate(relocate_spec, priority)
@@ -811,3 +1630,228 @@ class VMClient(BaseClient):
             result.status = False
             result.message = "VM Storage vMotion error: %s" % str(ex)
         return result
+
+    def relocate_vms(self, vms, source_limit=None, dest_limit=None,
+                     max_running=None, timeout=None,
+                     priority='defaultPriority'):
+        """
+        Storage vMotion many VMs.
+
+        The VMs are read in one PropertyCollector call and moved largest
+        first (the layoutEx bytes copied), under per-source and
+        per-destination datastore limits so an array is drained without
+        saturating it; a move which does not fit the free space left on
+        its destination fails without starting.
+        @param vms: [{"moid": "vm-10", "relocate_config": {...}}], see
+                    relocate_vm
+        @param source_limit: max running moves per source datastore,
+                             default constants.SVMOTION_SOURCE_LIMIT
+        @param dest_limit: max running moves per destination datastore,
+                           default constants.SVMOTION_DESTINATION_LIMIT
+        @param max_running: max running moves in total, None unlimited
+        @return: DataResult, data: {"results": {vm_moid: DataResult},
+                 "bytes": 0, "seconds": 0, "bytes_per_second": 0}
+                 a VM DataResult data: {"bytes": 0, "seconds": 0,
+                 "bytes_per_second": 0}
+        """
+        vm_mors = [self._make_mor([vim.VirtualMachine], vm['moid'])
+                   for vm in vms]
+        vms_props = self.retrieve_mors_properties(
+            vm_mors, constants.RELOCATE_VM_PROPERTIES)
+        return self._relocate_vms(
+            [(vms_props.get(vm['moid']) or {'moid': vm['moid']},
+              vm['relocate_config']) for vm in vms],
+            source_limit, dest_limit, max_running, timeout, priority)
+
+    def _relocate_vms(self, moves, source_limit, dest_limit, max_running,
+                      timeout, priority):
+        """
+        Run the Storage vMotions of [(vm properties, relocate_config)].
+
+        A move is sized from the layoutEx bytes of the home and disks it
+        copies, pinned disks are left out. The free space of every
+        destination datastore is reserved by the moves planned before
+        (largest first), a move which does not fit fails without starting.
+        """
+        results = {}
+        sizes = {}
+        limits = {
+            'source': source_limit or constants.SVMOTION_SOURCE_LIMIT,
+            'destination': dest_limit or constants.SVMOTION_DESTINATION_LIMIT,
+        }
+        priority = vim.VirtualMachine.MovePriority(priority)
+        # resolved managed objects shared by the VMs
+        cache = {}
+        # datastore name: moid, of the VM homes
+        ds_mors = {}
+        for props, _ in moves:
+            for ds_mor in props.get('datastore') or []:
+                ds_mors[ds_mor._moId] = ds_mor
+        ds_moids = dict((name, moid) for (moid, name) in
+                        self.get_mors_names(list(ds_mors.values())).items())
+
+        planned = []
+        for props, relocate_config in moves:
+            vm_moid = props['moid']
+            result = results[vm_moid] = DataResult()
+            try:
+                if 'mor' not in props:
+                    raise Exception("Not found VM: %s" % vm_moid)
+                devices = props['config.hardware.device'] or []
+                relocate_spec = self._make_relocate_spec(
+                    props['mor'], relocate_config, cache, devices)
+                home_ds_name = datastore_utils.parse_datastore_path(
+                    props['config.files.vmPathName'])[0]
+                transfers = vm_utils.get_relocate_transfers(
+                    devices,
+                    vm_utils.get_layout_sizes(props['layoutEx.file'],
+                                              props['layoutEx.disk']),
+                    ds_moids.get(home_ds_name), relocate_spec)
+            except Exception as ex:
+                LOG.exception(ex)
+                result.status = False
+                result.message = "VM Storage vMotion error: %s" % str(ex)
+                continue
+            planned.append((props, relocate_spec, transfers))
+
+        dest_moids = set(dest for (_, _, transfers) in planned
+                         for (_, dest) in transfers)
+        free = dict((moid, ds_props['summary.freeSpace'] or 0)
+                    for (moid, ds_props) in self.retrieve_mors_properties(
+                        [self._make_mor([vim.Datastore], moid)
+                         for moid in dest_moids],
+                        ['summary.freeSpace']).items())
+        started = time.time()
+        with self.get_task_tracker() as tracker:
+            scheduler = scheduler_utils.TaskScheduler(tracker, limits,
+                                                      max_running)
+            planned.sort(key=lambda move: -sum(move[2].values()))
+            for props, relocate_spec, transfers in planned:
+                vm_moid = props['moid']
+                needs = {}
+                for ((_, dest), size) in transfers.items():
+                    needs[dest] = needs.get(dest, 0) + size
+                short = [dest for (dest, size) in needs.items()
+                         if size > free.get(dest, 0)]
+                if short:
+                    results[vm_moid].status = False
+                    results[vm_moid].message = (
+                        "VM Storage vMotion error: Not enough free space on "
+                        "datastore %s." % ', '.join(sorted(short)))
+                    continue
+                for (dest, size) in needs.items():
+                    free[dest] -= size
+                sizes[vm_moid] = sum(transfers.values())
+                resources = sorted(set(
+                    [('source', source) for (source, _) in transfers] +
+                    [('destination', dest) for (_, dest) in transfers]))
+                scheduler.submit(
+                    vm_moid,
+                    functools.partial(props['mor'].Relocate, relocate_spec,
+                                      priority),
+                    resources)
+
+            for vm_moid, task_info, error in scheduler.run(timeout):
+                result = results[vm_moid]
+                if task_info is not None:
+                    info = task_utils.task_info_json(task_info)
+                    result.task_key = info['key']
+                    error = info['error']
+                    if not error and info['startTime'] and \
+                            info['completeTime']:
+                        seconds = (info['completeTime'] -
+                                   info['startTime']).total_seconds()
+                        result.data = {
+                            "bytes": sizes[vm_moid],
+                            "seconds": seconds,
+                            "bytes_per_second":
+                            sizes[vm_moid] / seconds if seconds else 0,
+                        }
+                if error:
+                    result.status = False
+                    result.message = "VM Storage vMotion error: %s" % error
+        result = result_utils.aggregate_results(results)
+        seconds = time.time() - started
+        moved = sum(sizes[vm_moid] for (vm_moid, r) in results.items()
+                    if r.status and vm_moid in sizes)
+        result.data.update({
+            "bytes": moved,
+            "seconds": seconds,
+            "bytes_per_second": moved / seconds if seconds else 0,
+        })
+        return result
+
+    def evacuate_datastore(self, ds_moid, dest_ds_moids, source_limit=None,
+                           dest_limit=None, max_running=None, timeout=None,
+                           priority='defaultPriority'):
+        """
+        Storage vMotion all VMs off a datastore, see relocate_vms.
+
+        Only the VM homes and disks on the datastore move; every VM goes
+        to the destination datastore with the most free space left after
+        the VMs planned before it, largest first by the layoutEx bytes on
+        the datastore.
+        @param dest_ds_moids: ["datastore-2", "datastore-3"]
+        @return: see relocate_vms
+        """
+        result = DataResult()
+        try:
+            ds_mor = self.get_datastore_mor(ds_moid)
+            if not ds_mor:
+                raise Exception("Not found datastore: %s" % ds_moid)
+            ds_props = self.retrieve_mors_properties(
+                [ds_mor] + [self._make_mor([vim.Datastore], moid)
+                            for moid in dest_ds_moids],
+                ['name', 'vm', 'summary.freeSpace'])
+            if ds_moid not in ds_props:
+                raise Exception("Not found datastore: %s" % ds_moid)
+            free = dict((moid, ds_props[moid]['summary.freeSpace'] or 0)
+                        for moid in dest_ds_moids
+                        if moid in ds_props and moid != ds_moid)
+            if not free:
+                raise Exception("No destination datastore found.")
+            vms_props = self.retrieve_mors_properties(
+                ds_props[ds_moid]['vm'] or [],
+                constants.RELOCATE_VM_PROPERTIES)
+        except Exception as ex:
+            LOG.exception(ex)
+            result.status = False
+            result.message = "Evacuate datastore error: %s" % str(ex)
+            return result
+
+        planned = []
+        for props in vms_props.values():
+            disk_sizes, home_size = vm_utils.get_layout_sizes(
+                props['layoutEx.file'], props['layoutEx.disk'])
+            home_moves = datastore_utils.parse_datastore_path(
+                props['config.files.vmPathName'])[0] == \
+                ds_props[ds_moid]['name']
+            size = home_size if home_moves else 0
+            disks = []
+            for dev in props['config.hardware.device'] or []:
+                if not isinstance(dev, vim.vm.device.VirtualDisk):
+                    continue
+                disk_ds = getattr(dev.backing, 'datastore', None)
+                if disk_ds is None:
+                    continue
+                if disk_ds._moId == ds_moid:
+                    size += disk_sizes.get(dev.key, 0)
+                    disks.append((dev.key, None))
+                elif home_moves:
+                    # a disk without locator would follow the home
+                    disks.append((dev.key, disk_ds._moId))
+            planned.append((size, props, home_moves, disks))
+
+        moves = []
+        for (size, props, home_moves, disks) in sorted(
+                planned, key=lambda move: -move[0]):
+            dest_moid = max(free, key=lambda moid: free[moid])
+            free[dest_moid] -= size
+            relocate_config = {"disks_cfg": [
+                {"dev_key": dev_key, "ds_moid": disk_ds_moid or dest_moid}
+                for (dev_key, disk_ds_moid) in disks]}
+            if home_moves:
+                relocate_config['ds_moid'] = dest_moid
+            moves.append((props, relocate_config))
+        return self._relocate_vms(moves, source_limit, dest_limit,
+                                  max_running, timeout, priority)